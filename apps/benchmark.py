@@ -52,8 +52,11 @@
 #
 # In all cases the time reported is measured from the moment when the
 # operands are ready until all the results are ready.
+#
+# The vector_mul operation multiplies share vectors of --vector-length
+# elements instead, so running it with different lengths shows how the
+# throughput grows when the elements share messages and callbacks.
 
-import sys
 import time
 from math import log
 from optparse import OptionParser
@@ -96,16 +99,14 @@ else:
 from benchutil import (SelfcontainedBenchmarkStrategy,
                        NeededDataBenchmarkStrategy,
                        ParallelBenchmark, SequentialBenchmark,
-                       BinaryOperation, NullaryOperation)
-
-# Hack in order to avoid Maximum recursion depth exceeded
-# exception;
-sys.setrecursionlimit(5000)
+                       BinaryOperation, NullaryOperation,
+                       VectorBinaryOperation)
 
 
 last_timestamp = time.time()
 
 operations = {"mul"       : ("mul", [], BinaryOperation),
+              "vector_mul": ("vector_mul", [], VectorBinaryOperation),
               "compToft05": ("greater_than_equal",
                              [ComparisonToft05Mixin], BinaryOperation),
               "compToft07": ("greater_than_equal",
@@ -147,6 +148,8 @@ parser.add_option("-p", "--parallel", action="store_true",
                   help="execute operations in parallel")
 parser.add_option("-s", "--sequential", action="store_false", dest="parallel",
                   help="execute operations in sequence")
+parser.add_option("--vector-length", type="int",
+                  help="number of elements in each vector for vector_mul")
 parser.add_option("-f", "--fake", action="store_true",
                   help="skip local computations using fake field elements")
 parser.add_option("--args", type="string",
@@ -166,6 +169,7 @@ parser.add_option("--pc", type="string",
 parser.set_defaults(modulus=2**65, threshold=1, count=10,
                     runtime="PassiveRuntime", mixins="", num_players=2, prss=True,
                     operation="mul", parallel=True, fake=False,
+                    vector_length=100,
                     args="", needed_data="")
 
 print "*" * 64
@@ -262,7 +266,8 @@ else:
 print "Using the Benchmark bases:"
 for b in bases:
     print "- %s" % b.__name__
-benchmark = type("ExtendedBenchmark", bases, {})
+benchmark = type("ExtendedBenchmark", bases,
+                 {"vector_length": options.vector_length})
 
 def do_benchmark(runtime, operation, benchmark, field, count, *args):
     benchmark(runtime, operation, field, count).benchmark(*args)
@@ -270,5 +275,12 @@ def do_benchmark(runtime, operation, benchmark, field, count, *args):
 pre_runtime.addCallback(do_benchmark, operation, benchmark,
                         Zp, count, needed_data, options.pc)
 
+def give_up(failure):
+    # Most likely the --ready-timeout expired.
+    print "Error: %s" % failure.getErrorMessage()
+    reactor.stop()
+
+pre_runtime.addErrback(give_up)
+
 print "#### Starting reactor ###"
 reactor.run()
@@ -21,25 +21,52 @@ from pprint import pformat
 
 from twisted.internet.defer import gatherResults
 
-from viff.runtime import gather_shares
+from viff.netem import EmulatedTransport
+from viff.runtime import gather_shares, gather_vector
 from viff.utils.util import rand
 
 start = 0
+start_bytes = 0
 
 
-def record_start(what):
-    global start
+def sent_bytes(rt):
+    """Return the number of bytes sent to other players by *rt*."""
+    return sum([p.sent_bytes for peer_id, p in rt.protocols.iteritems()
+                if peer_id != rt.id])
+
+
+def emulated_round_trip(rt):
+    """Return the largest emulated round trip time in seconds to the
+    other players, or None if the network is not emulated."""
+    times = [p.transport.round_trip_time()
+             for peer_id, p in rt.protocols.iteritems()
+             if peer_id != rt.id and isinstance(p.transport, EmulatedTransport)]
+    if times:
+        return max(times)
+    return None
+
+
+def record_start(what, rt):
+    global start, start_bytes
     start = time.time()
+    start_bytes = sent_bytes(rt)
     print "*" * 64
     print "Started", what
 
 
-def record_stop(x, what, count):
+def record_stop(x, what, count, rt):
     stop = time.time()
     print
     print "Total time used: %.3f sec" % (stop-start)
     print "Time per %s operation: %.0f ms" % (what, 1000*(stop-start) / count)
     print "Throughput: %d per second" % (count / (stop-start))
+    print "Bytes sent per %s operation: %.0f" % \
+          (what, (sent_bytes(rt) - start_bytes) / float(count))
+    round_trip = emulated_round_trip(rt)
+    if round_trip:
+        print "Emulated round trips: %.1f in total, %.3f per %s operation" \
+              % ((stop-start) / round_trip,
+                 (stop-start) / round_trip / count, what)
     print "*" * 64
     return x
 
@@ -63,9 +90,10 @@ class Benchmark(object):
         print "Preprocess", needed_data
         if needed_data:
             print "Starting preprocessing"
-            record_start("preprocessing")
+            record_start("preprocessing", self.rt)
             preproc = self.rt.preprocess(needed_data)
-            preproc.addCallback(record_stop, "preprocessing", self.count)
+            preproc.addCallback(record_stop, "preprocessing", self.count,
+                                self.rt)
             return preproc
         else:
             print "Need no preprocessing"
@@ -108,16 +136,16 @@ class ParallelBenchmark(Benchmark):
     def run_test(self, shares):
         # print "rt", self.rt.program_counter, self.pc
         if self.pc is not None:
-            self.rt.program_counter = self.pc
+            self.rt.program_counter = tuple(self.pc)
         else:
-            self.pc = list(self.rt.program_counter)
+            self.pc = self.rt.program_counter
         c_shares = []
-        record_start("parallel test")
+        record_start("parallel test", self.rt)
         while not self.is_operation_done():
             c_shares.append(self.do_operation())
 
         done = gatherResults(c_shares)
-        done.addCallback(record_stop, "parallel test", self.count)
+        done.addCallback(record_stop, "parallel test", self.count, self.rt)
         def f(x):
             needed_data = self.rt._needed_data
             self.rt._needed_data = {}
@@ -131,7 +159,7 @@ class SequentialBenchmark(Benchmark):
     other."""
 
     def run_test(self, _, termination_function, d):
-        record_start("sequential test")
+        record_start("sequential test", self.rt)
         self.single_operation(None, termination_function)
 
     def single_operation(self, _, termination_function):
@@ -139,7 +167,7 @@ class SequentialBenchmark(Benchmark):
             c = self.do_operation()
             self.rt.schedule_callback(c, self.single_operation, termination_function)
         else:
-            record_stop(None, "sequential test", self.count)
+            record_stop(None, "sequential test", self.count, self.rt)
             self.finished(None, termination_function)
 
 
@@ -200,6 +228,22 @@ class BinaryOperation(Operation):
         return self.operation(a, b)
 
 
+class VectorBinaryOperation(BinaryOperation):
+    """A binary operation on share vectors.
+
+    The shares are gathered into vectors of :attr:`vector_length`
+    elements, so the throughput is still measured per element."""
+
+    #: Number of elements in each vector.
+    vector_length = 1
+
+    def do_operation(self):
+        length = min(self.vector_length, len(self.a_shares))
+        a = [self.a_shares.pop() for _ in range(length)]
+        b = [self.b_shares.pop() for _ in range(length)]
+        return self.operation(gather_vector(a), gather_vector(b))
+
+
 class NullaryOperation(Operation):
     """A nullary operation."""
 
@@ -31,6 +31,7 @@ import viff.reactor
 viff.reactor.install()
 from twisted.internet import reactor
 
+from viff.circuit import run
 from viff.math.field import GF
 from viff.runtime import Runtime, create_runtime
 from viff.mixins.comparison import Toft07Runtime
@@ -57,12 +58,19 @@ def eval_poly(runtime):
         b = runtime.shamir_share([1], Zp)
         c = runtime.shamir_share([1], Zp)
 
+    if options.circuit:
+        # Trace the protocol and run it layer by layer.
+        output = run(runtime, poly_sign, x, a, b, c)
+    else:
+        output = poly_sign(runtime, x, a, b, c)
+    output.addCallback(done, start_time, runtime)
+
+def poly_sign(runtime, x, a, b, c):
     # Evaluate the polynomial.
     p = a * (x * x) + b * x + c
 
     sign = (p < 0) * -1 + (p > 0) * 1
-    output = runtime.open(sign)
-    output.addCallback(done, start_time, runtime)
+    return runtime.open(sign)
 
 def done(sign, start_time, runtime):
     print "Sign: %s" % sign
@@ -71,6 +79,9 @@ def done(sign, start_time, runtime):
 
 # Parse command line arguments.
 parser = OptionParser()
+parser.add_option("--circuit", action="store_true",
+                  help="trace the protocol and batch each layer")
+parser.set_defaults(circuit=False)
 Runtime.add_options(parser)
 options, args = parser.parse_args()
 
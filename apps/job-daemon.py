@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+
+# Copyright 2009 VIFF Development Team.
+#
+# This file is part of VIFF, the Virtual Ideal Functionality Framework.
+#
+# VIFF is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License (LGPL) as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# VIFF is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Lesser General
+# Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with VIFF. If not, see <http://www.gnu.org/licenses/>.
+
+# This program runs a player as a long-lived service. It connects to
+# the other players once and then runs the jobs submitted to it with
+# submit-job.py until it is told to shut down. The job functions are
+# taken from the FUNCTIONS dictionary of a module, by default the
+# example module jobs.py. Start the players with
+#
+#   ./job-daemon.py player-1.ini
+#   ./job-daemon.py player-2.ini
+#   ./job-daemon.py player-3.ini
+#
+# and submit the same job to each of them with its own input:
+#
+#   ./submit-job.py --job-port 10001 1 total 10
+#   ./submit-job.py --job-port 10002 1 total 20
+#   ./submit-job.py --job-port 10003 1 total 30
+
+from optparse import OptionParser
+
+import viff.reactor
+
+viff.reactor.install()
+from twisted.internet import reactor
+
+from viff.config import load_config
+from viff.runtime import Runtime, create_runtime
+from viff.runtimes.active import ActiveRuntime
+from viff.service import Service, listen_for_jobs
+
+parser = OptionParser(usage="Usage: %prog [options] config_file")
+parser.add_option("--job-port", type="int",
+                  help="accept jobs on this port (default 10000 + player ID)")
+parser.add_option("--jobs", metavar="MODULE",
+                  help="module with the FUNCTIONS of the jobs")
+parser.add_option("--max-jobs", type="int",
+                  help="run at most this many jobs at a time")
+parser.add_option("--preprocess", action="store_true",
+                  help=("preprocess the data of the jobs of a function "
+                        "learned from its first job"))
+parser.add_option("--active", action="store_true",
+                  help="use the actively secure runtime")
+parser.set_defaults(job_port=None, jobs="jobs", max_jobs=None,
+                    preprocess=False, active=False)
+
+Runtime.add_options(parser)
+options, args = parser.parse_args()
+
+if len(args) != 1:
+    parser.error("you must specify a config file")
+
+id, players = load_config(args[0])
+functions = __import__(options.jobs).FUNCTIONS
+if options.job_port is None:
+    options.job_port = 10000 + id
+
+if options.active:
+    runtime_class = ActiveRuntime
+    threshold = (len(players) - 1) // 3
+else:
+    runtime_class = None
+    threshold = (len(players) - 1) // 2
+
+
+def start_service(runtime):
+    service = Service(runtime, functions, options.max_jobs,
+                      options.preprocess)
+    listen_for_jobs(service, options.job_port)
+    reactor.addSystemEventTrigger("after", "shutdown",
+                                  service.print_statistics)
+    print "Accepting jobs on port %d" % options.job_port
+
+pre_runtime = create_runtime(id, players, threshold, options, runtime_class)
+pre_runtime.addCallback(start_service)
+
+reactor.run()
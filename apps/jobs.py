@@ -0,0 +1,41 @@
+# Copyright 2009 VIFF Development Team.
+#
+# This file is part of VIFF, the Virtual Ideal Functionality Framework.
+#
+# VIFF is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License (LGPL) as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# VIFF is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Lesser General
+# Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with VIFF. If not, see <http://www.gnu.org/licenses/>.
+
+# Example jobs for job-daemon.py. Every player inputs a number and
+# the jobs return the sum or the product of the inputs.
+
+import operator
+
+from viff.math.field import GF
+from viff.utils.util import find_prime
+
+Zp = GF(find_prime(2**64))
+
+
+def share_inputs(runtime, value):
+    return runtime.shamir_share(sorted(runtime.players), Zp, value)
+
+
+def total(runtime, value):
+    return runtime.open(reduce(operator.add, share_inputs(runtime, value)))
+
+
+def product(runtime, value):
+    return runtime.open(reduce(operator.mul, share_inputs(runtime, value)))
+
+
+FUNCTIONS = {"total": total, "product": product}
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+
+# Copyright 2009 VIFF Development Team.
+#
+# This file is part of VIFF, the Virtual Ideal Functionality Framework.
+#
+# VIFF is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License (LGPL) as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# VIFF is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Lesser General
+# Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with VIFF. If not, see <http://www.gnu.org/licenses/>.
+
+# This program runs benchmark.py for all players on this machine with
+# an emulated network of increasing latency and prints how the time
+# per operation and the throughput develop. Arguments after "--" are
+# passed on to benchmark.py. Example:
+#
+#   ./latency-sweep.py -l 0,10,50 player-*.ini -- --no-ssl -c 100
+
+import os
+import re
+import subprocess
+import sys
+import tempfile
+from optparse import OptionParser
+
+parser = OptionParser(usage="%prog [options] config... [-- benchmark options]")
+parser.add_option("-l", "--latencies", metavar="MS,...",
+                  help="comma separated one-way latencies in milliseconds")
+parser.set_defaults(latencies="0,5,10,20,50,100")
+
+if "--" in sys.argv:
+    split = sys.argv.index("--")
+    argv, extra = sys.argv[1:split], sys.argv[split + 1:]
+else:
+    argv, extra = sys.argv[1:], []
+options, configs = parser.parse_args(argv)
+if not configs:
+    parser.error("you must specify the player config files")
+
+benchmark = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         "benchmark.py")
+patterns = {"time": r"Time per (?!preprocessing).* operation: (\d+) ms",
+            "throughput": r"Throughput: (\d+) per second",
+            "round trips": r"Emulated round trips: .*, ([\d.]+) per"}
+
+print "%10s %12s %14s %20s" % ("latency", "time (ms)", "throughput",
+                               "round trips per op")
+for latency in options.latencies.split(","):
+    players = []
+    for config in configs:
+        args = [sys.executable, benchmark, "--net-latency", latency] + \
+            extra + [config]
+        # Files instead of pipes, a player must never block on its
+        # output while the others wait for it.
+        output = tempfile.TemporaryFile()
+        players.append((subprocess.Popen(args, stdout=output,
+                                          stderr=subprocess.STDOUT), output))
+    outputs = []
+    for player, output in players:
+        player.wait()
+        output.seek(0)
+        outputs.append(output.read())
+
+    # The last test reported by the first player is used.
+    results = {}
+    for name, pattern in patterns.iteritems():
+        matches = re.findall(pattern, outputs[0])
+        results[name] = matches and matches[-1] or "-"
+    print "%10s %12s %14s %20s" % (latency, results["time"],
+                                   results["throughput"],
+                                   results["round trips"])
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+
+# Copyright 2009 VIFF Development Team.
+#
+# This file is part of VIFF, the Virtual Ideal Functionality Framework.
+#
+# VIFF is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License (LGPL) as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# VIFF is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Lesser General
+# Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with VIFF. If not, see <http://www.gnu.org/licenses/>.
+
+# This program measures the memory used by shares. It creates a
+# number of shares in three states: pending without callbacks,
+# pending with one callback (like a share waiting for a peer), and
+# with a value. The memory is read from /proc, so this only works on
+# systems like Linux. Example:
+#
+#   ./memory-benchmark.py -n 1000000
+
+import gc
+from optparse import OptionParser
+
+from viff.math.field import GF
+from viff.runtime import Share
+from viff.utils.util import find_prime, memory_usage
+
+
+class FakeRuntime:
+    """The shares only need something to refer to."""
+
+    share_kinds = {}
+
+
+def pending(runtime, field, i):
+    return Share(runtime, field)
+
+
+def waiting(runtime, field, i):
+    share = Share(runtime, field)
+    share.addCallback(lambda x: x)
+    return share
+
+
+def resolved(runtime, field, i):
+    return Share(runtime, field, field(i))
+
+
+parser = OptionParser()
+parser.add_option("-n", "--count", type="int",
+                  help="number of shares of each kind")
+parser.set_defaults(count=1000000)
+options, args = parser.parse_args()
+
+runtime = FakeRuntime()
+Zp = GF(find_prime(2**64))
+
+# Creating many objects triggers many useless collections.
+gc.disable()
+for name, make in [("pending", pending), ("waiting", waiting),
+                   ("resolved", resolved)]:
+    before = memory_usage()["rss"]
+    shares = [make(runtime, Zp, i) for i in xrange(options.count)]
+    after = memory_usage()["rss"]
+    print "%-10s %8.1f MiB %8.1f bytes per share" % \
+        (name, (after - before) / 1024.0,
+         (after - before) * 1024.0 / options.count)
+    del shares
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+
+# Copyright 2009 VIFF Development Team.
+#
+# This file is part of VIFF, the Virtual Ideal Functionality Framework.
+#
+# VIFF is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License (LGPL) as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# VIFF is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Lesser General
+# Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with VIFF. If not, see <http://www.gnu.org/licenses/>.
+
+# This program measures the cost of the zero-timeout polls made by
+# Runtime.activate_reactor for each of the VIFF reactors. A number of
+# idle connections, one per emulated peer, are registered with the
+# reactor, and one of them has data waiting, just like a player in
+# the middle of a computation. The select based reactor cannot handle
+# descriptors beyond FD_SETSIZE (usually 1024). Example:
+#
+#   ./reactor-benchmark.py -p 2,10,100 -n 10000
+
+import socket
+import time
+from optparse import OptionParser
+
+from viff.reactor import ViffReactor
+
+try:
+    from viff.epollreactor import EPollViffReactor
+except ImportError:
+    EPollViffReactor = None
+
+
+class Reader:
+    """An idle connection which is never read from."""
+
+    def __init__(self, sock):
+        self.sock = sock
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def doRead(self):
+        pass
+
+    def logPrefix(self):
+        return "Reader"
+
+
+def measure(reactor_class, peers, count):
+    """Return the seconds per poll of a *reactor_class* with *peers*
+    connections."""
+    reactor = reactor_class()
+    pairs = [socket.socketpair() for _ in range(peers)]
+    for a, b in pairs:
+        reactor.addReader(Reader(a))
+    # One peer has data waiting which is left unread, so every poll
+    # finds a ready descriptor.
+    pairs[0][1].send("x")
+
+    start = time.time()
+    for _ in xrange(count):
+        reactor.poll()
+    stop = time.time()
+
+    reactor.removeAll()
+    reactor.waker.connectionLost(None)
+    for a, b in pairs:
+        a.close()
+        b.close()
+    return (stop - start) / count
+
+
+parser = OptionParser()
+parser.add_option("-p", "--peers", metavar="N,...",
+                  help="comma separated numbers of connections")
+parser.add_option("-n", "--count", type="int",
+                  help="number of polls for each measurement")
+parser.set_defaults(peers="2,10,100,400", count=10000)
+options, args = parser.parse_args()
+
+reactors = [("select", ViffReactor)]
+if EPollViffReactor is not None:
+    reactors.append(("epoll", EPollViffReactor))
+
+print "%8s" % "peers" + "".join(["%14s" % ("%s (us)" % name)
+                                 for name, _ in reactors])
+for peers in map(int, options.peers.split(",")):
+    times = [measure(cls, peers, options.count) for _, cls in reactors]
+    print "%8d" % peers + "".join(["%14.1f" % (t * 1e6) for t in times])
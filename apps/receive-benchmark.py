@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+
+# Copyright 2009 VIFF Development Team.
+#
+# This file is part of VIFF, the Virtual Ideal Functionality Framework.
+#
+# VIFF is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License (LGPL) as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# VIFF is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Lesser General
+# Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with VIFF. If not, see <http://www.gnu.org/licenses/>.
+
+# This program measures how fast a ShareExchanger can parse incoming
+# packets. No network or reactor is involved: a block of packets is
+# produced by one ShareExchanger and fed repeatedly to another one,
+# in reads of a fixed size, just like a transport would do it.
+#
+# Example:
+#
+#   ./receive-benchmark.py -n 1000000 --pc-length 6
+
+import time
+from optparse import OptionParser
+
+from twisted.test.proto_helpers import StringTransport
+
+from viff.math.field import GF
+from viff.runtime import Runtime, ShareExchanger
+from viff.utils.util import find_prime
+
+
+class FakeRuntime:
+    """Just enough of a runtime for a :class:`ShareExchanger`."""
+
+    def __init__(self, id, options):
+        self.id = id
+        self.options = options
+        self.operation = None
+        self.traffic = {}
+
+    def handle_deferred_data(self, deferred, data):
+        deferred.callback(data)
+
+
+class FakeFactory:
+
+    def __init__(self, runtime):
+        self.runtime = runtime
+
+    def identify_peer(self, protocol):
+        pass
+
+
+def make_exchanger(id, options):
+    exchanger = ShareExchanger()
+    exchanger.factory = FakeFactory(FakeRuntime(id, options))
+    exchanger.makeConnection(StringTransport())
+    return exchanger
+
+
+def transfer(sender, receiver):
+    data = sender.transport.value()
+    sender.transport.clear()
+    receiver.dataReceived(data)
+
+
+parser = OptionParser()
+parser.add_option("-n", "--count", type="int",
+                  help="number of packets to receive")
+parser.add_option("--block", type="int",
+                  help="number of packets in the repeated block")
+parser.add_option("--read-size", type="int",
+                  help="bytes handed to dataReceived at a time")
+parser.add_option("--pc-length", type="int",
+                  help="length of the program counters")
+parser.set_defaults(count=1000000, block=10000, read_size=65536,
+                    pc_length=6)
+Runtime.add_options(parser)
+options, args = parser.parse_args()
+
+sender = make_exchanger(1, options)
+receiver = make_exchanger(2, options)
+transfer(sender, receiver)
+transfer(receiver, sender)
+print "Features: %s" % (", ".join(sorted(receiver.features)) or "none")
+
+# The program counters of a block start with a fresh first
+# component, so the block can be received any number of times.
+Zp = GF(find_prime(2**64))
+for i in range(options.block):
+    pc = (i % 2, 1, 2) + tuple(range(i, i + options.pc_length - 3))
+    sender.sendShare(pc[:options.pc_length], Zp(i))
+sender.flush()
+block = sender.transport.value()
+sender.transport.clear()
+reads = [block[i:i + options.read_size]
+         for i in range(0, len(block), options.read_size)]
+
+print "Block: %d packets, %d bytes (%.1f bytes per packet)" % \
+    (options.block, len(block), float(len(block)) / options.block)
+
+repeat = max(1, options.count // options.block)
+start = time.time()
+for _ in xrange(repeat):
+    for data in reads:
+        receiver.dataReceived(data)
+    receiver.incoming_data.clear()
+stop = time.time()
+
+packets = repeat * options.block
+print "Received %d packets in %.3f sec" % (packets, stop - start)
+print "Packets per second: %d" % (packets / (stop - start))
+print "MB per second: %.1f" % (repeat * len(block) / (stop - start) / 2**20)
@@ -59,8 +59,9 @@ from twisted.internet import reactor
 
 from progressbar import ProgressBar, Percentage, Bar, ETA, ProgressBarWidget
 
+from viff.circuit import trace
 from viff.math.field import GF
-from viff.runtime import Runtime, create_runtime, gather_shares
+from viff.runtime import Runtime, Share, create_runtime, gather_shares
 from viff.mixins.comparison import Toft07Runtime
 from viff.config import load_config
 from viff.utils.util import find_prime, rand, dprint
@@ -75,8 +76,11 @@ parser.add_option("-m", "--max", type="int",
                   help="maximum size of array numbers")
 parser.add_option("-t", "--test", action="store_true",
                   help="run doctests on this file")
+parser.add_option("--circuit", action="store_true",
+                  help="trace the sorting network and batch each layer")
 
-parser.set_defaults(modulus=2**65, size=8, max=100, test=False)
+parser.set_defaults(modulus=2**65, size=8, max=100, test=False,
+                    circuit=False)
 
 Runtime.add_options(parser)
 
@@ -110,10 +114,18 @@ class Protocol:
         self.comparisons = 0
 
         array = self.make_array()
-        sorted = self.sort(array)
+        if options.circuit:
+            # Trace the sorting network and run it layer by layer,
+            # with the comparisons of each stage started together.
+            circuit, inputs = trace(runtime, self.sort_and_open, array)
+            self.comparisons = len([node for node in circuit.nodes
+                                    if node.op == "greater_than_equal"])
+            sorted = circuit.execute(runtime, inputs)
+        else:
+            sorted = self.sort_and_open(runtime, array)
 
         array = gather_shares(map(runtime.open, array))
-        sorted = gather_shares(map(runtime.open, sorted))
+        sorted = gather_shares(sorted)
 
         self.progressbar.start()
 
@@ -168,6 +180,9 @@ class Protocol:
             array.append(share)
         return array
 
+    def sort_and_open(self, runtime, array):
+        return map(runtime.open, self.sort(array))
+
     def sort(self, array):
         # Make a shallow copy -- the algorithm wont be in-place anyway
         # since we create lots of new Shares as we go along.
@@ -205,7 +220,9 @@ class Protocol:
                 return a + b - 2*a*b
 
             le = array[i] <= array[j] # a deferred
-            le.addCallback(tick_progressbar)
+            if isinstance(le, Share):
+                # There is nothing to wait for while tracing.
+                le.addCallback(tick_progressbar)
 
             # We must swap array[i] and array[j] when they sort in the
             # wrong direction, that is, when ascending is True and
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+
+# Copyright 2009 VIFF Development Team.
+#
+# This file is part of VIFF, the Virtual Ideal Functionality Framework.
+#
+# VIFF is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License (LGPL) as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# VIFF is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Lesser General
+# Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with VIFF. If not, see <http://www.gnu.org/licenses/>.
+
+# This program submits a job to a job-daemon.py running on this
+# machine and prints the result. Example:
+#
+#   ./submit-job.py --job-port 10001 1 total 10
+#
+# The inputs are parsed as integers. With --statistics the statistics
+# of the service are printed instead, and with --shutdown the service
+# is shut down.
+
+import json
+from optparse import OptionParser
+
+from twisted.internet import reactor
+
+from viff.service import connect_service
+
+parser = OptionParser(usage="Usage: %prog [options] job_id function [input...]")
+parser.add_option("--job-port", type="int",
+                  help="port of the service")
+parser.add_option("--host", help="host of the service")
+parser.add_option("--statistics", action="store_true",
+                  help="print the statistics of the service")
+parser.add_option("--shutdown", action="store_true",
+                  help="shut the service down")
+parser.set_defaults(job_port=10001, host="localhost", statistics=False,
+                    shutdown=False)
+options, args = parser.parse_args()
+
+if not (options.statistics or options.shutdown) and len(args) < 2:
+    parser.error("you must specify a job ID and a function")
+
+
+def submit(client):
+    if options.statistics:
+        result = client.service_statistics()
+        result.addCallback(lambda stats: json.dumps(stats, indent=2,
+                                                    sort_keys=True))
+    elif options.shutdown:
+        result = client.shutdown()
+        result.addCallback(lambda _: "Shutting down")
+    else:
+        job_id = int(args[0])
+        result = client.submit(job_id, args[1], *map(int, args[2:]))
+
+        def report(value):
+            stats = client.statistics[job_id]
+            return "Result: %s\nLatency: %.3f sec (%.3f sec running)" % \
+                (value, stats["latency"], stats["run"])
+        result.addCallback(report)
+    return result
+
+
+def done(output):
+    print output
+    reactor.stop()
+
+
+def failed(failure):
+    print "Error:", failure.getErrorMessage()
+    reactor.stop()
+
+result = connect_service(options.job_port, options.host)
+result.addCallback(submit)
+result.addCallbacks(done, failed)
+
+reactor.run()
@@ -77,7 +77,7 @@ that an operation starts as soon as the operands are ready.
         'Topic :: Software Development :: Libraries :: Application Frameworks',
         'Topic :: Software Development :: Libraries :: Python Modules'
         ],
-      requires=['twisted', 'gmpy']
+      requires=['twisted (>=20.3.0, <21.0)', 'gmpy']
       )
 
 # When releasing VIFF, notify these sites:
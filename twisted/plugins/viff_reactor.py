@@ -19,3 +19,5 @@
 # can install it.
 from twisted.application.reactors import Reactor
 viff = Reactor('viff', 'viff.reactor', 'The re-entrent VIFF reactor.')
+viff_epoll = Reactor('viff-epoll', 'viff.epollreactor',
+                     'The VIFF reactor based on epoll.')
@@ -37,27 +37,11 @@ def add_macs(runtime, field, u_bound, alpha, random, paillier, partial_shares):
     runtime.increment_pc() # Huh!?
 
     def do_add_macs(partial_share_contents, result_shares):
-        """The transmission_restraint_constant is the number of
-        encrypted shares we can safely transmit in one call to
-        sendData. The sendData method can only transmit up to
-        65536 bytes.
-        The constant has been imperically determined by running
-        TripleGenerator.generate_triples.
-        TODO: How can we allow a user of the runtime to adjust this
-        constraint at a higher level of abstraction?
-        """
-        transmission_restraint_constant = 50
-        
         num_players = runtime.num_players
 
-        list_of_player_to_enc_shares_lists = []
-        
         player_to_mac_keys = [ [] for x in runtime.players]
         player_to_enc_shares = [ [] for x in runtime.players]
-        for inx, partial_share_content in enumerate(partial_share_contents):
-            if inx % transmission_restraint_constant == 0:
-                player_to_enc_shares = [ [] for x in runtime.players]
-                list_of_player_to_enc_shares_lists.append(player_to_enc_shares)
+        for partial_share_content in partial_share_contents:
             for j in xrange(num_players):
                 # TODO: This is probably not the fastes way to generate
                 # the betas.
@@ -71,20 +55,12 @@ def add_macs(runtime, field, u_bound, alpha, random, paillier, partial_shares):
                 player_to_enc_shares[j].append(c)
                 player_to_mac_keys[j].append(field(beta))
 
-        received_cs = []
-        for ls in list_of_player_to_enc_shares_lists:
-            received_cs.append(_send(runtime, ls, deserialize=eval))
-
-        def merge(received_cs):
-            r = [ [] for x in xrange(len(received_cs[0]))]
-            for ls in received_cs:
-                for inx, xs in enumerate(ls):
-                    r[inx] += xs
-            return r
+        # Large messages are split into packets by the ShareExchanger,
+        # so all the encrypted shares for a player go in one message.
+        received_cs = _send(runtime, player_to_enc_shares, deserialize=eval)
 
         def finish_sharing(recevied_cs, partial_share_contents,
                            lists_of_mac_keys, result_shares):
-            recevied_cs = merge(recevied_cs)
             shares = []               
             for inx in xrange(0, len(partial_share_contents)):
                 mac_keys = []
@@ -102,7 +78,7 @@ def add_macs(runtime, field, u_bound, alpha, random, paillier, partial_shares):
                                         mac_msg_list))
             return shares
 
-        runtime.schedule_callback(gatherResults(received_cs),
+        runtime.schedule_callback(received_cs,
                                   finish_sharing,
                                   partial_share_contents,
                                   player_to_mac_keys,
@@ -26,6 +26,7 @@ from viff.math.field import FieldElement
 from viff.mixins.hash_broadcast import HashBroadcastMixin
 from viff.runtime import Share, gather_shares
 from viff.utils.constants import TEXT
+from viff.utils.util import operation
 
 
 class BeDOZaException(Exception):
@@ -40,6 +41,7 @@ class BeDOZaMixin(HashBroadcastMixin, ShareGenerator):
     def output(self, share, receivers=None):
         return self.open(share, receivers)
 
+    @operation
     def open_multiple_values(self, shares, receivers=None):
         """Share reconstruction of a list of shares."""
         assert shares
@@ -94,7 +96,8 @@ class BeDOZaMixin(HashBroadcastMixin, ShareGenerator):
                     message_string += "%s:%s;" % \
                            (beDOZaContents.get_value().value,
                             beDOZaContents.get_mac(other_id - 1).value)
-                self.protocols[other_id].sendData(pc, TEXT, message_string)
+                self.protocols[other_id].sendData(pc, TEXT, message_string,
+                                                  self)
 
             if self.id in receivers:
                 def deserialize(s):
@@ -125,6 +128,7 @@ class BeDOZaMixin(HashBroadcastMixin, ShareGenerator):
         if self.id in receivers:
             return result
 
+    @operation
     def open_two_values(self, share_a, share_b, receivers=None):
         """Share reconstruction of a list of shares."""
         assert isinstance(share_a, Share)
@@ -179,10 +183,12 @@ class BeDOZaMixin(HashBroadcastMixin, ShareGenerator):
             # Send share to all receivers.
             pc = tuple(self.program_counter)
             for other_id in receivers:
-                self.protocols[other_id].sendShare(pc, a.get_value())
-                self.protocols[other_id].sendShare(pc, a.get_mac(other_id - 1))
-                self.protocols[other_id].sendShare(pc, b.get_value())
-                self.protocols[other_id].sendShare(pc, b.get_mac(other_id - 1))
+                self.protocols[other_id].sendShare(pc, a.get_value(), self)
+                self.protocols[other_id].sendShare(pc, a.get_mac(other_id - 1),
+                                                   self)
+                self.protocols[other_id].sendShare(pc, b.get_value(), self)
+                self.protocols[other_id].sendShare(pc, b.get_mac(other_id - 1),
+                                                   self)
                 
             if self.id in receivers:
                 num_players = len(self.players.keys())
@@ -210,6 +216,7 @@ class BeDOZaMixin(HashBroadcastMixin, ShareGenerator):
         if self.id in receivers:
             return result
 
+    @operation
     def open(self, share, receivers=None):
         """Share reconstruction."""
         assert isinstance(share, Share)
@@ -253,9 +260,9 @@ class BeDOZaMixin(HashBroadcastMixin, ShareGenerator):
             pc = tuple(self.program_counter)
             for other_id in receivers:
                 self.protocols[other_id].sendShare(
-                    pc, shareContent.get_value())
+                    pc, shareContent.get_value(), self)
                 self.protocols[other_id].sendShare(
-                    pc, shareContent.get_mac(other_id - 1))
+                    pc, shareContent.get_mac(other_id - 1), self)
             if self.id in receivers:
                 num_players = len(self.players.keys())
                 values = num_players * [None]
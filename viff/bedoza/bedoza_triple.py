@@ -249,23 +249,7 @@ class TripleGenerator(object):
         Returns a deferred which will yield a list of field elements.
         """
         CKIND = 1
- 
-        """The transmission_restraint_constant is the number of
-        encrypted shares we can safely transmit in one call to
-        sendData. The sendData method can only transmit up to
-        65536 bytes.
-        The constant has been imperically determined by running
-        TripleGenerator.generate_triples.
-        TODO: How can we allow a user of the runtime to adjust this
-        constraint at a higher level of abstraction?
 
-        """
-        transmission_restraint_constant = 425
-
-        number_of_packets = n / transmission_restraint_constant
-        if n % transmission_restraint_constant != 0:
-            number_of_packets += 1
-        
         self.runtime.increment_pc()
 
         pc = tuple(self.runtime.program_counter)
@@ -274,31 +258,26 @@ class TripleGenerator(object):
         zis = []
         if self.runtime.id == inx:
             Nj_square = self.paillier.get_modulus_square(jnx)
-            all_cs = []
-            for iny, (ai, cj) in enumerate(zip(ais, cjs)):
-                if iny % transmission_restraint_constant == 0:
-                    cs = []
-                    all_cs.append(cs)
+            cs = []
+            for ai, cj in zip(ais, cjs):
                 u = rand.randint(0, self.u_bound)
                 Ej_u = self.paillier.encrypt(u, jnx)
                 cs.append( (fast_pow(cj, ai.value, Nj_square) * Ej_u) % Nj_square )
                 zi = self.Zp(-u)
                 zis.append(zi)
-                
-            for cs in all_cs:
-                self.runtime.protocols[jnx].sendData(pc, CKIND, str(cs))
+
+            # Large messages are split into packets by the
+            # ShareExchanger, so all ciphertexts go in one message.
+            self.runtime.protocols[jnx].sendData(pc, CKIND, str(cs),
+                                                 self.runtime)
 
         if self.runtime.id == jnx:
-            all_cs = []
-            for _ in xrange(number_of_packets):
-                cs = Deferred()
-                self.runtime._expect_data(inx, CKIND, cs)
-                all_cs.append(cs)
-                
-            def decrypt(all_cs, pc, zis):
+            cs = Deferred()
+            self.runtime._expect_data(inx, CKIND, cs)
+
+            def decrypt(cs, pc, zis):
                 zjs = []
-                cs = reduce(lambda x, y: x + eval(y), all_cs, [])
-                for iny, c in enumerate(cs):
+                for c in eval(cs):
                     t = self.paillier.decrypt(c)
                     zj = self.Zp(t)
                     zjs.append(zj)
@@ -306,9 +285,8 @@ class TripleGenerator(object):
                     return [x + y for x, y in zip(zis, zjs)]
                 else:
                     return zjs 
-            all_cs_d = gatherResults(all_cs)
-            all_cs_d.addCallback(decrypt, pc, zis)
-            deferred = all_cs_d
+            cs.addCallback(decrypt, pc, zis)
+            deferred = cs
         else:
             zis_deferred = Deferred()
             zis_deferred.callback(zis)
@@ -33,7 +33,7 @@ def _send(runtime, vals, serialize=str, deserialize=int):
     pc = tuple(runtime.program_counter)
     for p in runtime.players:
         msg = serialize(vals[p - 1])
-        runtime.protocols[p].sendData(pc, TEXT, msg)
+        runtime.protocols[p].sendData(pc, TEXT, msg, runtime)
     def err_handler(err):
         print err
     values = []
@@ -0,0 +1,378 @@
+# Copyright 2009 VIFF Development Team.
+#
+# This file is part of VIFF, the Virtual Ideal Functionality Framework.
+#
+# VIFF is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License (LGPL) as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# VIFF is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Lesser General
+# Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with VIFF. If not, see <http://www.gnu.org/licenses/>.
+
+"""Tracing of protocols into circuits. A protocol written for the
+runtime normally runs eagerly: each operation is started as soon as
+it is called, and the runtime never sees more than one operation at
+a time. Tracing instead runs the protocol on a :class:`Tracer`, which
+stands in for the runtime and records the operations in a
+:class:`Circuit`. The circuit is then executed layer by layer, where
+all multiplications and all openings of a layer are done as one
+:class:`~viff.runtime.ShareVector` operation each::
+
+  def poly(runtime, x, a, b, c):
+      return runtime.open(a * (x * x) + b * x + c)
+
+  result = run(runtime, poly, x, a, b, c)
+
+A protocol which is traced must not look at the values of the shares
+or add callbacks to them, since there are no values while tracing.
+Arguments which are shares (or lists and tuples of shares) become
+the inputs of the circuit, and the result of the protocol may
+likewise be a share or a list or tuple of shares.
+"""
+
+import operator
+
+from viff.math.field import GF256
+from viff.runtime import Share, gather_vector, split_vector
+
+#: Operations which always need communication. Multiplications need
+#: communication when both operands are shares.
+_INTERACTIVE = ("open", "greater_than_equal", "equal")
+
+#: Operations done locally, by the operators of :class:`Share`.
+_LOCAL = {"add": operator.add, "sub": operator.sub, "mul": operator.mul}
+
+
+class Node(object):
+    """An operation in a :class:`Circuit`.
+
+    The *args* are other nodes or constants. The *level* is the
+    number of layers of interactive operations the node depends on,
+    including itself.
+    """
+
+    __slots__ = ("op", "args", "field", "params", "interactive", "level")
+
+    def __init__(self, op, args, field, params=None):
+        self.op = op
+        self.args = args
+        self.field = field
+        self.params = params
+
+        nodes = [arg for arg in args if isinstance(arg, Node)]
+        if op == "mul":
+            self.interactive = len(nodes) == 2
+        else:
+            self.interactive = op in _INTERACTIVE
+        self.level = max([0] + [node.level for node in nodes])
+        if self.interactive:
+            self.level += 1
+
+    def __repr__(self):
+        return "<Node %s at level %d>" % (self.op, self.level)
+
+
+class Circuit(object):
+    """A traced protocol.
+
+    The nodes are kept in the order they were recorded, which is a
+    topological order. The *inputs* are the input nodes and the
+    *outputs* are the nodes of the result, in the structure the
+    protocol returned them.
+    """
+
+    def __init__(self):
+        self.nodes = []
+        self.inputs = []
+        self.outputs = None
+
+    def add_node(self, op, args, field, params=None):
+        """Record a new node and return it."""
+        node = Node(op, args, field, params)
+        self.nodes.append(node)
+        return node
+
+    def depth(self):
+        """Return the number of layers of interactive operations."""
+        return max([0] + [node.level for node in self.nodes])
+
+    def layers(self):
+        """Return the nodes grouped by level.
+
+        The result is a list with a pair of lists for each level: the
+        interactive nodes of the level and the local nodes of the
+        level. The local nodes may depend on the interactive nodes of
+        their level, but the interactive nodes only depend on nodes
+        of lower levels.
+        """
+        layers = [([], []) for _ in range(self.depth() + 1)]
+        for node in self.nodes:
+            interactive, local = layers[node.level]
+            if node.interactive:
+                interactive.append(node)
+            else:
+                local.append(node)
+        return layers
+
+    def execute(self, runtime, inputs):
+        """Execute the circuit with *runtime* on the *inputs* shares.
+
+        The interactive nodes of each layer are grouped by operation
+        and field. The multiplications of a group are done with one
+        :meth:`vector_mul` and the openings with one
+        :meth:`vector_open`, so each takes one message to each player.
+        Comparisons have no vector version and are started together.
+
+        Returns the result of the protocol with shares in place of
+        the output nodes.
+        """
+        assert len(inputs) == len(self.inputs), \
+            "Wrong number of inputs for the circuit."
+        values = dict(zip(self.inputs, inputs))
+
+        def value(arg):
+            if isinstance(arg, Node):
+                return values[arg]
+            return arg
+
+        for interactive, local in self.layers():
+            for op, nodes in _group(interactive):
+                args = [map(value, node.args) for node in nodes]
+                if op == "mul" and hasattr(runtime, "vector_mul"):
+                    a = gather_vector([x for x, _ in args])
+                    b = gather_vector([y for _, y in args])
+                    results = split_vector(runtime.vector_mul(a, b))
+                elif op == "mul":
+                    results = [runtime.mul(x, y) for x, y in args]
+                elif op == "open":
+                    receivers, threshold = nodes[0].params
+                    vector = gather_vector([x for x, in args])
+                    opened = runtime.vector_open(vector, receivers, threshold)
+                    if opened is None:
+                        results = [None] * len(nodes)
+                    else:
+                        results = split_vector(opened)
+                else:
+                    method = getattr(runtime, op)
+                    results = [method(*node_args) for node_args in args]
+                values.update(zip(nodes, results))
+
+            for node in local:
+                if node.op != "input":
+                    values[node] = _LOCAL[node.op](*map(value, node.args))
+
+        return _map(value, self.outputs, Node)
+
+
+def _group(nodes):
+    """Group the interactive *nodes* of a layer by operation, field
+    and parameters.
+
+    The groups are returned as ``(op, nodes)`` pairs in the order they
+    are first met, so all players make the same calls in the same
+    order.
+    """
+    groups = {}
+    order = []
+    for node in nodes:
+        key = (node.op, node.field, node.params)
+        if key not in groups:
+            groups[key] = []
+            order.append(key)
+        groups[key].append(node)
+    return [(key[0], groups[key]) for key in order]
+
+
+def _map(func, obj, cls):
+    """Apply *func* to the instances of *cls* in *obj*, which may be
+    nested in lists and tuples."""
+    if isinstance(obj, cls):
+        return func(obj)
+    if isinstance(obj, (list, tuple)):
+        return type(obj)([_map(func, item, cls) for item in obj])
+    return obj
+
+
+class Wire(object):
+    """A symbolic share, the output of a :class:`Node`.
+
+    Wires have the arithmetic and comparison operators of
+    :class:`~viff.runtime.Share`, which call back to the
+    :class:`Tracer` to record the operations.
+    """
+
+    __slots__ = ("runtime", "node")
+
+    def __init__(self, runtime, node):
+        self.runtime = runtime
+        self.node = node
+
+    @property
+    def field(self):
+        return self.node.field
+
+    def __add__(self, other):
+        """Addition."""
+        return self.runtime.add(self, other)
+
+    def __radd__(self, other):
+        """Addition (reflected argument version)."""
+        return self.runtime.add(self, other)
+
+    def __sub__(self, other):
+        """Subtraction."""
+        return self.runtime.sub(self, other)
+
+    def __rsub__(self, other):
+        """Subtraction (reflected argument version)."""
+        return self.runtime.sub(other, self)
+
+    def __mul__(self, other):
+        """Multiplication."""
+        return self.runtime.mul(self, other)
+
+    def __rmul__(self, other):
+        """Multiplication (reflected argument version)."""
+        return self.runtime.mul(self, other)
+
+    def __pow__(self, exponent):
+        """Exponentation to known integer exponents."""
+        return self.runtime.pow(self, exponent)
+
+    def __xor__(self, other):
+        """Exclusive-or."""
+        return self.runtime.xor(self, other)
+
+    def __rxor__(self, other):
+        """Exclusive-or (reflected argument version)."""
+        return self.runtime.xor(self, other)
+
+    def __lt__(self, other):
+        """Strictly less-than comparison."""
+        return 1 - self.runtime.greater_than_equal(self, other)
+
+    def __le__(self, other):
+        """Less-than or equal comparison."""
+        return self.runtime.greater_than_equal(other, self)
+
+    def __gt__(self, other):
+        """Strictly greater-than comparison."""
+        return 1 - self.runtime.greater_than_equal(other, self)
+
+    def __ge__(self, other):
+        """Greater-than or equal comparison."""
+        return self.runtime.greater_than_equal(self, other)
+
+    def __eq__(self, other):
+        """Equality testing."""
+        return self.runtime.equal(self, other)
+
+
+class Tracer(object):
+    """Stand-in for a runtime which records a protocol in a
+    :class:`Circuit`.
+
+    The operations on shares are recorded, while other attributes,
+    such as :attr:`id` and :attr:`players`, are those of the real
+    *runtime*.
+    """
+
+    def __init__(self, runtime):
+        self.runtime = runtime
+        self.circuit = Circuit()
+
+    def __getattr__(self, name):
+        return getattr(self.runtime, name)
+
+    def input(self, field):
+        """Return a wire for a new input of the circuit."""
+        node = self.circuit.add_node("input", (), field)
+        self.circuit.inputs.append(node)
+        return Wire(self, node)
+
+    def _record(self, op, args, params=None):
+        field = [arg.field for arg in args if isinstance(arg, Wire)][0]
+        args = tuple([_map(lambda wire: wire.node, arg, Wire)
+                      for arg in args])
+        return Wire(self, self.circuit.add_node(op, args, field, params))
+
+    def add(self, share_a, share_b):
+        return self._record("add", (share_a, share_b))
+
+    def sub(self, share_a, share_b):
+        return self._record("sub", (share_a, share_b))
+
+    def mul(self, share_a, share_b):
+        return self._record("mul", (share_a, share_b))
+
+    def pow(self, share, exponent):
+        """Exponentation by square-and-multiply, as in
+        :meth:`~viff.runtimes.passive.PassiveRuntime.pow`."""
+        assert isinstance(exponent, (int, long)), "Exponent must be an integer"
+        assert exponent >= 0, "Exponent must be non-negative"
+
+        if exponent == 0:
+            return 1
+        elif exponent % 2 == 0:
+            tmp = share ** (exponent / 2)
+            return tmp * tmp
+        else:
+            return share * (share ** (exponent - 1))
+
+    def xor(self, share_a, share_b):
+        if share_a.field is GF256:
+            return share_a + share_b
+        else:
+            return share_a + share_b - 2 * share_a * share_b
+
+    def open(self, share, receivers=None, threshold=None):
+        if receivers is not None:
+            receivers = tuple(receivers)
+        wire = self._record("open", (share,), (receivers, threshold))
+        if receivers is None or self.id in receivers:
+            return wire
+
+    def output(self, share, receivers=None, threshold=None):
+        return self.open(share, receivers, threshold)
+
+    def greater_than_equal(self, share_a, share_b):
+        return self._record("greater_than_equal", (share_a, share_b))
+
+    def equal(self, share_a, share_b):
+        return self._record("equal", (share_a, share_b))
+
+
+def trace(runtime, function, *args):
+    """Trace ``function(runtime, *args)`` into a :class:`Circuit`.
+
+    The shares among the *args* become the inputs of the circuit.
+    Returns the circuit and the list of these shares, ready for
+    :meth:`Circuit.execute`.
+    """
+    tracer = Tracer(runtime)
+    inputs = []
+
+    def make_input(share):
+        inputs.append(share)
+        return tracer.input(share.field)
+
+    args = _map(make_input, args, Share)
+    result = function(tracer, *args)
+    tracer.circuit.outputs = _map(lambda wire: wire.node, result, Wire)
+    return tracer.circuit, inputs
+
+
+def run(runtime, function, *args):
+    """Trace ``function(runtime, *args)`` and execute the circuit.
+
+    Returns the result of the protocol, computed with all the
+    multiplications and openings of each layer batched.
+    """
+    circuit, inputs = trace(runtime, function, *args)
+    return circuit.execute(runtime, inputs)
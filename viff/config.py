@@ -30,6 +30,7 @@ function to generate a player config and save it in a number of
 """
 
 from viff.libs.configobj import ConfigObj
+from viff.netem import SETTINGS
 from viff.shares.prf import PRF
 from viff.shares.prss import generate_subsets
 from viff.utils import paillier_util
@@ -51,6 +52,9 @@ class Player:
         self.dealer_keys = dealer_keys
         self.prfs_cache = {}
         self.dealers_cache = {}
+        #: Settings for the emulated network link to this player,
+        #: see :mod:`viff.netem`.
+        self.network = {}
 
     def prfs(self, modulus):
         """Retrieve PRSS PRFs.
@@ -168,6 +172,10 @@ def load_config(source):
         else:
             players[id] = Player(id, host, port, pubkey)
 
+        for name in SETTINGS:
+            if name in config[player]:
+                players[id].network[name] = float(config[player][name])
+
     return owner_id, players
 
 
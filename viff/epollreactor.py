@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright 2009 VIFF Development Team.
+#
+# This file is part of VIFF, the Virtual Ideal Functionality Framework.
+#
+# VIFF is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License (LGPL) as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# VIFF is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Lesser General
+# Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with VIFF. If not, see <http://www.gnu.org/licenses/>.
+
+"""VIFF reactor based on epoll.
+
+This module is kept apart from :mod:`viff.reactor` since importing
+it fails on platforms without epoll."""
+
+from twisted.internet.epollreactor import EPollReactor
+
+from viff.reactor import ViffReactorMixin
+
+
+class EPollViffReactor(ViffReactorMixin, EPollReactor):
+    """VIFF reactor based on epoll."""
+
+    base = EPollReactor
+
+
+def install():
+    """Use the epoll based VIFF reactor."""
+    reactor = EPollViffReactor()
+    from twisted.internet.main import installReactor
+    installReactor(reactor)
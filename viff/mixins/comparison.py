@@ -26,7 +26,7 @@ from viff.math.field import GF256, FieldElement
 from viff.runtime import Share, gather_shares
 from viff.runtimes.active import ActiveRuntime
 from viff.runtimes.passive import PassiveRuntime
-from viff.utils.util import rand, profile
+from viff.utils.util import rand, profile, operation
 
 
 class ComparisonToft05Mixin:
@@ -63,6 +63,7 @@ class ComparisonToft05Mixin:
 
         return int_b, bit_bits
 
+    @operation
     @profile
     def greater_than_equal(self, share_a, share_b):
         """Compute ``share_a >= share_b``.
@@ -181,6 +182,7 @@ class ComparisonToft07Mixin:
         full_mask = reduce(self.add, dst_shares)
         return tmp - full_mask
 
+    @operation
     @profile
     def greater_than_equal_preproc(self, field, smallField=None):
         """Preprocessing for :meth:`greater_than_equal`."""
@@ -235,6 +237,7 @@ class ComparisonToft07Mixin:
         # Preprocessing done
         ##################################################
 
+    @operation
     @profile
     def greater_than_equal_online(self, share_a, share_b, preproc, field):
         """Compute ``share_a >= share_b``. Result is secret shared."""
@@ -308,6 +311,7 @@ class ComparisonToft07Mixin:
 
     # END _finish_greater_than
 
+    @operation
     def greater_than_equal(self, share_a, share_b):
         """Compute ``share_a >= share_b``.
 
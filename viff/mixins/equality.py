@@ -20,11 +20,14 @@
 is mixed with.
 """
 
+from viff.utils.util import operation
+
 
 class ProbabilisticEqualityMixin:
     """This class implements probabilistic constant-round secure
     equality-testing of secret shared numbers."""
 
+    @operation
     def equal(self, share_x, share_y):
         """Equality testing with secret shared result.
 
@@ -24,6 +24,7 @@ try:
 except ImportError:
     from sha import sha as sha1
 from viff.utils.constants import TEXT, INCONSISTENTHASH, OK, HASH
+from viff.utils.util import operation
 
 from twisted.internet.defer import gatherResults
 
@@ -45,7 +46,7 @@ class HashBroadcastMixin:
 
     def _send_message(self, pc, sender, receivers, message):
         for peer_id in receivers:
-            self.protocols[peer_id].sendData(pc, TEXT, message)
+            self.protocols[peer_id].sendData(pc, TEXT, message, self)
 
     def _receive_broadcast(self, pc, unique_pc, sender, receivers):
 
@@ -54,7 +55,7 @@ class HashBroadcastMixin:
             h = sha1(m).hexdigest()
             # Send the hash to all receivers.
             for peer_id in receivers:
-                self.protocols[peer_id].sendData(unique_pc, HASH, str(h))
+                self.protocols[peer_id].sendData(unique_pc, HASH, str(h), self)
             return m, h
 
         # Set up receiver for hashes.
@@ -83,6 +84,7 @@ class HashBroadcastMixin:
         r.addCallback(combine)
         return r
 
+    @operation
     def broadcast(self, senders, receivers, message=None):
         """Broadcast the messeage from senders to receivers.
 
@@ -114,9 +116,8 @@ class HashBroadcastMixin:
         if self.id in receivers:
             for x in xrange(len(senders)):
                 sender = senders[x]
-                new_pc = list(self.program_counter)
-                new_pc.append(x)
-                results[x] = self._receive_broadcast(pc, tuple(new_pc), sender, receivers)
+                new_pc = pc + (x,)
+                results[x] = self._receive_broadcast(pc, new_pc, sender, receivers)
 
         if self.id in senders and self.id not in receivers:
             d = Deferred()
@@ -0,0 +1,187 @@
+# Copyright 2009 VIFF Development Team.
+#
+# This file is part of VIFF, the Virtual Ideal Functionality Framework.
+#
+# VIFF is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License (LGPL) as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# VIFF is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Lesser General
+# Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with VIFF. If not, see <http://www.gnu.org/licenses/>.
+
+"""Emulation of slow network links. This makes it possible to
+predict how a protocol performs on a wide area network by running
+all players on a single machine.
+
+An :class:`EmulatedTransport` wraps the transport of a
+:class:`~viff.runtime.ShareExchanger` and delays the bytes written to
+it. Each player delays the data it sends, so the settings of a link
+describe one direction. Emulation is enabled with the ``--net-*``
+options of the runtime (use ``--net-latency 0`` to only use per-link
+settings) and the settings can be overridden per link in the player
+configuration file::
+
+  [Player 2]
+    host = localhost
+    port = 9002
+    latency = 50
+    bandwidth = 2000
+
+The *latency* and *jitter* are in milliseconds, the *bandwidth* is in
+kilobits per second and *reorder* is a probability.
+
+Data is always delivered in order, since that is what TCP
+guarantees. A reordered segment is instead modelled the way TCP
+experiences it: it arrives one latency late and holds up the data
+sent after it.
+"""
+
+from collections import deque
+from random import Random
+
+#: Names of the link settings, see :meth:`EmulatedTransport.configure`.
+SETTINGS = ("latency", "jitter", "bandwidth", "reorder")
+
+
+def link_settings(options):
+    """Return the link settings given by the runtime *options*, or
+    an empty dictionary if no emulation was asked for."""
+    settings = {}
+    for name in SETTINGS:
+        value = getattr(options, "net_" + name, None)
+        if value is not None:
+            settings[name] = value
+    return settings
+
+
+class EmulatedTransport(object):
+    """Transport wrapper which delays the data written to it.
+
+    Attributes not defined here are looked up on the wrapped
+    transport, so this can be used in its place. The delays are
+    scheduled with *clock*, which defaults to the reactor.
+    """
+
+    #: Number of delayed bytes which makes us pause the producer,
+    #: like the write buffer of a Twisted transport.
+    bufferSize = 2**16
+
+    def __init__(self, transport, clock=None, **settings):
+        if clock is None:
+            from twisted.internet import reactor as clock
+        self.transport = transport
+        self.clock = clock
+        self.latency = 0
+        self.jitter = 0
+        self.bandwidth = None
+        self.reorder = 0
+        self.configure(**settings)
+        #: Bytes written but not yet delivered.
+        self.backlog = 0
+        self.producer = None
+        self.producerPaused = False
+        self._queue = deque()
+        self._calls = deque()
+        self._link_free = 0.0
+        self._last_delivery = 0.0
+        self._closing = False
+        self._random = Random()
+
+    def configure(self, latency=None, jitter=None, bandwidth=None,
+                  reorder=None):
+        """Change the settings of the link. Settings which are not
+        given keep their current value."""
+        if latency is not None:
+            self.latency = float(latency) / 1000
+        if jitter is not None:
+            self.jitter = float(jitter) / 1000
+        if bandwidth is not None:
+            # Kilobits per second to bytes per second.
+            self.bandwidth = float(bandwidth) * 1000 / 8
+        if reorder is not None:
+            self.reorder = float(reorder)
+
+    def round_trip_time(self):
+        """Return the round trip time in seconds assuming that the
+        link is symmetric and idle."""
+        return 2 * self.latency
+
+    def write(self, data):
+        if not data:
+            return
+        now = self.clock.seconds()
+        # The link sends one write at a time at the given bandwidth.
+        sent = max(now, self._link_free)
+        if self.bandwidth:
+            sent += len(data) / self.bandwidth
+        self._link_free = sent
+
+        delay = self.latency
+        if self.jitter:
+            delay += self._random.uniform(0, self.jitter)
+        if self.reorder and self._random.random() < self.reorder:
+            delay += self.latency
+        # Never deliver before the data written earlier.
+        arrival = max(sent + delay, self._last_delivery)
+        self._last_delivery = arrival
+
+        self._queue.append(data)
+        self.backlog += len(data)
+        self._calls.append(self.clock.callLater(arrival - now,
+                                                self._deliver))
+        if self.producer is not None and not self.producerPaused \
+                and self.backlog > self.bufferSize:
+            self.producerPaused = True
+            self.producer.pauseProducing()
+
+    def writeSequence(self, iovec):
+        self.write("".join(iovec))
+
+    def _deliver(self):
+        # Calls scheduled for the same time may fire in any order, but
+        # the data is always taken from the front of the queue.
+        calls = self._calls
+        while calls and not calls[0].active():
+            calls.popleft()
+        data = self._queue.popleft()
+        self.backlog -= len(data)
+        self.transport.write(data)
+        if self._queue:
+            return
+        if self.producerPaused:
+            self.producerPaused = False
+            self.producer.resumeProducing()
+        if self._closing:
+            self.transport.loseConnection()
+
+    def loseConnection(self):
+        """Close the connection when the delayed data is delivered."""
+        if self._queue:
+            self._closing = True
+        else:
+            self.transport.loseConnection()
+
+    def registerProducer(self, producer, streaming):
+        self.producer = producer
+
+    def unregisterProducer(self):
+        self.producer = None
+
+    def cancel(self):
+        """Forget the data not yet delivered. Called when the
+        connection is lost."""
+        for call in self._calls:
+            if call.active():
+                call.cancel()
+        self._calls.clear()
+        self._queue.clear()
+        self.backlog = 0
+
+    def __getattr__(self, name):
+        return getattr(self.transport, name)
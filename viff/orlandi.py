@@ -34,7 +34,7 @@ from viff.mixins.hash_broadcast import HashBroadcastMixin
 from viff.runtime import Share, gather_shares
 from viff.runtimes.paillier import encrypt_r, decrypt
 from viff.utils.constants import TEXT, PAILLIER
-from viff.utils.util import rand
+from viff.utils.util import rand, operation
 
 try:
     from pypaillier import encrypt_r, decrypt, tripple_2c, tripple_3a
@@ -119,10 +119,10 @@ class OrlandiMixin(HashBroadcastMixin):
     def _send_orlandi_share(self, other_id, pc, xi, rhoi, Cx):
         """Send the share *xi*, *rhoi*, and the commitment *Cx* to
         party *other_id*."""
-        self.protocols[other_id].sendShare(pc, xi)
-        self.protocols[other_id].sendShare(pc, rhoi[0])
-        self.protocols[other_id].sendShare(pc, rhoi[1])
-        self.protocols[other_id].sendData(pc, TEXT, repr(Cx))
+        self.protocols[other_id].sendShare(pc, xi, self)
+        self.protocols[other_id].sendShare(pc, rhoi[0], self)
+        self.protocols[other_id].sendShare(pc, rhoi[1], self)
+        self.protocols[other_id].sendData(pc, TEXT, repr(Cx), self)
 
     def _expect_orlandi_share(self, peer_id, field):
         """Waits for a number ``x``, ``rho``, and the commitment for
@@ -143,6 +143,7 @@ class OrlandiMixin(HashBroadcastMixin):
         sls.addCallbacks(combine, self.error_handler)
         return sls
 
+    @operation
     def secret_share(self, inputters, field, number=None):
         """Share the value *number* among all the parties using
         additive sharing.
@@ -213,6 +214,7 @@ class OrlandiMixin(HashBroadcastMixin):
             return results[0]
         return results
 
+    @operation
     def open(self, share, receivers=None):
         """Share reconstruction.
 
@@ -277,6 +279,7 @@ class OrlandiMixin(HashBroadcastMixin):
         if self.id in receivers:
             return result
 
+    @operation
     def open_two_values(self, share_a, share_b, receivers=None):
         """Share reconstruction of two shares."""
         assert isinstance(share_a, Share)
@@ -344,6 +347,7 @@ class OrlandiMixin(HashBroadcastMixin):
         if self.id in receivers:
             return result
 
+    @operation
     def open_multiple_values(self, shares, receivers=None):
         """Share reconstruction.
 
@@ -532,6 +536,7 @@ class OrlandiMixin(HashBroadcastMixin):
         Cz = Cx / Cy
         return (zi, (rhozi1, rhozi2), Cz)
 
+    @operation
     def input(self, inputters, field, number=None):
         """Input *number* to the computation.
 
@@ -540,6 +545,7 @@ class OrlandiMixin(HashBroadcastMixin):
         return self.shift(inputters, field, number)
 
 
+    @operation
     def shift(self, inputters, field, number=None):
         """Shift of a share.
 
@@ -648,6 +654,7 @@ class OrlandiMixin(HashBroadcastMixin):
             exp *= j
         return x, (rho1, rho2), Cx
 
+    @operation
     def leak_tolerant_mul(self, share_x, share_y, M):
         """Leak tolerant multiplication of shares.
 
@@ -768,6 +775,7 @@ class OrlandiMixin(HashBroadcastMixin):
 
         return result
 
+    @operation
     def triple_gen(self, field):
         """Generate a triple ``Tripel(a, b, c)`` s.t. ``c = a * b``.
 
@@ -888,7 +896,8 @@ class OrlandiMixin(HashBroadcastMixin):
                 
                 # Broadcast gamma_ij
                 if pi != self.id:
-                    self.protocols[pi].sendData(pc, PAILLIER, str(gammaij))
+                    self.protocols[pi].sendData(pc, PAILLIER, str(gammaij),
+                                                self)
                     d = Deferred()
                     d.addCallbacks(lambda value: long(value), self.error_handler)
                     self._expect_data(pi, PAILLIER, d)
@@ -984,6 +993,7 @@ class OrlandiMixin(HashBroadcastMixin):
 
         return result
 
+    @operation
     def random_triple(self, field, quantity=1):
         """Generate a list of triples ``Triple(a, b, c)`` where ``c = a * b``.
 
@@ -1051,7 +1061,7 @@ class OrlandiMixin(HashBroadcastMixin):
                 return gatherResults([xi, rho1, rho2, Cx])
 
             def send_long(player_id, pc, l):
-                self.protocols[player_id].sendData(pc, TEXT, str(l))
+                self.protocols[player_id].sendData(pc, TEXT, str(l), self)
 
             def receive_long(player_id):
                 l = Deferred()
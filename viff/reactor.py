@@ -19,35 +19,96 @@
 
 """VIFF reactor to have control over the scheduling."""
 
+import os
+
 from twisted.internet.selectreactor import SelectReactor
 
 
-class ViffReactor(SelectReactor):
-    """VIFF reactor.
+class ViffReactorMixin:
+    """Scheduling hooks shared by the VIFF reactors.
+
+    The difference to the plain reactor given by :attr:`base` is the
+    loop call, which is made around every iteration of the main loop,
+    and :meth:`poll`. The runtime uses the loop call to run the
+    callbacks of the data received, and :meth:`poll` to do network
+    I/O while the callbacks run. Polling never makes the loop call,
+    so the reactor is never entered recursively."""
 
-    The only difference to the SelectReactor is the loop call.
-    From there, doIteration() can be called recursively."""
+    #: The Twisted reactor class doing the actual I/O.
+    base = None
 
     def __init__(self):
-        SelectReactor.__init__(self)
+        self.base.__init__(self)
         self.loopCall = lambda: None
-   
+        #: True while :meth:`poll` is running.
+        self.polling = False
+
     def setLoopCall(self, f):
         self.loopCall = f
 
     def doIteration(self, t):
-        # Do the same as in mainLoop() first.
-        self.runUntilCurrent()
-        t2 = self.timeout()
+        # A poll() from a timed call may have left work for the loop
+        # call, which must not wait for the I/O below.
+        self.loopCall()
+        # The loop call may have scheduled calls, which the timeout
+        # computed before it does not cover.
+        t = self.running and self.timeout()
+        self.base.doIteration(self, t)
+        self.loopCall()
 
-        if t2 is not None:
-            t = min(t, self.running and t2)
+    def poll(self):
+        """Do the pending network I/O and run the timed calls which
+        are due, without waiting. Calls made while polling return
+        at once."""
+        if self.polling:
+            return
+        self.polling = True
+        try:
+            self.runUntilCurrent()
+            self.base.doIteration(self, 0)
+        finally:
+            self.polling = False
+
+
+class ViffReactor(ViffReactorMixin, SelectReactor):
+    """VIFF reactor based on :func:`select.select`."""
+
+    base = SelectReactor
 
-        SelectReactor.doIteration(self, t)
-        self.loopCall()
 
-def install():
+def install_viff():
     """Use the VIFF reactor."""
     reactor = ViffReactor()
     from twisted.internet.main import installReactor
     installReactor(reactor)
+
+
+def install_epoll():
+    """Use the VIFF reactor based on epoll.
+
+    Unlike :class:`ViffReactor`, the cost of an iteration does not
+    grow with the number of connections, and it is not limited to
+    ``FD_SETSIZE`` descriptors. This is only available on Linux."""
+    from viff.epollreactor import install
+    install()
+
+
+#: The available backends, see :func:`install`.
+backends = {"viff": install_viff,
+            "epoll": install_epoll}
+
+
+def install(backend=None):
+    """Install the reactor for the given *backend*.
+
+    If *backend* is not given, it is read from the ``VIFF_REACTOR``
+    environment variable and defaults to ``"viff"``. This lets all
+    applications pick the backend without being changed."""
+    if backend is None:
+        backend = os.environ.get("VIFF_REACTOR", "viff")
+    try:
+        install_backend = backends[backend]
+    except KeyError:
+        raise ValueError("Unknown reactor backend: %r (choose from %s)"
+                         % (backend, ", ".join(sorted(backends))))
+    install_backend()
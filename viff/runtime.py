@@ -31,27 +31,124 @@ scheduling things correctly behind the scenes.
 """
 from __future__ import division
 
+import cPickle
+import json
+import marshal
+import multiprocessing
 import os
+import socket
 import struct
-import sys
+import tempfile
+from binascii import hexlify, unhexlify
 import time
+import zlib
 from collections import deque
 from optparse import OptionParser, OptionGroup
 
 from twisted.internet import reactor
 from twisted.internet.defer import Deferred, DeferredList, gatherResults
-from twisted.internet.defer import maybeDeferred
-from twisted.internet.error import ConnectionDone, CannotListenError
+from twisted.internet.defer import maybeDeferred, fail
+from twisted.internet.error import ConnectionDone, ConnectionLost
+from twisted.internet.error import CannotListenError, TimeoutError
 from twisted.internet.protocol import ReconnectingClientFactory, ServerFactory
 from twisted.internet.task import LoopingCall
 from twisted.protocols.basic import Int16StringReceiver
+from twisted.python.failure import Failure
 
 import viff.reactor
+from viff.netem import EmulatedTransport, link_settings
 from viff.math.field import GF256, FieldElement
-from viff.utils.constants import SHARE
+from viff.utils import constants
+from viff.utils.constants import SHARE, TEXT, PAILLIER, SHARE_VECTOR
+from viff.utils.constants import BATCH, HELLO, BINARY_SHARE, CHUNK, COMPRESSED
+from viff.utils.constants import SHARE_BATCH
 from viff.utils.util import wrapper, rand, track_memory_usage, begin, end
 
 
+class ShareKind(object):
+    """The runtime and field of a :class:`Share`.
+
+    All shares with the same runtime and field refer to one instance,
+    see :func:`share_kind`, which saves two attributes per share."""
+
+    __slots__ = ("runtime", "field")
+
+    def __init__(self, runtime, field):
+        self.runtime = runtime
+        self.field = field
+
+
+#: Share kinds of the objects without a :attr:`Runtime.share_kinds`,
+#: keyed by runtime and field.
+_share_kinds = {}
+
+
+def share_kind(runtime, field):
+    """Return the :class:`ShareKind` of *runtime* and *field*."""
+    kinds = getattr(runtime, "share_kinds", None)
+    if kinds is None:
+        kinds = _share_kinds
+        key = (runtime, field)
+    else:
+        key = field
+    try:
+        return kinds[key]
+    except KeyError:
+        kind = kinds[key] = ShareKind(runtime, field)
+        return kind
+
+
+#: Keyword arguments of the callbacks which have none. It is never
+#: modified.
+_no_keywords = {}
+
+
+class Round(object):
+    """A round of communication on the path to a share.
+
+    Rounds are only recorded with the ``--depth-statistics`` option.
+    When data is expected from another player, a round one deeper
+    than the round of the running callback is created, so following
+    :attr:`previous` from a round gives the critical path of the
+    rounds it depends on. The *operation* and *program_counter* tell
+    where the data was expected.
+    """
+
+    __slots__ = ("depth", "operation", "program_counter", "previous")
+
+    def __init__(self, operation, program_counter, previous=None):
+        if previous is None:
+            self.depth = 1
+        else:
+            self.depth = previous.depth + 1
+        self.operation = operation
+        self.program_counter = program_counter
+        self.previous = previous
+
+    def path(self):
+        """Return the list of rounds leading to this round, starting
+        with the first."""
+        path = []
+        current = self
+        while current is not None:
+            path.append(current)
+            current = current.previous
+        path.reverse()
+        return path
+
+
+def deepest_round(deferreds):
+    """Return the deepest :class:`Round` of the *deferreds*, or None if
+    they have none."""
+    deepest = None
+    for deferred in deferreds:
+        current = getattr(deferred, "round", None)
+        if current is not None and (deepest is None or
+                                    current.depth > deepest.depth):
+            deepest = current
+    return deepest
+
+
 class Share(Deferred):
     """A shared number.
 
@@ -64,8 +161,22 @@ class Share(Deferred):
     sum of *a* and *b*. Each share is associated with a
     :class:`Runtime` and the arithmetic operations simply call back to
     that runtime.
+
+    Since large computations keep many shares alive, they are kept
+    small: the runtime and field are found through a shared
+    :class:`ShareKind` and the list of callbacks is only created when
+    the first callback is added. :meth:`Deferred.__init__` is not
+    called, so the other attributes of the Deferred are the class
+    attributes of :class:`Deferred`. The supported versions of Twisted
+    are listed in ``requirements.txt``.
     """
 
+    _canceller = None
+
+    #: The deepest :class:`Round` the share depends on, if the runtime
+    #: tracks the communication depth.
+    round = None
+
     def __init__(self, runtime, field, value=None):
         """Initialize a share.
 
@@ -75,18 +186,63 @@ class Share(Deferred):
         assert field is not None, "Cannot construct share without a field."
         assert callable(field), "The field is not callable, wrong argument?"
 
-        Deferred.__init__(self)
-        self.runtime = runtime
-        self.field = field
+        if self.debug:
+            # Let the Deferred record where it was created.
+            Deferred.__init__(self)
+        self.kind = share_kind(runtime, field)
         if value is not None:
             self.callback(value)
 
+    def _get_runtime(self):
+        return self.kind.runtime
+
+    def _set_runtime(self, runtime):
+        self.kind = share_kind(runtime, self.kind.field)
+
+    runtime = property(_get_runtime, _set_runtime)
+
+    def _get_field(self):
+        return self.kind.field
+
+    def _set_field(self, field):
+        self.kind = share_kind(self.kind.runtime, field)
+
+    field = property(_get_field, _set_field)
+
+    def _get_callbacks(self):
+        try:
+            return self.__dict__["callbacks"]
+        except KeyError:
+            # Deferred appends directly to the callbacks of a share
+            # which has no result yet, so the list is created then.
+            if self.called and not self.paused:
+                return ()
+            callbacks = self.__dict__["callbacks"] = []
+            return callbacks
+
+    def _set_callbacks(self, callbacks):
+        self.__dict__["callbacks"] = callbacks
+
+    callbacks = property(_get_callbacks, _set_callbacks)
+
+    def addCallbacks(self, callback, errback=None,
+                     callbackArgs=(), callbackKeywords=None,
+                     errbackArgs=(), errbackKeywords=None):
+        if "callbacks" not in self.__dict__:
+            self.__dict__["callbacks"] = []
+        # Deferred would store a new empty dictionary for each.
+        return Deferred.addCallbacks(self, callback, errback,
+                                     callbackArgs,
+                                     callbackKeywords or _no_keywords,
+                                     errbackArgs,
+                                     errbackKeywords or _no_keywords)
+
     if os.environ.get("VIFF_PROFILE"):
         old_init = __init__
 
         def __init__(self, *a, **kw):
             self.old_init(*a, **kw)
-            self.pc = self.runtime.program_counter[:]
+            self.pc = self.runtime.program_counter
             begin(None, self.label())
 
         def __del__(self):
@@ -161,6 +317,16 @@ class Share(Deferred):
         return 1 - self.runtime.equal(self, other)
 
 
+    def is_resolved(self):
+        """Return True if the value of the share can be used right
+        away, i.e., if it has been triggered and all its callbacks
+        have run. The value is then found in :attr:`result`."""
+        # The list of callbacks is looked up directly, since the
+        # property would create it.
+        return self.called and not self.paused \
+            and not self.__dict__.get("callbacks") \
+            and not isinstance(self.result, Failure)
+
     def clone(self):
         """Clone a share.
 
@@ -169,6 +335,8 @@ class Share(Deferred):
         """
 
         def split_result(result):
+            if self.round is not None:
+                clone.round = self.round
             clone.callback(result)
             return result
         clone = Share(self.runtime, self.field)
@@ -220,6 +388,9 @@ class ShareList(Share):
             "Threshold out of range"
 
         Share.__init__(self, shares[0].runtime, shares[0].field)
+        if getattr(self.runtime, "track_depth", False):
+            # The rounds of the shares are only known when they fire.
+            self._shares = shares
 
         self.results = [None] * len(shares)
         if threshold is None:
@@ -236,6 +407,9 @@ class ShareList(Share):
         self.results[index] = (success, result)
         self.missing_shares -= 1
         if not self.called and self.missing_shares == 0:
+            if "_shares" in self.__dict__:
+                self.round = deepest_round(self._shares)
+                del self._shares
             self.callback(self.results)
         return result
 
@@ -267,31 +441,516 @@ def gather_shares(shares):
     return share_list
 
 
+class ShareVector(Share):
+    """A vector of shared numbers.
+
+    The value of a share vector is a list of *size* field elements,
+    and the arithmetic operations work elementwise on the whole list.
+    Each operation uses a single Deferred and, where communication is
+    needed, a single message to each player, instead of one of each
+    per element:
+
+    >>> from viff.math.field import GF
+    >>> Zp = GF(101)
+    >>> a = ShareVector(None, Zp, 2)
+    >>> a.size
+    2
+    >>> a.callback([Zp(1), Zp(2)])
+    >>> a.result
+    [{1}, {2}]
+
+    The other operand may be a share vector, a list of constants of
+    the same size, or a single constant which applies to all elements.
+    Like a :class:`Share` the operations call back to the runtime, see
+    :meth:`~viff.runtimes.passive.PassiveRuntime.vector_add` and
+    friends.
+    """
+
+    def __init__(self, runtime, field, size, value=None):
+        """Initialize a share vector of *size* elements.
+
+        If an initial list of values is given, it will be passed to
+        :meth:`callback` right away.
+        """
+        self.size = size
+        Share.__init__(self, runtime, field, value)
+
+    def __add__(self, other):
+        """Elementwise addition."""
+        return self.runtime.vector_add(self, other)
+
+    def __radd__(self, other):
+        """Elementwise addition (reflected argument version)."""
+        return self.runtime.vector_add(self, other)
+
+    def __sub__(self, other):
+        """Elementwise subtraction."""
+        return self.runtime.vector_sub(self, other)
+
+    def __rsub__(self, other):
+        """Elementwise subtraction (reflected argument version)."""
+        return self.runtime.vector_sub(other, self)
+
+    def __mul__(self, other):
+        """Elementwise multiplication or scaling by a constant."""
+        return self.runtime.vector_mul(self, other)
+
+    def __rmul__(self, other):
+        """Elementwise multiplication (reflected argument version)."""
+        return self.runtime.vector_mul(self, other)
+
+    def clone(self):
+        """Clone a share vector."""
+
+        def split_result(result):
+            if self.round is not None:
+                clone.round = self.round
+            clone.callback(result)
+            return result
+        clone = ShareVector(self.runtime, self.field, self.size)
+        self.addCallback(split_result)
+        return clone
+
+
+def gather_vector(shares):
+    """Gather shares into a :class:`ShareVector`.
+
+    The vector is triggered with the list of values of the *shares*
+    once they are all ready:
+
+    >>> from viff.math.field import GF256
+    >>> a = Share(None, GF256)
+    >>> b = Share(None, GF256)
+    >>> vector = gather_vector([a, b])
+    >>> vector.size
+    2
+    >>> a.callback(10)
+    >>> b.callback(20)
+    >>> vector.result
+    [10, 20]
+    """
+    share_list = gather_shares(shares)
+    vector = ShareVector(share_list.runtime, share_list.field, len(shares))
+
+    def copy_round(values):
+        if share_list.round is not None:
+            vector.round = share_list.round
+        return values
+    share_list.addCallback(copy_round)
+    share_list.chainDeferred(vector)
+    return vector
+
+
+def split_vector(vector):
+    """Split a :class:`ShareVector` into a list of shares.
+
+    This is the inverse of :func:`gather_vector`:
+
+    >>> from viff.math.field import GF256
+    >>> vector = ShareVector(None, GF256, 2)
+    >>> a, b = split_vector(vector)
+    >>> vector.callback([10, 20])
+    >>> a.result, b.result
+    (10, 20)
+    """
+    shares = [Share(vector.runtime, vector.field)
+              for _ in range(vector.size)]
+
+    def split(values):
+        for share, value in zip(shares, values):
+            if vector.round is not None:
+                share.round = vector.round
+            share.callback(value)
+        return values
+    vector.addCallback(split)
+    return shares
+
+
+#: Number of bytes used for the binary encoding of elements, keyed by
+#: field. See :func:`encode_share`.
+_share_widths = {}
+
+
+#: Names of the data types, used for statistics.
+_data_type_names = dict([(value, name)
+                         for name, value in vars(constants).iteritems()
+                         if name.isupper()])
+
+
+def encode_share(element):
+    """Encode a field element as a fixed-width big-endian string.
+
+    The width is the number of bytes needed for ``field.modulus - 1``,
+    so :class:`~viff.math.field.GF256` elements take up a single
+    byte:
+
+    >>> from viff.math.field import GF, GF256
+    >>> encode_share(GF256(10))
+    '\\n'
+    >>> encode_share(GF(1031)(1000))
+    '\\x03\\xe8'
+
+    Returns :const:`None` if the value is out of range for the field,
+    which can happen for fake field elements.
+    """
+    field = element.field
+    try:
+        width = _share_widths[field]
+    except KeyError:
+        width = (len("%x" % (field.modulus - 1)) + 1) // 2
+        _share_widths[field] = width
+    value = element.value
+    if not 0 <= value < 256**width:
+        return None
+    if width == 1:
+        return chr(value)
+    return unhexlify("%0*x" % (2 * width, value))
+
+
+def decode_share(data):
+    """Decode a string made by :func:`encode_share` into an integer.
+
+    >>> decode_share('\\x03\\xe8')
+    1000L
+    """
+    if len(data) == 1:
+        return ord(data)
+    return long(hexlify(data), 16)
+
+
+def encode_shares(elements):
+    """Encode a list of field elements as a string.
+
+    The elements are encoded as by :func:`encode_share` after the
+    width of the encoding, so the receiver can split the string
+    without knowing the field:
+
+    >>> from viff.math.field import GF
+    >>> Zp = GF(1031)
+    >>> encode_shares([Zp(1000), Zp(3)])
+    '\\x02\\x03\\xe8\\x00\\x03'
+
+    Elements out of range for their field are encoded with width
+    zero followed by their values in hexadecimal.
+    """
+    encoded = map(encode_share, elements)
+    if None in encoded:
+        return "\x00" + " ".join(["%x" % e.value for e in elements])
+    if not encoded:
+        return "\x00"
+    return encode_varint(len(encoded[0])) + "".join(encoded)
+
+
+def decode_shares(data):
+    """Decode a string made by :func:`encode_shares` into a list of
+    integers.
+
+    >>> decode_shares('\\x02\\x03\\xe8\\x00\\x03')
+    [1000L, 3L]
+    """
+    width, offset = decode_varint(data, 0)
+    if width == 0:
+        return [long(value, 16) for value in data[offset:].split()]
+    if (len(data) - offset) % width:
+        raise struct.error("truncated share vector")
+    return [decode_share(data[i:i + width])
+            for i in xrange(offset, len(data), width)]
+
+
+def encode_varint(number):
+    """Encode a non-negative integer with seven bits per byte.
+
+    The high bit of a byte is set when more bytes follow, so small
+    numbers take up a single byte:
+
+    >>> encode_varint(5)
+    '\\x05'
+    >>> encode_varint(300)
+    '\\xac\\x02'
+    """
+    if number < 0x80:
+        return chr(number)
+    result = []
+    while number >= 0x80:
+        result.append(chr(number & 0x7f | 0x80))
+        number >>= 7
+    result.append(chr(number))
+    return "".join(result)
+
+
+def decode_varint(string, offset):
+    """Decode an integer made by :func:`encode_varint` starting at
+    *offset* in *string*. Returns the integer and the offset of the
+    following byte:
+
+    >>> decode_varint('\\xac\\x02\\x05', 0)
+    (300, 2)
+    """
+    number = 0
+    shift = 0
+    while True:
+        try:
+            byte = ord(string[offset])
+        except IndexError:
+            raise struct.error("truncated varint")
+        offset += 1
+        number |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return number, offset
+        shift += 7
+
+
+def _share_value(value, field):
+    # Binary shares are decoded on arrival, shares sent as
+    # hexadecimal strings are decoded here.
+    if isinstance(value, str):
+        value = long(value, 16)
+    return field(value)
+
+
+#: First two bytes of packets using the compact format, see
+#: :meth:`ShareExchanger._compact_header`.
+COMPACT_MARKER = "\xff\xff"
+
+#: Length prefix of strings and packets in a batch.
+_length_struct = struct.Struct("!H")
+#: Header of packets in the format described in
+#: :meth:`ShareExchanger.sendData`.
+_header_struct = struct.Struct("!HHB")
+#: Program counters of packets in the same format, keyed by size.
+_pc_structs = {}
+
+
+def _pc_struct(size):
+    try:
+        return _pc_structs[size]
+    except KeyError:
+        pc_struct = _pc_structs[size] = struct.Struct("!%dI" % size)
+        return pc_struct
+
+
+def _data_size(data):
+    """Return the number of bytes of received *data*, which is a
+    string or a share decoded into an integer."""
+    if isinstance(data, str):
+        return len(data)
+    return (data.bit_length() + 7) // 8 or 1
+
+
+class _SpilledData(object):
+    """Early data written to the spill file of a
+    :class:`ShareExchanger`."""
+
+    __slots__ = ("offset", "length")
+
+    def __init__(self, offset, length):
+        self.offset = offset
+        self.length = length
+
+
 class ShareExchanger(Int16StringReceiver):
     """Send and receive shares.
 
     All players are connected by pair-wise connections and this
     Twisted protocol is one such connection. It is used to send and
     receive shares from one other player.
+
+    The exchanger registers itself as a streaming producer with its
+    transport. While the transport is paused because the peer does
+    not read fast enough, packets are held in a send queue instead.
+    When the queue grows beyond the ``--send-high-watermark`` option,
+    the runtime is told that the peer is congested, see
+    :meth:`Runtime.send_pressure`. It is told again when the queue has
+    shrunk below the ``--send-low-watermark`` option.
+
+    Data which arrives before the runtime asks for it is kept in
+    :attr:`incoming_data`. The ``--max-early-bytes`` option bounds the
+    memory used for it, see :meth:`_store_early_data`, and the
+    ``--stale-report`` option makes the exchanger remember when each
+    key started waiting, see :meth:`Runtime.stale_keys`.
     """
 
+    #: Largest frame which can be sent with a 16-bit length prefix.
+    max_frame_size = 2**16 - 1
+
+    #: Data types which are compressed when :attr:`compress` is set.
+    compressible_types = frozenset([TEXT, PAILLIER])
+
     def __init__(self):
         self.peer_id = None
         self.lost_connection = Deferred()
         #: Data expected to be received in the future.
         self.incoming_data = {}
         self.waiting_deferreds = {}
+        #: Maps the keys of :attr:`incoming_data` and
+        #: :attr:`waiting_deferreds` to the time they were added. Only
+        #: used with the ``--stale-report`` option.
+        self.key_times = {}
+        #: Bytes of early data held in memory and in the spill file.
+        self.early_bytes = 0
+        self.spilled_bytes = 0
+        #: Reading from the transport is paused because too much
+        #: early data is held, see :meth:`_store_early_data`.
+        self.reading_paused = False
+        self._spill_file = None
+        #: Features announced by the peer, see :meth:`local_features`.
+        self.peer_features = frozenset()
+        #: Features supported by both ends of the connection.
+        self.features = frozenset()
+        #: Combine messages sent in the same reactor iteration into
+        #: a single frame.
+        self.batch_messages = False
+        #: Send shares in binary instead of hexadecimal notation.
+        self.binary_shares = False
+        #: Use the compact program counter encoding.
+        self.compact_pc = False
+        #: Compress large messages of the :attr:`compressible_types`.
+        self.compress = False
+        #: Send the shares of a reactor iteration as one message.
+        self.batch_shares = False
+        #: Program counters of the last compact packets sent and
+        #: received, used for prefix compression.
+        self._last_sent_pc = ()
+        self._last_received_pc = ()
+        #: Chunks of a large message received so far.
+        self._chunks = []
+        self._chunks_pc = None
+        #: Received bytes not yet processed, see :meth:`dataReceived`.
+        self._buffer = ""
+        self._pending = []
+        self._receiving = False
+        #: Program counters and encoded shares waiting to be sent as
+        #: a share batch, with the runtime and operation sending them.
+        self._outgoing_shares = []
+        #: Packets waiting to be sent as a batch.
+        self._outgoing = []
+        self._outgoing_size = 0
+        self._flush_call = None
+        #: Packets waiting for the transport to resume, see
+        #: :meth:`resumeProducing`.
+        self._send_queue = deque()
+        self.queued_bytes = 0
+        self.paused = False
+        self.congested = False
+        self._closing = False
         #: Statistics
         self.sent_packets = 0
         self.sent_bytes = 0
+        self.sent_data_bytes = 0
+        self.sent_messages = 0
+        self.max_queued_bytes = 0
+        self.congestion_count = 0
+        self.peak_early_bytes = 0
+        self.spill_count = 0
+        self.read_pause_count = 0
+        #: Maps data types to ``[messages, bytes before, bytes after,
+        #: seconds]`` for the messages we tried to compress.
+        self.compression_stats = {}
+        #: Maps data types to seconds spent decompressing.
+        self.decompression_time = {}
 
     def connectionMade(self):
+        settings = link_settings(self.factory.runtime.options)
+        if settings:
+            self.transport = EmulatedTransport(self.transport, **settings)
+        self.transport.registerProducer(self, True)
         self.sendString(str(self.factory.runtime.id))
+        # Announce our features. A peer which does not know about
+        # HELLO packets never announces any features and so we will
+        # only send packets it understands. It will keep our HELLO
+        # packet as unclaimed data, which is harmless.
+        self.sendData((), HELLO, " ".join(sorted(self.local_features())))
+
+    def local_features(self):
+        """Return the set of optional wire format features enabled
+        by the runtime options.
+
+        A feature is only used on a connection when both players
+        announce it, see :meth:`hello_received`.
+        """
+        options = self.factory.runtime.options
+        features = set(["chunks"])
+        if options.batch_messages:
+            features.add("batch")
+        if options.binary_shares:
+            features.add("binary-shares")
+        if options.compact_pc:
+            features.add("compact-pc")
+        if options.compress:
+            features.add("compress")
+        if options.batch_shares:
+            features.add("share-batch")
+        return features
+
+    def hello_received(self, data):
+        """Enable the features announced in a HELLO packet from the
+        peer which we support ourselves."""
+        self.peer_features = frozenset(data.split())
+        self.features = self.peer_features & self.local_features()
+        self.batch_messages = "batch" in self.features
+        self.binary_shares = "binary-shares" in self.features
+        self.compact_pc = "compact-pc" in self.features
+        self.compress = "compress" in self.features
+        self.batch_shares = "share-batch" in self.features
 
     def connectionLost(self, reason):
-        reason.trap(ConnectionDone)
+        if self._flush_call is not None and self._flush_call.active():
+            self._flush_call.cancel()
+        self._flush_call = None
+        if isinstance(self.transport, EmulatedTransport):
+            self.transport.cancel()
+        if self._spill_file is not None:
+            self._spill_file.close()
+            self._spill_file = None
+        # A Unix domain socket reports a non-clean close when the
+        # peer shuts down with data from us still unread.
+        reason.trap(ConnectionDone, ConnectionLost)
         self.lost_connection.callback(self)
 
+    def dataReceived(self, data):
+        """Split the received bytes into strings.
+
+        The strings are parsed directly from the receive buffer
+        without slicing them out first, see :meth:`_packet_received`.
+
+        The :class:`~viff.reactor.ViffReactor` may call this method
+        again while we are delivering data (e.g., when the runtime is
+        handed to the protocol). Such data is appended to the buffer
+        and processed by the outer call.
+        """
+        self._pending.append(data)
+        if self._receiving:
+            return
+        self._receiving = True
+        try:
+            buf = self._buffer
+            offset = 0
+            while self._pending:
+                buf = buf[offset:] + "".join(self._pending)
+                self._pending = []
+                offset = 0
+                size = len(buf)
+                while size - offset >= 2:
+                    length, = _length_struct.unpack_from(buf, offset)
+                    start = offset + 2
+                    end = start + length
+                    if end > size:
+                        break
+                    offset = end
+                    if self.peer_id is None:
+                        self.stringReceived(buf[start:end])
+                    else:
+                        try:
+                            self._packet_received(buf, start, end)
+                        except struct.error, e:
+                            self._buffer = ""
+                            self._pending = []
+                            self.factory.runtime.abort(self, e)
+                            return
+            self._buffer = buf[offset:]
+        finally:
+            self._receiving = False
+
     def stringReceived(self, string):
         """Called when a share is received.
 
@@ -299,9 +958,6 @@ class ShareExchanger(Int16StringReceiver):
         a data part. The data is passed the appropriate Deferred in
         :class:`self.incoming_data`.
         """
-        # needed to make VIFF reactor work with later versions of Twisted
-        if 'recvd' not in self.__dict__:
-            self._unprocessed = self._unprocessed[self._compatibilityOffset:]
         if self.peer_id is None:
             # TODO: Handle ValueError if the string cannot be decoded.
             self.peer_id = int(string)
@@ -320,30 +976,248 @@ class ShareExchanger(Int16StringReceiver):
             self.factory.identify_peer(self)
         else:
             try:
-                pc_size, data_size, data_type = struct.unpack("!HHB", string[:5])
-                fmt = "!%dI%ds" % (pc_size, data_size)
-                unpacked = struct.unpack(fmt, string[5:])
-
-                program_counter = unpacked[:pc_size]
-                data = unpacked[-1]
-
-                key = (program_counter, data_type)
-
-                if key in self.waiting_deferreds:
-                    deq = self.waiting_deferreds[key]
-                    deferred = deq.popleft()
-                    if not deq:
-                        del self.waiting_deferreds[key]
-                    self.factory.runtime.handle_deferred_data(deferred, data)
-                else:
-                    deq = self.incoming_data.setdefault(key, deque())
-                    deq.append(data)
+                self._packet_received(string)
             except struct.error, e:
                 self.factory.runtime.abort(self, e)
-        if 'recvd' not in self.__dict__:
-            self.recvd = self._unprocessed
 
-    def sendData(self, program_counter, data_type, data):
+    def _packet_received(self, buf, start=0, end=None):
+        """Unpack the packet found in *buf* from *start* to *end* and
+        deliver its data.
+
+        Both the format described in :meth:`sendData` and the compact
+        format described in :meth:`_compact_header` are understood.
+        Headers are unpacked in place and only the data is copied out
+        of *buf*.
+
+        A packet of type :data:`~viff.utils.constants.BATCH` carries a
+        number of length-prefixed packets which are unpacked in turn.
+        Shares sent as :data:`~viff.utils.constants.BINARY_SHARE` are
+        decoded into integers and delivered as
+        :data:`~viff.utils.constants.SHARE` data. The data in
+        :data:`~viff.utils.constants.CHUNK` packets is put in front of
+        the data of the next packet. Data sent as
+        :data:`~viff.utils.constants.COMPRESSED` is decompressed and
+        delivered with the data type found in its first byte.
+        """
+        if end is None:
+            end = len(buf)
+        if end - start < 3:
+            raise struct.error("packet too short")
+
+        marker, = _length_struct.unpack_from(buf, start)
+        if marker == 0xFFFF:
+            data_type = ord(buf[start + 2])
+            shared, offset = decode_varint(buf, start + 3)
+            count, offset = decode_varint(buf, offset)
+            if shared > len(self._last_received_pc):
+                raise struct.error("bad program counter prefix")
+            suffix = []
+            for _ in xrange(count):
+                # Most components fit in a single byte.
+                byte = ord(buf[offset:offset + 1] or "\x80")
+                if byte < 0x80:
+                    suffix.append(byte)
+                    offset += 1
+                else:
+                    component, offset = decode_varint(buf, offset)
+                    suffix.append(component)
+            if offset > end:
+                raise struct.error("truncated program counter")
+            program_counter = self._last_received_pc[:shared] + tuple(suffix)
+            self._last_received_pc = program_counter
+        else:
+            pc_size, data_size, data_type = _header_struct.unpack_from(buf,
+                                                                       start)
+            offset = start + 5 + 4 * pc_size
+            if offset + data_size != end:
+                raise struct.error("packet size mismatch")
+            program_counter = _pc_struct(pc_size).unpack_from(buf, start + 5)
+
+        if data_type == BATCH:
+            while offset < end:
+                if offset + 2 > end:
+                    raise struct.error("truncated packet in batch")
+                size, = _length_struct.unpack_from(buf, offset)
+                offset += 2
+                if offset + size > end:
+                    raise struct.error("truncated packet in batch")
+                self._packet_received(buf, offset, offset + size)
+                offset += size
+            return
+
+        data = buf[offset:end]
+        if data_type == CHUNK:
+            if self._chunks and self._chunks_pc != program_counter:
+                raise struct.error("interleaved chunks")
+            self._chunks.append(data)
+            self._chunks_pc = program_counter
+            return
+
+        if self._chunks:
+            if self._chunks_pc != program_counter:
+                raise struct.error("incomplete chunked message")
+            self._chunks.append(data)
+            data = "".join(self._chunks)
+            self._chunks = []
+            self._chunks_pc = None
+
+        if data_type == COMPRESSED:
+            if not data:
+                raise struct.error("empty compressed packet")
+            data_type = ord(data[0])
+            started = time.time()
+            try:
+                data = zlib.decompress(buffer(data, 1))
+            except zlib.error, e:
+                raise struct.error("bad compressed data: %s" % e)
+            elapsed = time.time() - started
+            self.decompression_time[data_type] = \
+                self.decompression_time.get(data_type, 0) + elapsed
+
+        if data_type == BINARY_SHARE:
+            self._deliver_data(program_counter, SHARE, decode_share(data))
+        elif data_type == SHARE_BATCH:
+            self._share_batch_received(data)
+        elif data_type == HELLO:
+            self.hello_received(data)
+        else:
+            self._deliver_data(program_counter, data_type, data)
+
+    def _share_batch_received(self, data):
+        """Deliver the shares of a share batch, see :meth:`flush`."""
+        last_pc = ()
+        offset = 0
+        end = len(data)
+        while offset < end:
+            shared, offset = decode_varint(data, offset)
+            count, offset = decode_varint(data, offset)
+            suffix = []
+            for _ in xrange(count):
+                component, offset = decode_varint(data, offset)
+                suffix.append(component)
+            size, offset = decode_varint(data, offset)
+            if offset + size > end:
+                raise struct.error("truncated share batch")
+            last_pc = last_pc[:shared] + tuple(suffix)
+            self._deliver_data(last_pc, SHARE,
+                               decode_share(data[offset:offset + size]))
+            offset += size
+
+    def _deliver_data(self, program_counter, data_type, data):
+        """Pass *data* to the Deferred waiting for it, or store it
+        until somebody asks for it."""
+        key = (program_counter, data_type)
+
+        if key in self.waiting_deferreds:
+            deq = self.waiting_deferreds[key]
+            deferred = deq.popleft()
+            if not deq:
+                del self.waiting_deferreds[key]
+            if not deq and self.key_times:
+                self.key_times.pop(key, None)
+            self.factory.runtime.handle_deferred_data(deferred, data)
+        else:
+            self._store_early_data(key, data)
+
+    def _store_early_data(self, key, data):
+        """Keep *data* until the runtime asks for it.
+
+        If the early data held in memory grows beyond the
+        ``--max-early-bytes`` option, the data is written to a
+        temporary file in the ``--spill-dir`` directory instead, if
+        that option is given. Otherwise the transport is told to stop
+        reading from the peer until the runtime has claimed enough of
+        the data, see :meth:`claim_data`. Reading is not paused while
+        the runtime waits for data from the peer, since that data may
+        well be among the bytes not yet read.
+        """
+        options = self.factory.runtime.options
+        size = _data_size(data)
+        limit = options.max_early_bytes
+        if limit is not None and self.early_bytes + size > limit:
+            if options.spill_dir is not None:
+                data = self._spill(data, options.spill_dir)
+                size = 0
+            elif not self.reading_paused and not self.waiting_deferreds:
+                self.reading_paused = True
+                self.read_pause_count += 1
+                self.transport.pauseProducing()
+                self.factory.runtime.receive_pressure(self.peer_id, True)
+        self.early_bytes += size
+        if self.early_bytes > self.peak_early_bytes:
+            self.peak_early_bytes = self.early_bytes
+        if key not in self.incoming_data:
+            self.incoming_data[key] = deque()
+            if options.stale_report is not None:
+                self.key_times[key] = time.time()
+        self.incoming_data[key].append(data)
+
+    def _spill(self, data, directory):
+        """Write *data* to the spill file and return a record of
+        where it was written."""
+        if self._spill_file is None:
+            self._spill_file = tempfile.TemporaryFile(prefix="viff-",
+                                                      dir=directory)
+        data = marshal.dumps(data)
+        self._spill_file.seek(0, os.SEEK_END)
+        spilled = _SpilledData(self._spill_file.tell(), len(data))
+        self._spill_file.write(data)
+        self.spilled_bytes += len(data)
+        self.spill_count += 1
+        return spilled
+
+    def _unspill(self, spilled):
+        """Read back the data written by :meth:`_spill`."""
+        self._spill_file.seek(spilled.offset)
+        data = self._spill_file.read(spilled.length)
+        self.spilled_bytes -= spilled.length
+        if self.spilled_bytes == 0:
+            # Nothing is left in the file, so start from scratch.
+            self._spill_file.seek(0)
+            self._spill_file.truncate()
+        return marshal.loads(data)
+
+    def claim_data(self, key):
+        """Remove and return the oldest early data stored for *key*.
+
+        Raises :exc:`KeyError` if there is no data for *key*. Reading
+        from the transport is resumed once the early data held in
+        memory has shrunk to half of the ``--max-early-bytes`` option.
+        """
+        deq = self.incoming_data[key]
+        data = deq.popleft()
+        if not deq:
+            del self.incoming_data[key]
+            if self.key_times:
+                self.key_times.pop(key, None)
+        if isinstance(data, _SpilledData):
+            data = self._unspill(data)
+        else:
+            self.early_bytes -= _data_size(data)
+            if self.reading_paused and self.early_bytes <= \
+                    self.factory.runtime.options.max_early_bytes // 2:
+                self._resume_reading()
+        return data
+
+    def wait_for_data(self, key, deferred):
+        """Let *deferred* wait for the data for *key*.
+
+        Reading from the transport is resumed if it was paused, so
+        the data can arrive."""
+        if key not in self.waiting_deferreds:
+            self.waiting_deferreds[key] = deque()
+            if self.factory.runtime.options.stale_report is not None:
+                self.key_times[key] = time.time()
+        self.waiting_deferreds[key].append(deferred)
+        if self.reading_paused:
+            self._resume_reading()
+
+    def _resume_reading(self):
+        self.reading_paused = False
+        self.transport.resumeProducing()
+        self.factory.runtime.receive_pressure(self.peer_id, False)
+
+    def sendData(self, program_counter, data_type, data, runtime=None):
         """Send data to the peer.
 
         The *program_counter* is a tuple of unsigned integers, the
@@ -358,27 +1232,327 @@ class ShareExchanger(Int16StringReceiver):
 
         The program counter takes up ``4 * pc_size`` bytes, the data
         takes up ``data_size`` bytes.
+
+        If the packet would be larger than :attr:`max_frame_size`, the
+        data is split into pieces. All but the last piece are sent as
+        :data:`~viff.utils.constants.CHUNK` packets and the receiver
+        joins them with the last piece. This does not wait for the
+        HELLO of the peer, since data sent as soon as the runtime is
+        ready may go out before it is handled, and a peer which does
+        not understand chunks could not receive the data anyway.
+
+        If :attr:`batch_messages` is set, the packet is queued and
+        sent together with the other packets queued in the same
+        reactor iteration, see :meth:`flush`.
+
+        If :attr:`compress` is set, data of the
+        :attr:`compressible_types` longer than the
+        ``--compress-threshold`` option is compressed with zlib. It is
+        then sent as :data:`~viff.utils.constants.COMPRESSED` data
+        whose first byte holds the original data type. This happens
+        before the data is split into chunks.
+
+        The message is accounted to the current operation of
+        *runtime* in its :attr:`~Runtime.traffic`. This is the runtime
+        of the connection unless another runtime is given, as the
+        sessions sharing the connection do, see
+        :meth:`Runtime.open_session`.
         """
-        pc_size = len(program_counter)
-        data_size = len(data)
-        fmt = "!HHB%dI%ds" % (pc_size, data_size)
-        t = (pc_size, data_size, data_type) + program_counter + (data,)
-        packet = struct.pack(fmt, *t)
-        self.sendString(packet)
+        if runtime is None:
+            runtime = self.factory.runtime
+        self.sent_messages += 1
+        if data_type == BINARY_SHARE:
+            key = (SHARE, runtime.operation)
+        else:
+            key = (data_type, runtime.operation)
+        packet_bytes, payload = self._send_data(program_counter, data_type,
+                                                data)
+        self._account(runtime, key, packet_bytes - payload, payload)
+
+    def _send_data(self, program_counter, data_type, data):
+        """Compress and send *data* as described in :meth:`sendData`.
+
+        Returns the number of bytes sent and the size of the data
+        after compression."""
+        if self.compress and data_type in self.compressible_types and \
+                len(data) >= self.factory.runtime.options.compress_threshold:
+            data_type, data = self._compress(data_type, data)
+        payload = len(data)
+        packet_bytes = 0
+        if self.compact_pc:
+            # Each component takes up at most five bytes.
+            header_size = 5 + 5 * len(program_counter) + 10
+        else:
+            header_size = 5 + 4 * len(program_counter)
+        max_data_size = self.max_frame_size - header_size
+        if len(data) > max_data_size:
+            pieces = [data[i:i + max_data_size]
+                      for i in xrange(0, len(data), max_data_size)]
+            for piece in pieces[:-1]:
+                packet_bytes += self._send_message(program_counter, CHUNK,
+                                                   piece)
+            data = pieces[-1]
+        packet_bytes += self._send_message(program_counter, data_type, data)
+        return packet_bytes, payload
+
+    def _account(self, runtime, key, header_bytes, data_bytes):
+        """Account a message to the :attr:`~Runtime.traffic` of
+        *runtime* under *key*."""
+        stats = runtime.traffic.get(key)
+        if stats is None:
+            stats = runtime.traffic[key] = [0, 0, 0]
+        stats[0] += 1
+        stats[1] += header_bytes
+        stats[2] += data_bytes
+
+    def _compress(self, data_type, data):
+        """Return the data type and data to send for *data*. The
+        compressed data is only used if it is smaller."""
+        started = time.time()
+        compressed = zlib.compress(data)
+        elapsed = time.time() - started
+        if len(compressed) + 1 < len(data):
+            result = COMPRESSED, chr(data_type) + compressed
+        else:
+            result = data_type, data
+
+        stats = self.compression_stats.setdefault(data_type, [0, 0, 0, 0])
+        stats[0] += 1
+        stats[1] += len(data)
+        stats[2] += len(result[1])
+        stats[3] += elapsed
+        return result
+
+    def _send_message(self, program_counter, data_type, data):
+        if self.compact_pc:
+            packet = self._compact_header(program_counter, data_type) + data
+        else:
+            pc_size = len(program_counter)
+            packet = "".join([_header_struct.pack(pc_size, len(data),
+                                                  data_type),
+                              _pc_struct(pc_size).pack(*program_counter),
+                              data])
+        self.sent_data_bytes += len(data)
+        if self.batch_messages:
+            self._queue_packet(packet)
+        else:
+            self._send_packet(packet)
+        return len(packet)
+
+    def _compact_header(self, program_counter, data_type):
+        """Return the header of a packet in the compact format.
+
+        The program counter is encoded relative to the program
+        counter of the previous compact packet. Only the number of
+        leading components they share and the remaining components
+        are sent, all as varints (see :func:`encode_varint`)::
+
+          +--------+-----------+--------+-------+--------+------+
+          | 0xFFFF | data_type | shared | count | suffix | data |
+          +--------+-----------+--------+-------+--------+------+
+            2 bytes    1 byte    varint   varint  varints  varies
+
+        The marker cannot be mistaken for the *pc_size* of a normal
+        packet since such a program counter would not fit in a packet.
+        The receiver reconstructs the program counter from the last
+        one it has seen, which works since packets are processed in
+        the order they are sent.
+        """
+        last = self._last_sent_pc
+        shared = 0
+        limit = min(len(last), len(program_counter))
+        while shared < limit and last[shared] == program_counter[shared]:
+            shared += 1
+        self._last_sent_pc = program_counter
+        suffix = program_counter[shared:]
+        parts = [COMPACT_MARKER, chr(data_type), encode_varint(shared),
+                 encode_varint(len(suffix))]
+        parts.extend([encode_varint(component) for component in suffix])
+        return "".join(parts)
+
+    def _send_packet(self, packet):
+        if self.paused:
+            self._send_queue.append(packet)
+            self.queued_bytes += len(packet)
+            if self.queued_bytes > self.max_queued_bytes:
+                self.max_queued_bytes = self.queued_bytes
+            options = self.factory.runtime.options
+            if not self.congested and \
+                    self.queued_bytes > options.send_high_watermark:
+                self.congested = True
+                self.congestion_count += 1
+                self.factory.runtime.send_pressure(self.peer_id, True)
+        else:
+            self.sendString(packet)
         self.sent_packets += 1
         self.sent_bytes += len(packet)
 
-    def sendShare(self, program_counter, share):
+    def pauseProducing(self):
+        """Called by the transport when its buffer is full."""
+        self.paused = True
+
+    def resumeProducing(self):
+        """Called by the transport when its buffer has been sent.
+
+        Queued packets are written until the transport pauses us
+        again."""
+        self.paused = False
+        queue = self._send_queue
+        while queue and not self.paused:
+            packet = queue.popleft()
+            self.queued_bytes -= len(packet)
+            self.sendString(packet)
+        options = self.factory.runtime.options
+        if self.congested and self.queued_bytes <= options.send_low_watermark:
+            self.congested = False
+            self.factory.runtime.send_pressure(self.peer_id, False)
+        if self._closing and not queue:
+            self.transport.loseConnection()
+
+    def stopProducing(self):
+        """Called by the transport when the connection is lost."""
+        self._send_queue.clear()
+        self.queued_bytes = 0
+
+    def _queue_packet(self, packet):
+        # Each packet in a batch has a 2 byte length prefix and the
+        # batch itself has a 5 byte header.
+        size = len(packet) + 2
+        if self._outgoing_size + size > self.max_frame_size - 5:
+            # Only the packets, the header of this packet is encoded
+            # relative to the queued packets, not to queued shares.
+            self._flush_packets()
+        self._outgoing.append(packet)
+        self._outgoing_size += size
+        if self._flush_call is None:
+            self._flush_call = reactor.callLater(0, self.flush)
+
+    def flush(self):
+        """Send all queued packets.
+
+        A single queued packet is sent as it is, several packets are
+        combined into one :data:`~viff.utils.constants.BATCH` packet::
+
+          +---------+-----------+-------+------+----------+-------+-----
+          |    0    | data_size | BATCH | size |  packet  |  size | ...
+          +---------+-----------+-------+------+----------+-------+-----
+            2 bytes   2 bytes    1 byte  2 bytes  varies   2 bytes
+
+        This method is called automatically in the reactor iteration
+        following the first call to :meth:`sendData`.
+
+        The shares queued by :meth:`sendShare` are sent first, as a
+        single :data:`~viff.utils.constants.SHARE_BATCH` message. Its
+        data holds the program counter and the encoded share of each,
+        all but the share as varints::
+
+          +--------+-------+--------+------+-------+-----
+          | shared | count | suffix | size | share | ...
+          +--------+-------+--------+------+-------+-----
+
+        The program counters are encoded relative to the previous one
+        as in :meth:`_compact_header`, starting from the empty
+        program counter.
+        """
+        if self._outgoing_shares:
+            self._send_share_batch()
+
+        if self._flush_call is not None and self._flush_call.active():
+            self._flush_call.cancel()
+        self._flush_call = None
+        self._flush_packets()
+
+    def _flush_packets(self):
+        packets = self._outgoing
+        if not packets:
+            return
+        self._outgoing = []
+        self._outgoing_size = 0
+
+        if len(packets) == 1:
+            self._send_packet(packets[0])
+        else:
+            body = "".join([_length_struct.pack(len(p)) + p for p in packets])
+            header = _header_struct.pack(0, len(body), BATCH)
+            self._send_packet(header + body)
+
+    def _send_share_batch(self):
+        shares = self._outgoing_shares
+        self._outgoing_shares = []
+        self.sent_messages += 1
+        parts = []
+        headers = []
+        last = ()
+        for program_counter, data, _, _ in shares:
+            shared = 0
+            limit = min(len(last), len(program_counter))
+            while shared < limit and last[shared] == program_counter[shared]:
+                shared += 1
+            last = program_counter
+            suffix = program_counter[shared:]
+            header = [encode_varint(shared), encode_varint(len(suffix))]
+            header.extend([encode_varint(component) for component in suffix])
+            header.append(encode_varint(len(data)))
+            headers.append(sum([len(part) for part in header]))
+            parts.extend(header)
+            parts.append(data)
+        packet_bytes, payload = self._send_data((), SHARE_BATCH,
+                                                "".join(parts))
+
+        # Each share is accounted to the runtime and operation which
+        # sent it, with an equal part of the packet headers.
+        overhead, remainder = divmod(packet_bytes - payload, len(shares))
+        for i, (_, data, runtime, operation) in enumerate(shares):
+            header_bytes = headers[i] + overhead + (i < remainder)
+            self._account(runtime, (SHARE, operation), header_bytes,
+                          len(data))
+
+    def sendShare(self, program_counter, share, runtime=None):
         """Send a share.
 
         The program counter and the share are converted to bytes and
-        sent to the peer.
+        sent to the peer. If the peer supports it, the share is sent
+        in the binary encoding of :func:`encode_share`. The share is
+        accounted to *runtime* as in :meth:`sendData`.
+
+        If :attr:`batch_shares` is set, the share is queued and sent
+        together with the other shares queued in the same reactor
+        iteration, see :meth:`flush`.
         """
-        self.sendData(program_counter, SHARE, hex(share.value))
+        if self.batch_shares:
+            data = encode_share(share)
+            if data is not None:
+                if runtime is None:
+                    runtime = self.factory.runtime
+                self._outgoing_shares.append((program_counter, data, runtime,
+                                              runtime.operation))
+                if self._flush_call is None:
+                    self._flush_call = reactor.callLater(0, self.flush)
+                return
+        if self.binary_shares:
+            data = encode_share(share)
+            if data is not None:
+                self.sendData(program_counter, BINARY_SHARE, data, runtime)
+                return
+        self.sendData(program_counter, SHARE, hex(share.value), runtime)
+
+    def sendShares(self, program_counter, shares, runtime=None):
+        """Send a list of shares as a single message.
+
+        The shares are encoded with :func:`encode_shares`.
+        """
+        self.sendData(program_counter, SHARE_VECTOR, encode_shares(shares),
+                      runtime)
 
     def loseConnection(self):
-        """Disconnect this protocol instance."""
-        self.transport.loseConnection()
+        """Disconnect this protocol instance.
+
+        The connection is closed when the send queue is empty."""
+        self.flush()
+        if self._send_queue:
+            self._closing = True
+        else:
+            self.transport.loseConnection()
 
 class SelfShareExchanger(ShareExchanger):
 
@@ -394,22 +1568,9 @@ class SelfShareExchanger(ShareExchanger):
         a data part. The data is passed the appropriate Deferred in
         :class:`self.incoming_data`.
         """
-        try:
-            key = (program_counter, data_type)
-                         
-            if key in self.waiting_deferreds:
-                deq = self.waiting_deferreds[key]
-                deferred = deq.popleft()
-                if not deq:
-                    del self.waiting_deferreds[key]
-                self.factory.runtime.handle_deferred_data(deferred, data)
-            else:
-                deq = self.incoming_data.setdefault(key, deque())
-                deq.append(data)
-        except struct.error, e:
-            self.factory.runtime.abort(self, e)
+        self._deliver_data(program_counter, data_type, data)
 
-    def sendData(self, program_counter, data_type, data):
+    def sendData(self, program_counter, data_type, data, runtime=None):
         """Send data to the self.id."""
         self.stringReceived(program_counter, data_type, data)
 
@@ -440,6 +1601,13 @@ class FakeTransport(object):
     def close(self):
         return True
 
+    def pauseProducing(self):
+        # Data sent to ourselves cannot be held back.
+        pass
+
+    def resumeProducing(self):
+        pass
+
 class ShareExchangerFactory(ReconnectingClientFactory, ServerFactory):
     """Factory for creating ShareExchanger protocols."""
 
@@ -453,15 +1621,57 @@ class ShareExchangerFactory(ReconnectingClientFactory, ServerFactory):
         self.players = players
         self.needed_protocols = len(players) - 1
         self.protocols_ready = protocols_ready
+        #: Time when we started connecting to the other players.
+        self.started = time.time()
 
     def identify_peer(self, protocol):
-        self.runtime.add_player(self.players[protocol.peer_id], protocol)
+        if self.protocols_ready.called:
+            # We gave up waiting, see the --ready-timeout option.
+            protocol.transport.loseConnection()
+            return
+        elapsed = time.time() - self.started
+        self.runtime.connection_times[protocol.peer_id] = elapsed
+        player = self.players[protocol.peer_id]
+        if isinstance(protocol.transport, EmulatedTransport):
+            protocol.transport.configure(**player.network)
+        self.runtime.add_player(player, protocol)
         self.needed_protocols -= 1
         if self.needed_protocols == 0:
             self.protocols_ready.callback(self.runtime)
 
+    def missing_players(self):
+        """Return the IDs of the players we are not yet connected to."""
+        return sorted(set(self.players) - set(self.runtime.protocols))
+
     def clientConnectionLost(self, connector, reason):
-        reason.trap(ConnectionDone)
+        # See ShareExchanger.connectionLost.
+        reason.trap(ConnectionDone, ConnectionLost)
+
+
+class PeerConnectionFactory(ReconnectingClientFactory):
+    """Factory for the connection to a single peer.
+
+    Each peer has its own factory so that the delays between the
+    connection attempts are independent. The connections are
+    identified by the :class:`ShareExchangerFactory` given.
+    """
+
+    protocol = ShareExchanger
+    initialDelay = 0.1
+    maxDelay = 3
+    factor = 1.234567 # About half of the Twisted default
+
+    def __init__(self, parent):
+        self.parent = parent
+        self.runtime = parent.runtime
+
+    def identify_peer(self, protocol):
+        self.resetDelay()
+        self.parent.identify_peer(protocol)
+
+    def clientConnectionLost(self, connector, reason):
+        # See ShareExchanger.connectionLost.
+        reason.trap(ConnectionDone, ConnectionLost)
 
 
 def preprocess(generator):
@@ -501,6 +1711,26 @@ def preprocess(generator):
     return preprocess_decorator
 
 
+def _run_in_worker(call):
+    """Make a function call pickled by :meth:`Runtime.defer_to_worker`.
+
+    This runs in a worker process. The result is returned pickled
+    together with a flag telling if the call succeeded. A failed call
+    returns the exception, or a :exc:`RuntimeError` describing it if
+    the exception cannot be pickled.
+    """
+    try:
+        func, args = cPickle.loads(call)
+        result = (True, func(*args))
+    except Exception, e:
+        result = (False, e)
+    try:
+        return cPickle.dumps(result, cPickle.HIGHEST_PROTOCOL)
+    except Exception, e:
+        error = RuntimeError("cannot pickle %r: %s" % (result[1], e))
+        return cPickle.dumps((False, error), cPickle.HIGHEST_PROTOCOL)
+
+
 class Runtime:
     """Basic VIFF runtime with no crypto.
 
@@ -508,6 +1738,10 @@ class Runtime:
     as the program counter, the list of other players, etc.
     """
 
+    #: True if the communication depth of shares is tracked, see
+    #: :meth:`depth_statistics`.
+    track_depth = False
+
     @staticmethod
     def add_options(parser):
         group = OptionGroup(parser, "VIFF Runtime Options")
@@ -532,6 +1766,87 @@ class Runtime:
                          help="Track memory usage over time.")
         group.add_option("--statistics", action="store_true",
                          help="Print statistics on shutdown.")
+        group.add_option("--batch-messages", action="store_true",
+                         help=("Send the messages for a peer produced in "
+                               "one reactor iteration as a single packet."))
+        group.add_option("--no-binary-shares", action="store_false",
+                         dest="binary_shares",
+                         help=("Send shares as hexadecimal strings instead "
+                               "of fixed-width binary strings."))
+        group.add_option("--no-compact-pc", action="store_false",
+                         dest="compact_pc",
+                         help=("Send program counters as lists of 32-bit "
+                               "integers instead of the compact encoding."))
+        group.add_option("--no-eager", action="store_false", dest="eager",
+                         help=("Always go through callbacks for local "
+                               "operations on shares with a value."))
+        group.add_option("--batch-shares", action="store_true",
+                         help=("Send the shares for a peer produced in "
+                               "one reactor iteration as one message."))
+        group.add_option("--compress", action="store_true",
+                         help=("Compress large TEXT and PAILLIER messages "
+                               "if the peer supports it."))
+        group.add_option("--compress-threshold", type="int", metavar="BYTES",
+                         help=("Only compress messages of at least this "
+                               "many bytes."))
+        group.add_option("--unix-sockets", action="store_true",
+                         help=("Connect to players on this host through "
+                               "Unix domain sockets (only without SSL)."))
+        group.add_option("--socket-dir", metavar="DIR",
+                         help=("Directory for the Unix domain sockets. "
+                               "It should only be accessible to the "
+                               "players."))
+        group.add_option("--ready-timeout", type="float", metavar="SECONDS",
+                         help=("Give up if not connected to all players "
+                               "within this many seconds."))
+        group.add_option("--send-high-watermark", type="int",
+                         metavar="BYTES",
+                         help=("Consider a peer congested when this many "
+                               "bytes are waiting to be sent to it."))
+        group.add_option("--send-low-watermark", type="int",
+                         metavar="BYTES",
+                         help=("Consider a congested peer ready again when "
+                               "at most this many bytes are waiting."))
+        group.add_option("--max-early-bytes", type="int", metavar="BYTES",
+                         help=("Hold at most this many bytes of data which "
+                               "arrive from a peer before they are needed. "
+                               "Further data is spilled to disk if "
+                               "--spill-dir is given, otherwise reading from "
+                               "the peer is paused."))
+        group.add_option("--spill-dir", metavar="DIR",
+                         help=("Write early data beyond --max-early-bytes to "
+                               "temporary files in this directory."))
+        group.add_option("--stale-report", type="float", metavar="SECONDS",
+                         help=("Every this many seconds, report the data "
+                               "which has waited longer than that to be "
+                               "received or to be used."))
+        group.add_option("--workers", type="int", metavar="N",
+                         help=("Run heavy local computations, such as "
+                               "Paillier encryptions, in a pool of N "
+                               "processes. The default is to run them in "
+                               "the main process."))
+        group.add_option("--net-latency", type="float", metavar="MS",
+                         help=("Emulate a network which delays the data "
+                               "sent to each player by this many "
+                               "milliseconds."))
+        group.add_option("--net-jitter", type="float", metavar="MS",
+                         help=("Add a random delay of up to this many "
+                               "milliseconds to the emulated latency."))
+        group.add_option("--net-bandwidth", type="float", metavar="KBIT",
+                         help=("Emulate links with this many kilobits per "
+                               "second of bandwidth."))
+        group.add_option("--net-reorder", type="float", metavar="P",
+                         help=("Emulate that a segment is reordered with "
+                               "probability P. This delays it by another "
+                               "latency, as TCP would."))
+        group.add_option("--depth-statistics", action="store_true",
+                         help=("Track the communication depth of the "
+                               "shares and print the rounds, the critical "
+                               "path and a depth histogram on shutdown."))
+        group.add_option("--traffic-json", metavar="FILE",
+                         help=("Write statistics on the data sent, broken "
+                               "down by data type and operation, to FILE "
+                               "as JSON on shutdown."))
         group.add_option("--no-socket-retry", action="store_true",
                          default=False, help="Fail rather than keep retrying "
                          "to connect if port is already in use.")
@@ -562,6 +1877,28 @@ class Runtime:
                             profile=False,
                             track_memory=False,
                             statistics=False,
+                            batch_messages=False,
+                            binary_shares=True,
+                            compact_pc=True,
+                            eager=True,
+                            batch_shares=False,
+                            compress=False,
+                            compress_threshold=1024,
+                            unix_sockets=False,
+                            socket_dir=tempfile.gettempdir(),
+                            ready_timeout=None,
+                            send_high_watermark=4 * 2**20,
+                            send_low_watermark=2**20,
+                            max_early_bytes=None,
+                            spill_dir=None,
+                            stale_report=None,
+                            workers=0,
+                            net_latency=None,
+                            net_jitter=None,
+                            net_bandwidth=None,
+                            net_reorder=None,
+                            depth_statistics=False,
+                            traffic_json=None,
                             computation_id=None)
 
     def __init__(self, player, threshold, options=None):
@@ -590,18 +1927,25 @@ class Runtime:
             from twisted.internet import defer
             defer.setDebugging(True)
 
+        #: Mapping from field to the :class:`ShareKind` of the shares
+        #: of this runtime.
+        self.share_kinds = {}
+
         #: Pool of preprocessed data.
         self._pool = {}
         #: Description of needed preprocessed data.
         self._needed_data = {}
 
         #: Current program counter.
+        #:
+        #: It is a tuple which is replaced instead of changed, so it
+        #: can be saved and used as a key without copying it.
         __comp_id = self.options.computation_id
         if __comp_id is None:
             __comp_id = 0
         else:
             assert __comp_id > 0, "Non-positive ID: %d." % __comp_id
-        self.program_counter = [__comp_id, 0]
+        self.program_counter = (__comp_id, 0)
 
         #: Connections to the other players.
         #:
@@ -630,31 +1974,124 @@ class Runtime:
         self.complex_deferred_queue = deque()
         #: Counter for calls of activate_reactor().
         self.activation_counter = 0
-        #: Record the recursion depth.
-        self.depth_counter = 0
-        self.max_depth = 0
-        #: Recursion depth limit by experiment, including security margin.
-        self.depth_limit = int(sys.getrecursionlimit() / 50)
+        #: True while :meth:`process_deferred_queue` runs.
+        self.processing = False
         #: Use deferred queues only if the ViffReactor is running.
-        self.using_viff_reactor = isinstance(reactor, viff.reactor.ViffReactor)
+        self.using_viff_reactor = isinstance(reactor,
+                                           viff.reactor.ViffReactorMixin)
+        #: Mapping from player ID to the number of seconds it took to
+        #: connect to the player, see :func:`create_runtime`.
+        self.connection_times = {}
+        #: Listening Unix domain socket, see :func:`create_runtime`.
+        self.unix_port = None
+        #: Name of the operation which data is accounted to, see
+        #: :func:`~viff.utils.util.operation`.
+        self.operation = None
+        #: Maps ``(data_type, operation)`` pairs to ``[messages,
+        #: header bytes, data bytes]`` for the messages sent by this
+        #: runtime, see :meth:`traffic_statistics`.
+        self.traffic = {}
+        #: IDs of the players we cannot send to as fast as we produce
+        #: data, see :meth:`send_pressure`.
+        self.congested_peers = set()
+        self._capacity_waiters = []
+        #: IDs of the players we have stopped reading from, see
+        #: :meth:`receive_pressure`.
+        self.unread_peers = set()
+        #: Pool of worker processes, see :meth:`defer_to_worker`.
+        self.worker_pool = None
+        #: Mapping from session ID to the runtimes of the sessions
+        #: opened with :meth:`open_session`.
+        self.sessions = {}
+        #: The runtime which opened this session and the session ID,
+        #: or None if this runtime is not a session.
+        self.parent = None
+        self.session_id = None
+        self.track_depth = self.options.depth_statistics
+        #: The :class:`Round` of the callback which is running.
+        self.current_round = None
+        #: The deepest :class:`Round` seen so far.
+        self.deepest_round = None
+        #: Mapping from depth to the number of data items expected
+        #: from other players at that depth.
+        self.depth_histogram = {}
 
     def add_player(self, player, protocol):
         self.players[player.id] = player
         self.num_players = len(self.players)
         self.protocols[player.id] = protocol
 
+    def open_session(self, session_id, runtime_class=None):
+        """Start an independent computation over the connections of
+        this runtime.
+
+        Returns a new runtime of *runtime_class*, by default the class
+        of this runtime, with the same options and players. The
+        program counters of the session start with *session_id*, so
+        its data never mixes with the data of this runtime or of other
+        sessions, and it has its own pool of preprocessed data. The
+        connections and the scheduler of this runtime are shared, so
+        a session needs no ports or handshakes. The data sent by the
+        session is accounted to it, so :meth:`traffic_statistics` of
+        the session only covers the operations of the session.
+
+        All players must open the session with the same ID, but not
+        at the same time: data which arrives for a session before it
+        is opened is kept like other early data. A session is ended
+        with :meth:`close_session` or with :meth:`shutdown` on the
+        session, which leaves the shared connections open.
+        """
+        assert session_id > 0, "Non-positive session ID: %d." % session_id
+        assert session_id != self.program_counter[0] and \
+            session_id not in self.sessions, \
+            "Session ID %d is already in use." % session_id
+        if runtime_class is None:
+            runtime_class = self.__class__
+        session = runtime_class(self.players[self.id], self.threshold,
+                                self.options)
+        session.program_counter = (session_id, 0)
+        session.parent = self
+        session.session_id = session_id
+        # Only our queues are processed by the reactor.
+        session.deferred_queue = self.deferred_queue
+        session.complex_deferred_queue = self.complex_deferred_queue
+        session.congested_peers.update(self.congested_peers)
+        for player_id, player in self.players.iteritems():
+            if player_id != self.id:
+                session.add_player(player, self.protocols[player_id])
+        self.sessions[session_id] = session
+        return session
+
+    def close_session(self, session_id):
+        """End the session opened with :meth:`open_session`.
+
+        Returns a :class:`Deferred` which fires when all players have
+        closed the session. The ID should not be used again, since
+        data left over from the closed session would be taken for data
+        of the new one."""
+        session = self.sessions.pop(session_id)
+        return session.synchronize()
+
     def shutdown(self):
         """Shutdown the runtime.
 
         All connections are closed and the runtime cannot be used
-        again after this has been called.
+        again after this has been called. For a session, see
+        :meth:`open_session`, only the session is closed.
         """
+        if self.parent is not None:
+            return self.parent.close_session(self.session_id)
+
         print "Synchronizing shutdown...",
 
         def close_connections(_):
             print "done."
             print "Closing connections...",
-            results = [maybeDeferred(self.port.stopListening)]
+            results = []
+            # The port is None if we were still trying to listen.
+            for port in self.port, self.unix_port:
+                if port is not None:
+                    results.append(maybeDeferred(port.stopListening))
             for protocol in self.protocols.itervalues():
                 results.append(protocol.lost_connection)
                 protocol.loseConnection()
@@ -694,15 +2131,16 @@ class Runtime:
 
     def increment_pc(self):
         """Increment the program counter."""
-        self.program_counter[-1] += 1
+        pc = self.program_counter
+        self.program_counter = pc[:-1] + (pc[-1] + 1,)
 
     def fork_pc(self):
         """Fork the program counter."""
-        self.program_counter.append(0)
+        self.program_counter += (0,)
 
     def unfork_pc(self):
         """Leave a fork of the program counter."""
-        self.program_counter.pop()
+        self.program_counter = self.program_counter[:-1]
 
     def schedule_callback(self, deferred, func, *args, **kwargs):
         """Schedule a callback on a deferred with the correct program
@@ -718,21 +2156,50 @@ class Runtime:
         :meth:`addCallback`.
         """
         self.increment_pc()
-        saved_pc = self.program_counter[:]
+        saved_pc = self.program_counter
+        saved_operation = self.operation
+
+        if self.track_depth:
+            func = self._track_round(deferred, func)
 
         @wrapper(func)
         def callback_wrapper(*args, **kwargs):
             """Wrapper for a callback which ensures a correct PC."""
             try:
-                current_pc = self.program_counter[:]
-                self.program_counter[:] = saved_pc
-                self.fork_pc()
+                current_pc = self.program_counter
+                current_operation = self.operation
+                self.program_counter = saved_pc + (0,)
+                self.operation = saved_operation
                 return func(*args, **kwargs)
             finally:
-                self.program_counter[:] = current_pc
+                self.program_counter = current_pc
+                self.operation = current_operation
 
         return deferred.addCallback(callback_wrapper, *args, **kwargs)
 
+    def _track_round(self, deferred, func):
+        """Wrap *func* so that it runs in the round of *deferred*.
+
+        The data expected by the callback is then one round deeper,
+        and the round of a Deferred returned by the callback becomes
+        the round of *deferred*."""
+
+        @wrapper(func)
+        def round_wrapper(*args, **kwargs):
+            current_round = self.current_round
+            self.current_round = getattr(deferred, "round", None)
+            try:
+                result = func(*args, **kwargs)
+            finally:
+                self.current_round = current_round
+            if isinstance(result, Deferred):
+                def merge_round(value):
+                    deferred.round = deepest_round([deferred, result])
+                    return value
+                result.addCallback(merge_round)
+            return result
+        return round_wrapper
+
     def schedule_complex_callback(self, deferred, func, *args, **kwargs):
         """Schedule a complex callback, i.e. a callback which blocks a
         long time.
@@ -755,6 +2222,63 @@ class Runtime:
         deferred.addCallback(queue_callback, self, fork)
         return self.schedule_callback(fork, func, *args, **kwargs)
 
+    def defer_to_worker(self, func, *args):
+        """Compute ``func(*args)`` in a worker process.
+
+        Returns a :class:`Deferred` which fires in the reactor thread
+        with the result, or fails with the exception raised by *func*.
+        The workers are started by the first call and only used with
+        the ``--workers`` option. Without it the function is called
+        right away and the returned :class:`Deferred` has already
+        fired.
+
+        The function and arguments must be picklable, so *func* must
+        be a module level function. It should be pure and it must
+        not use :data:`~viff.utils.util.rand`, since every worker has
+        its own copy of the generator and would repeat the numbers of
+        the others. Draw random numbers first and pass them as
+        arguments instead.
+        """
+        if not self.options.workers:
+            return maybeDeferred(func, *args)
+        if self.parent is not None:
+            # Sessions share the workers of the runtime.
+            return self.parent.defer_to_worker(func, *args)
+        if self.worker_pool is None:
+            self.worker_pool = multiprocessing.Pool(self.options.workers)
+        # Pickling here reports unpicklable calls as a failure instead
+        # of losing them in the thread which feeds the pool.
+        try:
+            call = cPickle.dumps((func, args), cPickle.HIGHEST_PROTOCOL)
+        except Exception:
+            return fail()
+
+        deferred = Deferred()
+
+        def done(result):
+            # Called in a thread of the pool.
+            reactor.callFromThread(self._worker_done, deferred, result)
+
+        self.worker_pool.apply_async(_run_in_worker, (call,), callback=done)
+        return deferred
+
+    def _worker_done(self, deferred, result):
+        # The callbacks may poll the reactor, which runs the calls from
+        # the threads again while we are one of them. They are
+        # therefore left to the deferred queue like received data.
+        succeeded, value = cPickle.loads(result)
+        if not succeeded:
+            value = Failure(value)
+        self.handle_deferred_data(deferred, value)
+
+    def stop_workers(self):
+        """Stop the worker processes, if any, after they have
+        finished the calls given to them."""
+        if self.worker_pool is not None:
+            self.worker_pool.close()
+            self.worker_pool.join()
+            self.worker_pool = None
+
     def synchronize(self):
         """Introduce a synchronization point.
 
@@ -771,25 +2295,29 @@ class Runtime:
         return result
 
     def _expect_data(self, peer_id, data_type, deferred):
-        # Convert self.program_counter to a hashable value in order to
-        # use it as a key in self.protocols[peer_id].incoming_data.
-        pc = tuple(self.program_counter)
+        # The program counter is a tuple and so it can be used as a
+        # key in self.protocols[peer_id].incoming_data as it is.
+        pc = self.program_counter
         return self._expect_data_with_pc(pc, peer_id, data_type, deferred)
 
     def _expect_data_with_pc(self, pc, peer_id, data_type, deferred):
+        if self.track_depth:
+            deferred.round = Round(self.operation, pc, self.current_round)
+            depth = deferred.round.depth
+            self.depth_histogram[depth] = self.depth_histogram.get(depth, 0) + 1
+            if self.deepest_round is None or \
+                    depth > self.deepest_round.depth:
+                self.deepest_round = deferred.round
+
         key = (pc, data_type)
+        protocol = self.protocols[peer_id]
 
-        if key in self.protocols[peer_id].incoming_data:
+        if key in protocol.incoming_data:
             # We have already received some data from the other side.
-            deq = self.protocols[peer_id].incoming_data[key]
-            data = deq.popleft()
-            if not deq:
-                del self.protocols[peer_id].incoming_data[key]
-            deferred.callback(data)
+            deferred.callback(protocol.claim_data(key))
         else:
             # We have not yet received anything from the other side.
-            deq = self.protocols[peer_id].waiting_deferreds.setdefault(key, deque())
-            deq.append(deferred)
+            protocol.wait_for_data(key, deferred)
 
     def _exchange_shares(self, peer_id, field_element):
         """Exchange shares with another player.
@@ -804,15 +2332,37 @@ class Runtime:
         else:
             share = self._expect_share(peer_id, field_element.field)
             pc = tuple(self.program_counter)
-            self.protocols[peer_id].sendShare(pc, field_element)
+            self.protocols[peer_id].sendShare(pc, field_element, self)
             return share
 
+    def _exchange_share_vectors(self, peer_id, field, elements):
+        """Exchange lists of shares with another player.
+
+        Like :meth:`_exchange_shares`, but the list of field
+        *elements* is sent as a single message.
+        """
+        if peer_id == self.id:
+            return Share(self, field, elements)
+        else:
+            shares = self._expect_shares(peer_id, field)
+            pc = tuple(self.program_counter)
+            self.protocols[peer_id].sendShares(pc, elements, self)
+            return shares
+
     def _expect_share(self, peer_id, field):
         share = Share(self, field)
-        share.addCallback(lambda value: field(long(value, 16)))
+        share.addCallback(_share_value, field)
         self._expect_data(peer_id, SHARE, share)
         return share
 
+    def _expect_shares(self, peer_id, field):
+        """Return a :class:`Share` which is triggered with the list of
+        field elements sent by :meth:`ShareExchanger.sendShares`."""
+        shares = Share(self, field)
+        shares.addCallback(lambda data: map(field, decode_shares(data)))
+        self._expect_data(peer_id, SHARE_VECTOR, shares)
+        return shares
+
     def preprocess(self, program):
         """Generate preprocess material.
 
@@ -902,28 +2452,90 @@ class Runtime:
         else:
             deferred.callback(data)
 
-    def process_deferred_queue(self):
-        """Execute the callbacks of the deferreds in the queue.
+    def send_pressure(self, peer_id, congested):
+        """Called by the :class:`ShareExchanger` for *peer_id* when
+        the peer becomes congested or ready again.
 
-        If this function is not called via activate_reactor(), also
-        complex callbacks are executed."""
+        While a peer is congested, the deferred queue is not
+        processed. This stops the generation of new messages while
+        the network keeps running.
+        """
+        if congested:
+            self.congested_peers.add(peer_id)
+        else:
+            self.congested_peers.discard(peer_id)
+            if not self.congested_peers:
+                waiters = self._capacity_waiters
+                self._capacity_waiters = []
+                for deferred in waiters:
+                    deferred.callback(None)
+        for session in self.sessions.values():
+            session.send_pressure(peer_id, congested)
+
+    def receive_pressure(self, peer_id, paused):
+        """Called by the :class:`ShareExchanger` for *peer_id* when
+        reading from the peer is paused or resumed because of the
+        ``--max-early-bytes`` option.
+
+        While reading from a peer is paused, the deferred queue is
+        processed even if peers are congested. The early data is only
+        claimed by the callbacks in the queue, so two players which
+        stopped reading from each other would otherwise wait for each
+        other forever.
+        """
+        if paused:
+            self.unread_peers.add(peer_id)
+        else:
+            self.unread_peers.discard(peer_id)
 
-        self.process_queue(self.deferred_queue)
+    def send_capacity(self):
+        """Return a Deferred which fires when no peer is congested.
 
-        if self.depth_counter == 0:
-            self.process_queue(self.complex_deferred_queue)
+        Programs which generate a lot of work can wait for this
+        between rounds to bound the memory used for sending."""
+        deferred = Deferred()
+        if self.congested_peers:
+            self._capacity_waiters.append(deferred)
+        else:
+            deferred.callback(None)
+        return deferred
 
-    def process_queue(self, queue):
-        """Execute the callbacks of the deferreds in *queue*."""
+    def process_deferred_queue(self):
+        """Execute the callbacks of the deferreds in the queues.
+
+        This is the scheduler of the runtime, called by the
+        ViffReactor after every iteration. The callbacks are run one
+        at a time from here. When they call :meth:`activate_reactor`,
+        the data received is appended to the queues and picked up by
+        the loop below instead of being processed deeper down the
+        stack. Complex callbacks are only run when the other queue is
+        empty. Nothing is done while a peer is congested, unless we
+        have stopped reading from a peer, see :meth:`receive_pressure`.
+        """
 
-        while queue:
-            deferred, data = queue.popleft()
-            deferred.callback(data)
+        if self.processing:
+            return
+        self.processing = True
+        try:
+            queue = self.deferred_queue
+            complex_queue = self.complex_deferred_queue
+            while not self.congested_peers or self.unread_peers:
+                if queue:
+                    deferred, data = queue.popleft()
+                elif complex_queue:
+                    deferred, data = complex_queue.popleft()
+                else:
+                    break
+                deferred.callback(data)
+        finally:
+            self.processing = False
 
     def activate_reactor(self):
         """Activate the reactor to do actual communcation.
 
-        This is where the recursion happens."""
+        The pending network I/O is done, but the callbacks of the
+        data received are left to :meth:`process_deferred_queue`, so
+        this never recurses."""
 
         if not self.using_viff_reactor:
             return
@@ -933,26 +2545,197 @@ class Runtime:
         # setting the number to n makes the reactor called 
         # only every n-th time
         if self.activation_counter >= 2:
-            self.depth_counter += 1
-
-            if self.depth_counter > self.max_depth:
-                # Record the maximal depth reached.
-                self.max_depth = self.depth_counter
-                if self.depth_counter >= self.depth_limit:
-                    print "Recursion depth limit reached."
-
-            if self.depth_counter < self.depth_limit:
-                reactor.doIteration(0)
-
-            self.depth_counter -= 1
             self.activation_counter = 0
+            reactor.poll()
+
+    def traffic_statistics(self):
+        """Return statistics on the data sent to the other players.
+
+        The result is a dictionary which can be dumped as JSON. The
+        ``"peers"`` entry has the totals for each connection, which
+        includes the data of all sessions using it. The
+        ``"data_types"`` and ``"operations"`` entries break the
+        messages sent by this runtime down by data type and by the
+        operation which sent them, see
+        :func:`~viff.utils.util.operation`. Messages sent
+        outside any operation are listed under ``"other"``. Header
+        bytes are the packet headers including the program counters.
+        With ``--batch-shares``, each share of a batch counts as a
+        message of its operation, while the peers count the batch as
+        one message.
+        With the ``--depth-statistics`` option the ``"depth"`` entry
+        holds the :meth:`depth_statistics`.
+        """
+        peers = {}
+        data_types = {}
+        operations = {}
+        for peer_id, protocol in self.protocols.iteritems():
+            if peer_id == self.id:
+                continue
+            peers[peer_id] = {
+                "bytes": protocol.sent_bytes,
+                "header_bytes": protocol.sent_bytes - protocol.sent_data_bytes,
+                "data_bytes": protocol.sent_data_bytes,
+                "packets": protocol.sent_packets,
+                "messages": protocol.sent_messages}
+        for (data_type, operation), stats in self.traffic.iteritems():
+            messages, header_bytes, data_bytes = stats
+            data_type = _data_type_names.get(data_type, str(data_type))
+            for table, name in [(data_types, data_type),
+                                (operations, operation or "other")]:
+                entry = table.setdefault(name, {"messages": 0,
+                                                "header_bytes": 0,
+                                                "data_bytes": 0})
+                entry["messages"] += messages
+                entry["header_bytes"] += header_bytes
+                entry["data_bytes"] += data_bytes
+        statistics = {"player": self.id,
+                      "peers": peers,
+                      "data_types": data_types,
+                      "operations": operations}
+        if self.track_depth:
+            statistics["depth"] = self.depth_statistics()
+        return statistics
+
+    def write_traffic_statistics(self, filename):
+        """Write :meth:`traffic_statistics` to *filename* as JSON."""
+        output = open(filename, "w")
+        try:
+            json.dump(self.traffic_statistics(), output, indent=2,
+                      sort_keys=True)
+        finally:
+            output.close()
 
     def print_transferred_data(self):
         """Print the amount of transferred data for all connections."""
 
         for protocol in self.protocols.itervalues():
-            print "Transfer to peer %d: %d bytes in %d packets" % \
-                  (protocol.peer_id, protocol.sent_bytes, protocol.sent_packets)
+            header_bytes = protocol.sent_bytes - protocol.sent_data_bytes
+            print "Transfer to peer %d: %d bytes (%d header, %d data) " \
+                  "in %d packets (%d messages)" % \
+                  (protocol.peer_id, protocol.sent_bytes, header_bytes,
+                   protocol.sent_data_bytes, protocol.sent_packets,
+                   protocol.sent_messages)
+            if protocol.max_queued_bytes:
+                print "  Send queue held at most %d bytes, peer was " \
+                      "congested %d times" % \
+                      (protocol.max_queued_bytes, protocol.congestion_count)
+            if self.options.max_early_bytes is not None:
+                print "  Early data held at most %d bytes, %d messages " \
+                      "spilled to disk, reading paused %d times" % \
+                      (protocol.peak_early_bytes, protocol.spill_count,
+                       protocol.read_pause_count)
+            for data_type in sorted(protocol.compression_stats):
+                messages, before, after, seconds = \
+                    protocol.compression_stats[data_type]
+                print "  Compressed %d messages of type %d: %d -> %d bytes " \
+                      "(ratio %.2f) in %.3f sec" % \
+                      (messages, data_type, before, after,
+                       before / max(after, 1), seconds)
+            for data_type in sorted(protocol.decompression_time):
+                print "  Decompressed messages of type %d from peer %d " \
+                      "in %.3f sec" % \
+                      (data_type, protocol.peer_id,
+                       protocol.decompression_time[data_type])
+
+        statistics = self.traffic_statistics()
+        for title, table in [("data type", statistics["data_types"]),
+                             ("operation", statistics["operations"])]:
+            for name in sorted(table):
+                entry = table[name]
+                print "Sent by %s %s: %d bytes (%d header, %d data) " \
+                      "in %d messages" % \
+                      (title, name, entry["header_bytes"] + entry["data_bytes"],
+                       entry["header_bytes"], entry["data_bytes"],
+                       entry["messages"])
+
+    def stale_keys(self, age):
+        """Return the keys which have waited for more than *age*
+        seconds.
+
+        The result is a list of ``(seconds, peer_id, program_counter,
+        data_type, state)`` tuples, oldest first. The state is
+        ``"waiting"`` when we wait for data from the peer, and
+        ``"unclaimed"`` when the peer has sent data which we have not
+        asked for. Either points to players whose program counters
+        no longer match. The times are only recorded with the
+        ``--stale-report`` option.
+        """
+        now = time.time()
+        stale = []
+        for peer_id, protocol in self.protocols.iteritems():
+            for key, added in protocol.key_times.iteritems():
+                if now - added <= age:
+                    continue
+                if key in protocol.waiting_deferreds:
+                    state = "waiting"
+                else:
+                    state = "unclaimed"
+                pc, data_type = key
+                stale.append((now - added, peer_id, pc, data_type, state))
+        stale.sort(reverse=True)
+        return stale
+
+    def print_stale_keys(self, age):
+        """Print the :meth:`stale_keys` older than *age* seconds."""
+        stale = self.stale_keys(age)
+        if not stale:
+            return
+        print "Data waiting for more than %g seconds:" % age
+        for seconds, peer_id, pc, data_type, state in stale:
+            print "  %s: %s data from player %d at %s for %.1f sec" % \
+                  (state, _data_type_names.get(data_type, str(data_type)),
+                   peer_id, ".".join(map(str, pc)), seconds)
+
+    def depth_statistics(self):
+        """Return statistics on the communication depth of the shares.
+
+        The ``"rounds"`` entry is the depth of the deepest share, the
+        ``"critical_path"`` entry lists the operation and program
+        counter of each round leading to it, and the ``"histogram"``
+        entry maps each depth to the number of data items expected
+        from other players at that depth. The depth is only tracked
+        with the ``--depth-statistics`` option.
+        """
+        path = []
+        rounds = 0
+        if self.deepest_round is not None:
+            rounds = self.deepest_round.depth
+            path = [{"depth": r.depth,
+                     "operation": r.operation or "other",
+                     "program_counter": list(r.program_counter)}
+                    for r in self.deepest_round.path()]
+        return {"rounds": rounds,
+                "critical_path": path,
+                "histogram": dict(self.depth_histogram)}
+
+    def print_depth_statistics(self):
+        """Print the :meth:`depth_statistics`.
+
+        Consecutive rounds of the critical path made by the same
+        operation are printed as one line."""
+        statistics = self.depth_statistics()
+        print "Communication rounds: %d" % statistics["rounds"]
+        print "Critical path:"
+        path = statistics["critical_path"]
+        start = 0
+        for index, entry in enumerate(path):
+            if index + 1 < len(path) and \
+                    path[index + 1]["operation"] == entry["operation"]:
+                continue
+            first = path[start]
+            if first is entry:
+                rounds = "round %d" % entry["depth"]
+            else:
+                rounds = "rounds %d-%d" % (first["depth"], entry["depth"])
+            print "  %s: %s (from %s)" % \
+                  (rounds, entry["operation"],
+                   ".".join(map(str, first["program_counter"])))
+            start = index + 1
+        print "Depth histogram:"
+        histogram = statistics["histogram"]
+        for depth in sorted(histogram):
+            print "  depth %d: %d" % (depth, histogram[depth])
 
 
 def make_runtime_class(runtime_class=None, mixins=None):
@@ -976,6 +2759,26 @@ def make_runtime_class(runtime_class=None, mixins=None):
         bases = tuple(mixins) + (runtime_class, object)
         return type("ExtendedRuntime", bases, {})
 
+def is_local_host(host):
+    """Return True if *host* names the machine we are running on.
+
+    >>> is_local_host("localhost")
+    True
+    >>> is_local_host("127.0.0.2")
+    True
+    >>> is_local_host("192.0.2.1")
+    False
+    """
+    return host in ("localhost", "::1", socket.gethostname()) \
+        or host.startswith("127.")
+
+
+def unix_socket_path(port, options):
+    """Return the path of the Unix domain socket used instead of
+    TCP *port* when the ``--unix-sockets`` option is given."""
+    return os.path.join(options.socket_dir, "viff-%d.sock" % port)
+
+
 def create_runtime(id, players, threshold, options=None, runtime_class=None):
     """Create a :class:`Runtime` and connect to the other players.
 
@@ -1006,6 +2809,22 @@ def create_runtime(id, players, threshold, options=None, runtime_class=None):
     This is the general template which VIFF programs should follow.
     Please see the example applications for more examples.
 
+    With the ``--unix-sockets`` option, the runtime also listens on
+    a Unix domain socket (see :func:`unix_socket_path`) and connects
+    to players on the same host through their sockets, bypassing the
+    TCP stack. This is not done when SSL is used.
+
+    Listening and connecting to the other players happens
+    concurrently and without blocking the reactor. The time it took to
+    connect to each player is stored in
+    :attr:`Runtime.connection_times`. If the ``--ready-timeout``
+    option is given, the returned Deferred fails with a
+    :exc:`~twisted.internet.error.TimeoutError` when the runtime is not
+    connected to all players within that many seconds. With the
+    ``--no-socket-retry`` option, it fails with a
+    :exc:`~twisted.internet.error.CannotListenError` if the port of
+    the player is in use. Otherwise listening is retried until it
+    succeeds, even after the other players have connected.
     """
     if options and options.track_memory:
         lc = LoopingCall(track_memory_usage)
@@ -1059,6 +2878,20 @@ def create_runtime(id, players, threshold, options=None, runtime_class=None):
     if options and options.statistics:
         reactor.addSystemEventTrigger("after", "shutdown",
                                       runtime.print_transferred_data)
+    if options and options.depth_statistics:
+        reactor.addSystemEventTrigger("after", "shutdown",
+                                      runtime.print_depth_statistics)
+    if options and options.traffic_json:
+        reactor.addSystemEventTrigger("after", "shutdown",
+                                      runtime.write_traffic_statistics,
+                                      options.traffic_json)
+    if options and options.workers:
+        reactor.addSystemEventTrigger("after", "shutdown",
+                                      runtime.stop_workers)
+    if options and options.stale_report:
+        report = LoopingCall(runtime.print_stale_keys, options.stale_report)
+        report.start(options.stale_report, now=False)
+        reactor.addSystemEventTrigger("before", "shutdown", report.stop)
 
     if options and options.ssl:
         print "Using SSL"
@@ -1090,33 +2923,102 @@ def create_runtime(id, players, threshold, options=None, runtime_class=None):
 
         ctx_factory = SSLContextFactory(id)
         listen = lambda port: reactor.listenSSL(port, factory, ctx_factory)
-        connect = lambda host, port: reactor.connectSSL(host, port, factory, ctx_factory)
+        connect = lambda host, port, client: \
+            reactor.connectSSL(host, port, client, ctx_factory)
     else:
         print "Not using SSL"
         listen = lambda port: reactor.listenTCP(port, factory)
-        connect = lambda host, port: reactor.connectTCP(host, port, factory)
+        connect = lambda host, port, client: \
+            reactor.connectTCP(host, port, client)
 
     port = players[id].port
     runtime.port = None
-    delay = 2
-    while runtime.port is None:
+    pending_calls = []
+    # Other players may connect before we manage to listen, so the
+    # retries are kept apart and not cancelled when we are ready.
+    listen_calls = []
+    clients = []
+
+    def cancel_calls(calls):
+        for call in calls:
+            if call.active():
+                call.cancel()
+
+    def stop_connecting():
+        cancel_calls(pending_calls)
+        cancel_calls(listen_calls)
+        for client in clients:
+            client.stopTrying()
+        for port in runtime.port, runtime.unix_port:
+            if port is not None:
+                port.stopListening()
+        for peer_id, protocol in runtime.protocols.iteritems():
+            if peer_id != runtime.id:
+                protocol.loseConnection()
+
+    def try_listen(delay):
         # We keep trying to listen on the port, but with an
-        # exponentially increasing delay between each attempt.
+        # exponentially increasing delay between each attempt. The
+        # connections to the other players are made in the meantime.
         try:
             runtime.port = listen(port)
         except CannotListenError, e:
+            print "Error listening on port %d: %s" % (port, e.socketError[1])
             if options and options.no_socket_retry:
-                raise
+                if not result.called:
+                    stop_connecting()
+                    result.errback(e)
+                return
             delay *= 1 + rand.random()
-            print "Error listening on port %d: %s" % (port, e.socketError[1])
             print "Will try again in %d seconds" % delay
-            time.sleep(delay)
-    print "Listening on port %d" % port
+            listen_calls.append(reactor.callLater(delay, try_listen, delay))
+        else:
+            print "Listening on port %d" % port
+    try_listen(2)
+    if result.called:
+        return result
+
+    use_unix = options and options.unix_sockets and not options.ssl
+    if use_unix:
+        path = unix_socket_path(port, options)
+        # The lock file lets Twisted remove stale sockets left behind
+        # by players which did not shut down cleanly.
+        runtime.unix_port = reactor.listenUNIX(path, factory, mode=0600,
+                                               wantPID=True)
+        print "Listening on %s" % path
 
     for peer_id, player in players.iteritems():
         if peer_id > id:
-            print "Will connect to %s" % player
-            connect(player.host, player.port)
+            client = PeerConnectionFactory(factory)
+            clients.append(client)
+            if use_unix and is_local_host(player.host):
+                path = unix_socket_path(player.port, options)
+                print "Will connect to %s through %s" % (player, path)
+                reactor.connectUNIX(path, client)
+            else:
+                print "Will connect to %s" % player
+                connect(player.host, player.port, client)
+
+    def ready(runtime):
+        cancel_calls(pending_calls)
+        for peer_id in sorted(runtime.connection_times):
+            print "Connected to player %d in %.3f sec" % \
+                (peer_id, runtime.connection_times[peer_id])
+        print "Connected to all players in %.3f sec" % \
+            (time.time() - factory.started)
+        return runtime
+    result.addCallback(ready)
+
+    def give_up():
+        stop_connecting()
+        missing = factory.missing_players()
+        print "Not connected to players %s after %s sec, giving up" % \
+            (", ".join(map(str, missing)), options.ready_timeout)
+        result.errback(TimeoutError("not connected to players %s" %
+                                    ", ".join(map(str, missing))))
+    if options and options.ready_timeout:
+        pending_calls.append(reactor.callLater(options.ready_timeout,
+                                               give_up))
 
     if runtime.using_viff_reactor:
         # Process the deferred queue after every reactor iteration.
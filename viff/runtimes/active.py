@@ -22,12 +22,13 @@ from math import ceil
 
 from twisted.internet.defer import gatherResults, Deferred
 
-from viff.runtime import Share, preprocess, gather_shares
+from viff.runtime import Share, ShareVector, preprocess, gather_shares, \
+     gather_vector
 from viff.runtimes.passive import PassiveRuntime
 from viff.shares import shamir
 from viff.utils.constants import ECHO, READY, SEND
 from viff.utils.matrix import Matrix, hyper
-from viff.utils.util import rand
+from viff.utils.util import rand, operation
 
 
 class BrachaBroadcastMixin:
@@ -68,7 +69,7 @@ class BrachaBroadcastMixin:
             # other words, it sends the message to each player except
             # for this one.
             for protocol in self.protocols.itervalues():
-                protocol.sendData(pc, data_type, message)
+                protocol.sendData(pc, data_type, message, self)
 
             # do actual communication
             self.activate_reactor()
@@ -140,6 +141,7 @@ class BrachaBroadcastMixin:
 
         return result
 
+    @operation
     def broadcast(self, senders, message=None):
         """Perform one or more Bracha broadcast(s).
 
@@ -227,7 +229,7 @@ class TriplesHyperinvertibleMatricesMixin:
         # We send our shares to the verifying players.
         for offset, share in enumerate(svec):
             if T + 1 + offset != self.id:
-                self.protocols[T + 1 + offset].sendShare(pc, share)
+                self.protocols[T + 1 + offset].sendShare(pc, share, self)
 
         if self.id > T:
             # The other players will send us their shares of si_1
@@ -257,8 +259,8 @@ class TriplesHyperinvertibleMatricesMixin:
         # We send our shares to the verifying players.
         for offset, (s1, s2) in enumerate(zip(svec1, svec2)):
             if T + 1 + offset != self.id:
-                self.protocols[T + 1 + offset].sendShare(pc, s1)
-                self.protocols[T + 1 + offset].sendShare(pc, s2)
+                self.protocols[T + 1 + offset].sendShare(pc, s1, self)
+                self.protocols[T + 1 + offset].sendShare(pc, s2, self)
 
         if self.id > T:
             # The other players will send us their shares of si_1
@@ -293,6 +295,7 @@ class TriplesHyperinvertibleMatricesMixin:
         rvec = rvec.transpose().rows[0]
         return svec, rvec
 
+    @operation
     def single_share_random(self, T, degree, field):
         """Share a random secret.
 
@@ -308,6 +311,7 @@ class TriplesHyperinvertibleMatricesMixin:
                                rvec, T, field, degree)
         return result
 
+    @operation
     def double_share_random(self, T, d1, d2, field):
         """Double-share a random secret using two polynomials.
 
@@ -331,6 +335,7 @@ class TriplesHyperinvertibleMatricesMixin:
         # are no pre-processed triples left.
         return self.generate_triples(field, quantity=1, gather=False)[0]
 
+    @operation
     def generate_triples(self, field, quantity=None, gather=True):
         """Generate multiplication triples.
 
@@ -387,6 +392,7 @@ class TriplesPRSSMixin:
         result = self.generate_triples(field, quantity=1, gather=False)
         return result[0]
 
+    @operation
     def generate_triples(self, field, quantity=1, gather=True):
         """Generate *quantity* multiplication triples using PRSS.
 
@@ -434,6 +440,7 @@ class BasicActiveRuntime(PassiveRuntime):
     def get_triple(self, field):
         raise NotImplementedError
 
+    @operation
     def mul(self, share_x, share_y):
         """Multiplication of shares.
 
@@ -470,6 +477,37 @@ class BasicActiveRuntime(PassiveRuntime):
         result.addCallback(lambda (d, e): d * e + d * b + e * a + c)
         return result
 
+    @operation
+    def vector_mul(self, vector_x, vector_y):
+        """Elementwise multiplication of share vectors.
+
+        Preprocessing: 1 multiplication triple per element.
+        Communication: 2 vector openings.
+        """
+        assert isinstance(vector_x, ShareVector), \
+            "vector_x must be a ShareVector."
+
+        if not isinstance(vector_y, ShareVector):
+            return PassiveRuntime.vector_mul(self, vector_x, vector_y)
+
+        field = vector_x.field
+
+        def as_share(value):
+            # Preprocessed triples are field elements, not shares.
+            if isinstance(value, Share):
+                return value
+            return Share(self, field, value)
+
+        triples = [self.get_triple(field)[0] for _ in range(vector_x.size)]
+        a, b, c = [gather_vector(map(as_share, shares))
+                   for shares in zip(*triples)]
+        d = self.vector_open(vector_x - a)
+        e = self.vector_open(vector_y - b)
+
+        def computation(d, e, a, b, c):
+            return d * e + d * b + e * a + c
+        return self._vector_map(computation, [d, e, a, b, c])
+
 
 class ActiveRuntime(TriplesPRSSMixin, BasicActiveRuntime):
     """Default mix of :class:`BasicActiveRuntime` and
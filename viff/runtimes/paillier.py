@@ -30,7 +30,7 @@ from twisted.internet.defer import Deferred, gatherResults
 
 from viff.runtime import Runtime, Share, gather_shares
 from viff.utils.constants import PAILLIER
-from viff.utils.util import rand, find_random_prime
+from viff.utils.util import rand, find_random_prime, operation
 
 
 def L(u, n):
@@ -115,6 +115,7 @@ class PaillierRuntime(Runtime):
         """
         return self.share(inputters, field, number)
 
+    @operation
     def share(self, inputters, field, number=None):
         """Share *number* additively."""
         assert number is None or self.id in inputters
@@ -130,7 +131,7 @@ class PaillierRuntime(Runtime):
 
                 results.append(Share(self, a.field, a))
                 pc = tuple(self.program_counter)
-                self.protocols[self.peer.id].sendShare(pc, b)
+                self.protocols[self.peer.id].sendShare(pc, b, self)
             else:
                 share = self._expect_share(peer_id, field)
                 results.append(share)
@@ -144,12 +145,13 @@ class PaillierRuntime(Runtime):
     def output(self, share, receivers=None):
         return self.open(share, receivers)
 
+    @operation
     def open(self, share, receivers=None):
         """Open *share* to *receivers* (defaults to both players)."""
 
         def exchange(a):
             pc = tuple(self.program_counter)
-            self.protocols[self.peer.id].sendShare(pc, a)
+            self.protocols[self.peer.id].sendShare(pc, a, self)
             result = self._expect_share(self.peer.id, share.field)
             result.addCallback(lambda b: a + b)
             return result
@@ -173,8 +175,14 @@ class PaillierRuntime(Runtime):
         result.addCallback(lambda (a, b): a + b)
         return result
 
+    @operation
     def mul(self, share_a, share_b):
-        """Multiplication of shares."""
+        """Multiplication of shares.
+
+        The encryptions, decryptions and exponentiations are done with
+        :meth:`~viff.runtime.Runtime.defer_to_worker`, so they run in
+        worker processes with the ``--workers`` option.
+        """
         field = getattr(share_a, "field", getattr(share_b, "field", None))
 
         k = self.options.security_parameter
@@ -187,21 +195,34 @@ class PaillierRuntime(Runtime):
         if not isinstance(share_b, Share):
             share_b = Share(self, field, share_b)
 
+        def encrypt_in_worker(m, pubkey):
+            # The randomness is chosen here since the workers cannot
+            # use our random generator, see defer_to_worker.
+            r = rand.randint(1, long(pubkey['n']))
+            return self.defer_to_worker(encrypt_r, m, r, pubkey)
+
         def finish_mul((a, b)):
             pc = tuple(self.program_counter)
             send_data = self.protocols[self.peer.id].sendData
 
-            if hash(pc) % 2 == self.id:
+            # The players have IDs 1 and 2, so exactly one of them
+            # plays the role of P1.
+            if hash(pc) % 2 == self.id % 2:
                 # We play the role of P1.
                 a1, b1 = a, b
-                enc_a1 = encrypt(a1.value, self.player.pubkey)
-                enc_b1 = encrypt(b1.value, self.player.pubkey)
-                send_data(pc, PAILLIER, str(enc_a1))
-                send_data(pc, PAILLIER, str(enc_b1))
+                enc_a1 = encrypt_in_worker(a1.value, self.player.pubkey)
+                enc_b1 = encrypt_in_worker(b1.value, self.player.pubkey)
 
                 enc_c1 = Share(self, field)
                 self._expect_data(self.peer.id, PAILLIER, enc_c1)
-                c1 = enc_c1.addCallback(decrypt, self.player.seckey)
+
+                def send_encryptions((enc_a1, enc_b1)):
+                    send_data(pc, PAILLIER, str(enc_a1), self)
+                    send_data(pc, PAILLIER, str(enc_b1), self)
+                self.schedule_callback(gatherResults([enc_a1, enc_b1]),
+                                       send_encryptions)
+                c1 = enc_c1.addCallback(lambda c: self.defer_to_worker(
+                        decrypt, c, self.player.seckey))
                 c1.addCallback(lambda c: long(c) + a1 * b1)
                 return c1
             else:
@@ -216,20 +237,24 @@ class PaillierRuntime(Runtime):
 
                 nsq = self.peer.pubkey['n'] ** 2
                 # Calculate a1 * b2 and b1 * a2 inside the encryption.
-                enc_a1_b2 = enc_a1.addCallback(pow, b2.value, nsq)
-                enc_b1_a2 = enc_b1.addCallback(pow, a2.value, nsq)
+                enc_a1_b2 = enc_a1.addCallback(
+                    lambda c: self.defer_to_worker(pow, c, b2.value, nsq))
+                enc_b1_a2 = enc_b1.addCallback(
+                    lambda c: self.defer_to_worker(pow, c, a2.value, nsq))
 
                 # Chose and encrypt r.
                 r = rand.randint(0, 2 * field.modulus ** 2 + 2 ** k)
-                enc_r = encrypt(r, self.peer.pubkey)
+                enc_r = encrypt_in_worker(r, self.peer.pubkey)
 
-                c1 = gatherResults([enc_a1_b2, enc_b1_a2])
-                c1.addCallback(lambda (a, b): a * b * enc_r)
-                c1.addCallback(lambda c: send_data(pc, PAILLIER, str(c)))
+                c1 = gatherResults([enc_a1_b2, enc_b1_a2, enc_r])
+                c1.addCallback(lambda (a, b, enc_r): a * b * enc_r)
+                def send_result(c):
+                    send_data(pc, PAILLIER, str(c), self)
+                self.schedule_callback(c1, send_result)
 
                 c2 = a2 * b2 - r
                 return Share(self, field, c2)
 
         result = gather_shares([share_a, share_b])
-        result.addCallback(finish_mul)
+        self.schedule_callback(result, finish_mul)
         return result
@@ -24,10 +24,11 @@ import operator
 from twisted.internet.defer import gatherResults
 
 from viff.math.field import GF256, FieldElement
-from viff.runtime import Runtime, Share, ShareList, gather_shares, preprocess
+from viff.runtime import Runtime, Share, ShareList, ShareVector, \
+     deepest_round, gather_shares, gather_vector, split_vector, preprocess
 from viff.shares import shamir
 from viff.shares.prss import prss, prss_lsb, prss_zero, prss_multi
-from viff.utils.util import rand, profile
+from viff.utils.util import rand, profile, operation
 
 
 class PassiveRuntime(Runtime):
@@ -57,6 +58,7 @@ class PassiveRuntime(Runtime):
     def output(self, share, receivers=None, threshold=None):
         return self.open(share, receivers, threshold)
 
+    @operation
     def open(self, share, receivers=None, threshold=None):
         """Open a secret sharing.
 
@@ -93,7 +95,7 @@ class PassiveRuntime(Runtime):
             for peer_id in receivers:
                 if peer_id != self.id:
                     pc = tuple(self.program_counter)
-                    self.protocols[peer_id].sendShare(pc, share)
+                    self.protocols[peer_id].sendShare(pc, share, self)
             # Receive and recombine shares if this player is a receiver.
             if self.id in receivers:
                 deferreds = []
@@ -115,20 +117,112 @@ class PassiveRuntime(Runtime):
         if self.id in receivers:
             return result
 
+    @operation
+    def open_many(self, shares, receivers=None, threshold=None):
+        """Open a list of secret sharings at once.
+
+        The sharings must be over the same field. The *receivers*
+        and *threshold* are as for :meth:`open`. Returns a list of
+        :class:`~viff.runtime.Share` objects for the opened values.
+
+        Communication cost: every player sends one message with all
+        its shares to each receiving player, see :meth:`vector_open`.
+        """
+        assert shares, "Cannot open an empty list of shares."
+        for share in shares:
+            assert isinstance(share, Share)
+        opened = self.vector_open(gather_vector(shares), receivers, threshold)
+
+        if opened is not None:
+            return split_vector(opened)
+
+    @operation
+    def vector_open(self, vector, receivers=None, threshold=None):
+        """Open a :class:`~viff.runtime.ShareVector`.
+
+        The *receivers* and *threshold* are as for :meth:`open`. The
+        receivers get a share vector with the opened values.
+
+        Communication cost: every player sends one message with all
+        its shares to each receiving player. The shares are
+        recombined with a single recombination vector.
+        """
+        assert isinstance(vector, ShareVector)
+        field = vector.field
+        if receivers is None:
+            receivers = self.players.keys()
+        if threshold is None:
+            threshold = self.threshold
+
+        def filter_good_shares(results):
+            return [result[1] for result in results
+                    if result is not None and result[0]][:threshold + 1]
+
+        def exchange(values):
+            pc = self.program_counter
+            for peer_id in receivers:
+                if peer_id != self.id:
+                    self.protocols[peer_id].sendShares(pc, values, self)
+            if self.id in receivers:
+                deferreds = []
+                for peer_id in self.players:
+                    if peer_id == self.id:
+                        d = Share(self, field, (field(peer_id), values))
+                    else:
+                        d = self._expect_shares(peer_id, field)
+                        d.addCallback(lambda s, peer_id: (field(peer_id), s),
+                                      peer_id)
+                    deferreds.append(d)
+                result = ShareList(deferreds, threshold + 1)
+                result.addCallback(filter_good_shares)
+                result.addCallback(shamir.recombine_vector)
+                return result
+
+        result = vector.clone()
+        self.schedule_callback(result, exchange)
+
+        # do actual communication
+        self.activate_reactor()
+
+        if self.id in receivers:
+            return result
+
+    def _eager_result(self, share, operands):
+        """Return *share*, which was computed right away from the
+        *operands*, in the deepest round of the operands."""
+        if self.track_depth:
+            share.round = deepest_round(operands)
+        return share
+
     @profile
     def add(self, share_a, share_b):
         """Addition of shares.
 
+        If the operands have values already, the result is computed
+        right away instead of through callbacks, unless the
+        ``--no-eager`` option is given. The same holds for the other
+        local operations.
+
         Communication cost: none.
         """
+        eager = self.options.eager and share_a.is_resolved()
         if not isinstance(share_b, Share):
             # Addition with constant. share_a always is a Share by
             # operator overloading in Share. Clone share_a to avoid
             # changing it.
+            if eager:
+                return self._eager_result(
+                    Share(self, share_a.field, share_b + share_a.result),
+                    [share_a])
             result = share_a.clone()
             result.addCallback(lambda a, b: b + a, share_b)
             return result
 
+        if eager and share_b.is_resolved():
+            return self._eager_result(
+                Share(self, share_a.field, share_a.result + share_b.result),
+                [share_a, share_b])
+
         result = gather_shares([share_a, share_b])
         result.addCallback(lambda (a, b): a + b)
         return result
@@ -144,6 +238,12 @@ class PassiveRuntime(Runtime):
         if not isinstance(share_b, Share):
             share_b = Share(self, field, share_b)
 
+        if self.options.eager and share_a.is_resolved() \
+                and share_b.is_resolved():
+            return self._eager_result(
+                Share(self, share_a.field, share_a.result - share_b.result),
+                [share_a, share_b])
+
         result = gather_shares([share_a, share_b])
         result.addCallback(lambda (a, b): a - b)
         return result
@@ -169,10 +269,22 @@ class PassiveRuntime(Runtime):
         def computation(shares, coefficients):
             return sum(map(operator.mul, coefficients, shares))
 
+        if self.options.eager:
+            for share in shares:
+                if not share.is_resolved():
+                    break
+            else:
+                values = [share.result for share in shares]
+                return self._eager_result(
+                    Share(self, shares[0].field,
+                          computation(values, coefficients)),
+                    shares)
+
         result = gather_shares(shares)
         result.addCallback(computation, coefficients)
         return result
 
+    @operation
     @profile
     def mul(self, share_a, share_b):
         """Multiplication of shares.
@@ -186,6 +298,10 @@ class PassiveRuntime(Runtime):
             # Local multiplication. share_a always is a Share by
             # operator overloading in Share. We clone share_a first
             # to avoid changing it.
+            if self.options.eager and share_a.is_resolved():
+                return self._eager_result(
+                    Share(self, share_a.field, share_b * share_a.result),
+                    [share_a])
             result = share_a.clone()
             result.addCallback(lambda a: share_b * a)
             return result
@@ -242,6 +358,149 @@ class PassiveRuntime(Runtime):
         else:
             return share_a + share_b - 2 * share_a * share_b
 
+    def _vector_map(self, func, operands):
+        """Apply *func* elementwise to the *operands*.
+
+        The operands are :class:`~viff.runtime.ShareVector` objects,
+        lists of constants or single constants used for all elements.
+        The result is a share vector which is triggered when the share
+        vectors among the operands are ready.
+        """
+        vectors = [o for o in operands if isinstance(o, ShareVector)]
+        assert vectors, "At least one operand must be a share vector."
+        field = vectors[0].field
+        size = vectors[0].size
+
+        columns = []
+        for operand in operands:
+            if isinstance(operand, ShareVector):
+                assert operand.size == size, \
+                    "Share vectors must have the same size."
+                columns.append(None)
+            elif isinstance(operand, (list, tuple)):
+                assert len(operand) == size, \
+                    "Lists of constants must have the size of the vectors."
+                columns.append(operand)
+            else:
+                assert not isinstance(operand, Share), \
+                    "Shares cannot be combined with share vectors."
+                columns.append([operand] * size)
+
+        def computation(values):
+            values = iter(values)
+            return map(func, *[column if column is not None else values.next()
+                               for column in columns])
+
+        if self.options.eager:
+            for vector in vectors:
+                if not vector.is_resolved():
+                    break
+            else:
+                values = [vector.result for vector in vectors]
+                return self._eager_result(
+                    ShareVector(self, field, size, computation(values)),
+                    vectors)
+
+        result = ShareVector(self, field, size)
+        gathered = gather_shares(vectors)
+
+        def finish(values):
+            if gathered.round is not None:
+                result.round = gathered.round
+            return computation(values)
+        gathered.addCallback(finish)
+        gathered.chainDeferred(result)
+        return result
+
+    @profile
+    def vector_add(self, vector_a, vector_b):
+        """Elementwise addition of share vectors.
+
+        Either operand may also be a list of constants or a constant
+        added to every element.
+
+        Communication cost: none.
+        """
+        return self._vector_map(operator.add, [vector_a, vector_b])
+
+    def vector_sub(self, vector_a, vector_b):
+        """Elementwise subtraction of share vectors.
+
+        Communication cost: none.
+        """
+        return self._vector_map(operator.sub, [vector_a, vector_b])
+
+    @profile
+    def vector_lin_comb(self, coefficients, vectors):
+        """Linear combination of share vectors.
+
+        Each vector is scaled by its constant coefficient and the
+        results are added elementwise.
+
+        Communication cost: none.
+        """
+        for coeff in coefficients:
+            assert not isinstance(coeff, Share), \
+                "Coefficients should not be shares."
+
+        for vector in vectors:
+            assert isinstance(vector, ShareVector), \
+                "Vectors should be share vectors."
+
+        assert len(coefficients) == len(vectors), \
+            "Number of coefficients and vectors should be equal."
+
+        def computation(*values):
+            return sum(map(operator.mul, coefficients, values))
+
+        return self._vector_map(computation, vectors)
+
+    @operation
+    @profile
+    def vector_mul(self, vector_a, vector_b):
+        """Elementwise multiplication of share vectors.
+
+        If *vector_b* is a constant or a list of constants, the vector
+        is scaled locally.
+
+        Communication cost: 1 Shamir sharing of each element, sent to
+        each player as a single message.
+        """
+        assert isinstance(vector_a, ShareVector), \
+            "vector_a must be a ShareVector."
+
+        if not isinstance(vector_b, ShareVector):
+            return self._vector_map(operator.mul, [vector_a, vector_b])
+
+        field = vector_a.field
+
+        def share_recombine(products):
+            sharings = [shamir.share(product, self.threshold,
+                                     self.num_players)
+                        for product in products]
+
+            exchanged_shares = []
+            for index in range(self.num_players):
+                peer_id = field(index + 1)
+                shares = [sharing[index][1] for sharing in sharings]
+                d = self._exchange_share_vectors(peer_id.value, field, shares)
+                d.addCallback(lambda shares, peer_id: (peer_id, shares),
+                              peer_id)
+                exchanged_shares.append(d)
+
+            # Recombine the first 2t+1 shares.
+            result = gather_shares(exchanged_shares[:2 * self.threshold + 1])
+            result.addCallback(shamir.recombine_vector)
+            return result
+
+        result = self._vector_map(operator.mul, [vector_a, vector_b])
+        self.schedule_callback(result, share_recombine)
+
+        # do actual communication
+        self.activate_reactor()
+
+        return result
+
     def prss_key(self):
         """Create unique key for PRSS.
 
@@ -263,6 +522,7 @@ class PassiveRuntime(Runtime):
         self.increment_pc()
         return tuple(self.program_counter)
 
+    @operation
     def prss_share(self, inputters, field, element=None):
         """Creates pseudo-random secret sharings.
 
@@ -312,7 +572,7 @@ class PassiveRuntime(Runtime):
             pc = tuple(self.program_counter)
             for peer_id in self.players:
                 if self.id != peer_id:
-                    self.protocols[peer_id].sendShare(pc, correction)
+                    self.protocols[peer_id].sendShare(pc, correction, self)
 
         # Receive correction value from inputters and compute share.
         result = []
@@ -331,6 +591,7 @@ class PassiveRuntime(Runtime):
         else:
             return result
 
+    @operation
     def prss_share_random(self, field, binary=False):
         """Generate shares of a uniformly random element from the field given.
 
@@ -370,6 +631,7 @@ class PassiveRuntime(Runtime):
         self.schedule_callback(result, finish, share, binary)
         return result
 
+    @operation
     def prss_share_random_multi(self, field, quantity, binary=False):
         """Does the same as calling *quantity* times :meth:`prss_share_random`,
         but with less calls to the PRF. Sampling of a binary element is only
@@ -392,6 +654,7 @@ class PassiveRuntime(Runtime):
                             modulus, quantity)
         return [Share(self, field, share) for share in shares]
 
+    @operation
     def prss_share_zero(self, field, quantity):
         """Generate *quantity* shares of the zero element from the
         field given.
@@ -405,6 +668,7 @@ class PassiveRuntime(Runtime):
                                field, prfs, prss_key, quantity)
         return [Share(self, field, zero_share[i]) for i in range(quantity)]
 
+    @operation
     def prss_double_share(self, field, quantity):
         """Make *quantity* double-sharings using PRSS.
 
@@ -485,6 +749,7 @@ class PassiveRuntime(Runtime):
         shares = self.prss_share_random_multi(GF256, quantity)
         return [gatherResults(self.powerchain(share, max)) for share in shares]
 
+    @operation
     def input(self, inputters, field, number=None, threshold=None):
         """Input *number* to the computation.
 
@@ -492,6 +757,7 @@ class PassiveRuntime(Runtime):
         """
         return self.shamir_share(inputters, field, number, threshold)
 
+    @operation
     def shamir_share(self, inputters, field, number=None, threshold=None):
         """Secret share *number* over *field* using Shamir's method.
 
@@ -545,7 +811,8 @@ class PassiveRuntime(Runtime):
                     if other_id.value == self.id:
                         results.append(Share(self, share.field, share))
                     else:
-                        self.protocols[other_id.value].sendShare(pc, share)
+                        self.protocols[other_id.value].sendShare(pc, share,
+                                                                 self)
             else:
                 results.append(self._expect_share(peer_id, field))
 
@@ -0,0 +1,475 @@
+# Copyright 2009 VIFF Development Team.
+#
+# This file is part of VIFF, the Virtual Ideal Functionality Framework.
+#
+# VIFF is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License (LGPL) as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# VIFF is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Lesser General
+# Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with VIFF. If not, see <http://www.gnu.org/licenses/>.
+
+"""Long-lived service running many computations. A :class:`Service`
+wraps a connected runtime and runs jobs on it: a job is a protocol
+function registered under a name, called with the inputs of this
+player::
+
+  def total(runtime, value):
+      shares = runtime.shamir_share(sorted(runtime.players), Zp, value)
+      return runtime.open(sum(shares[1:], shares[0]))
+
+  service = Service(runtime, {"total": total})
+  result = service.submit(1, "total", 42)
+
+Each job runs in its own session, see
+:meth:`~viff.runtime.Runtime.open_session`, so the connections, the
+caches of the players and the process stay warm between jobs. All
+players must submit the same jobs with the same job IDs.
+
+With preprocessing enabled, the preprocessed data a function needs
+is learned from the first job submitted for it. Later jobs of the
+function have their data preprocessed as soon as that job is done,
+in a session of their own, while they wait in the queue or for the
+other players. Job *j* runs in session ``2 * j`` and is preprocessed
+in session ``2 * j + 1``.
+
+Jobs can also be submitted from other processes with the line based
+JSON protocol of :class:`JobProtocol`. :func:`connect_service` connects
+to it and returns a :class:`ServiceClient`.
+"""
+
+import json
+import time
+from collections import deque
+
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred, gatherResults, maybeDeferred
+from twisted.internet.protocol import ClientCreator, ServerFactory
+from twisted.protocols.basic import LineReceiver
+
+from viff.math.field import FieldElement
+
+
+class JobError(Exception):
+    """A job failed or could not be submitted."""
+
+
+class Job(object):
+    """A computation submitted to a :class:`Service`.
+
+    The *result* is a :class:`Deferred` which fires with the result of
+    the protocol function. The times are taken with
+    :func:`time.time` and are :const:`None` until they happen.
+    """
+
+    def __init__(self, job_id, function, inputs):
+        self.id = job_id
+        self.function = function
+        self.inputs = inputs
+        self.result = Deferred()
+        #: Fires when the data preprocessed for the job is ready.
+        self.preprocessed = Deferred()
+        self.submitted = time.time()
+        #: Fires with the data this job needs preprocessed when the
+        #: job is used to learn it, see :class:`Service`.
+        self.learn = None
+        self.preprocessing_started = None
+        self.preprocessing_finished = None
+        self.started = None
+        self.finished = None
+
+    def statistics(self):
+        """Return the time spent in each phase of the job in seconds.
+
+        The ``"queued"`` time is the time from submission until the
+        job started, ``"preprocessing"`` is the time spent generating
+        preprocessed data, ``"run"`` is the time from the start of
+        the job until its result was ready, and ``"latency"`` is the
+        total time from submission to result."""
+        def elapsed(start, stop):
+            if start is None or stop is None:
+                return None
+            return stop - start
+        return {"function": self.function,
+                "queued": elapsed(self.submitted, self.started),
+                "preprocessing": elapsed(self.preprocessing_started,
+                                         self.preprocessing_finished),
+                "run": elapsed(self.started, self.finished),
+                "latency": elapsed(self.submitted, self.finished)}
+
+
+def _plain(value):
+    """Convert a result into something which can be dumped as JSON."""
+    if isinstance(value, FieldElement):
+        return value.value
+    if isinstance(value, (list, tuple)):
+        return [_plain(item) for item in value]
+    return value
+
+
+class Service(object):
+    """Run jobs on a connected *runtime*.
+
+    The *functions* map names to protocol functions which are called
+    as ``function(runtime, *inputs)`` and must return a
+    :class:`Deferred` or a list of them. At most *max_jobs* jobs run
+    at a time and the rest wait in a queue.
+
+    If *preprocess* is set, the first job submitted for each function
+    runs without preprocessing and the data it needs is recorded. The
+    data of the later jobs of the function is then preprocessed
+    before they start. With a limit on the number of jobs or with
+    preprocessing, all players must submit the jobs in the same
+    order, or they may end up waiting for each other forever.
+    """
+
+    def __init__(self, runtime, functions, max_jobs=None, preprocess=False):
+        self.runtime = runtime
+        self.functions = dict(functions)
+        self.max_jobs = max_jobs
+        self.preprocess = preprocess
+        #: Jobs waiting to be started.
+        self.queue = deque()
+        #: Mapping from job ID to the jobs which are running.
+        self.running = {}
+        #: The IDs of the jobs submitted. They are never used again,
+        #: since the sessions of a job cannot be reopened.
+        self.job_ids = set()
+        #: Mapping from function name to a :class:`Deferred` which
+        #: fires with the data the function needs preprocessed, with
+        #: program counters relative to the session of the job.
+        self.programs = {}
+        #: Mapping from function name to ``[jobs, failed, total
+        #: latency, minimum latency, maximum latency]``.
+        self.function_stats = {}
+        self.started = time.time()
+        self.completed = 0
+        self.failed = 0
+
+    def submit(self, job_id, function, *inputs):
+        """Submit a job and return a :class:`Deferred` which fires
+        with its result.
+
+        The *job_id* must be a positive integer which is not used by
+        any other job, and the same for all players. A :exc:`JobError`
+        is raised for a bad ID or an unknown *function*.
+        """
+        return self.submit_job(job_id, function, inputs).result
+
+    def submit_job(self, job_id, function, inputs):
+        """Submit a job like :meth:`submit` and return the
+        :class:`Job`."""
+        if isinstance(job_id, bool) or not isinstance(job_id, (int, long)) \
+                or job_id <= 0:
+            raise JobError("Job ID must be a positive integer: %r"
+                           % (job_id,))
+        # The job runs in session 2 * job_id and is preprocessed in
+        # session 2 * job_id + 1.
+        sessions = (2 * job_id, 2 * job_id + 1)
+        if job_id in self.job_ids or \
+                self.runtime.program_counter[0] in sessions or \
+                any(session in self.runtime.sessions for session in sessions):
+            raise JobError("Job ID %d is already in use." % job_id)
+        if function not in self.functions:
+            raise JobError("Unknown function: %s" % function)
+        self.job_ids.add(job_id)
+        job = Job(job_id, function, inputs)
+        self.runtime.open_session(2 * job_id)
+        if not self.preprocess:
+            job.preprocessed.callback(None)
+        elif function not in self.programs:
+            # This job will tell us what to preprocess.
+            job.learn = self.programs[function] = Deferred()
+            job.preprocessed.callback(None)
+        else:
+            self.programs[function].addCallback(self._preprocess, job)
+        self.queue.append(job)
+        self._start_jobs()
+        return job
+
+    def _preprocess(self, program, job):
+        """Generate the data *job* needs in a session of its own."""
+        if not program:
+            job.preprocessed.callback(None)
+            return program
+
+        prefix = (2 * job.id,)
+        program_counters = dict([(key, [prefix + pc for pc in pcs])
+                                 for key, pcs in program.iteritems()])
+        preprocessing = self.runtime.open_session(2 * job.id + 1)
+        job.preprocessing_started = time.time()
+
+        def move_pool(_):
+            job.preprocessing_finished = time.time()
+            session = self.runtime.sessions[2 * job.id]
+            session._pool.update(preprocessing._pool)
+
+        def close_session(result):
+            # The session is closed whether preprocessing failed or not.
+            self.runtime.close_session(2 * job.id + 1)
+            return result
+
+        ready = maybeDeferred(preprocessing.preprocess, program_counters)
+        ready.addCallback(move_pool)
+        ready.addBoth(close_session)
+        ready.chainDeferred(job.preprocessed)
+        return program
+
+    def _start_jobs(self):
+        while self.queue and (self.max_jobs is None or
+                              len(self.running) < self.max_jobs):
+            job = self.queue.popleft()
+            self.running[job.id] = job
+            job.preprocessed.addCallback(self._run, job)
+            job.preprocessed.addErrback(self._failed, job)
+
+    def _run(self, _, job):
+        job.started = time.time()
+        session = self.runtime.sessions[2 * job.id]
+        result = self.functions[job.function](session, *job.inputs)
+        if isinstance(result, (list, tuple)):
+            result = gatherResults(list(result))
+        result.addCallback(self._finished, job, session)
+        result.addErrback(self._failed, job)
+
+    def _finished(self, result, job, session):
+        job.finished = time.time()
+        if job.learn is not None:
+            program = dict([(key, [pc[1:] for pc in pcs])
+                            for key, pcs in session._needed_data.iteritems()])
+            job.learn.callback(program)
+        self.completed += 1
+        self._record(job, True)
+        self._done(job)
+        job.result.callback(result)
+
+    def _failed(self, failure, job):
+        job.finished = time.time()
+        if job.learn is not None:
+            # The later jobs run without preprocessing.
+            job.learn.callback(None)
+        self.failed += 1
+        self._record(job, False)
+        self._done(job)
+        job.result.errback(failure)
+
+    def _record(self, job, succeeded):
+        latency = job.finished - job.submitted
+        stats = self.function_stats.get(job.function)
+        if stats is None:
+            stats = [0, 0, 0.0, latency, latency]
+            self.function_stats[job.function] = stats
+        if succeeded:
+            stats[0] += 1
+            stats[2] += latency
+        else:
+            stats[1] += 1
+        stats[3] = min(stats[3], latency)
+        stats[4] = max(stats[4], latency)
+
+    def _done(self, job):
+        del self.running[job.id]
+        self.runtime.close_session(2 * job.id)
+        self._start_jobs()
+
+    def statistics(self):
+        """Return statistics on the jobs run so far.
+
+        The result is a dictionary which can be dumped as JSON. The
+        ``"throughput"`` entry is the number of jobs completed per
+        second since the service started. The ``"functions"`` entry
+        has the number of completed and failed jobs and the mean,
+        minimum and maximum latency for each function."""
+        uptime = time.time() - self.started
+        functions = {}
+        for name, stats in self.function_stats.iteritems():
+            jobs, failed, total, least, most = stats
+            functions[name] = {"jobs": jobs,
+                               "failed": failed,
+                               "mean_latency": total / max(jobs, 1),
+                               "min_latency": least,
+                               "max_latency": most}
+        return {"uptime": uptime,
+                "completed": self.completed,
+                "failed": self.failed,
+                "running": len(self.running),
+                "queued": len(self.queue),
+                "throughput": self.completed / max(uptime, 1e-6),
+                "functions": functions}
+
+    def print_statistics(self):
+        """Print the :meth:`statistics`."""
+        stats = self.statistics()
+        print "Jobs: %d completed, %d failed in %.1f sec (%.2f per second)" \
+            % (stats["completed"], stats["failed"], stats["uptime"],
+               stats["throughput"])
+        for name in sorted(stats["functions"]):
+            entry = stats["functions"][name]
+            print "  %s: %d jobs, %d failed, latency %.3f sec " \
+                  "(min %.3f, max %.3f)" % \
+                  (name, entry["jobs"], entry["failed"],
+                   entry["mean_latency"], entry["min_latency"],
+                   entry["max_latency"])
+
+
+class JobProtocol(LineReceiver):
+    """Accept jobs for a :class:`Service` from a local client.
+
+    Each line is a JSON object. A job is submitted with::
+
+      {"id": 7, "function": "total", "inputs": [42]}
+
+    and answered, when the job is done, with an object holding the
+    ``"id"`` and either the ``"result"`` and the job
+    ``"statistics"``, or an ``"error"``. The object
+    ``{"command": "statistics"}`` is answered with the statistics of
+    the service and ``{"command": "shutdown"}`` shuts the runtime
+    down, see :meth:`~viff.runtime.Runtime.shutdown`.
+    """
+
+    delimiter = "\n"
+
+    def lineReceived(self, line):
+        service = self.factory.service
+        try:
+            request = json.loads(line)
+        except ValueError, e:
+            self.reply({"error": "bad request: %s" % e})
+            return
+        if not isinstance(request, dict):
+            self.reply({"error": "bad request: not an object"})
+            return
+
+        command = request.get("command", "job")
+        if command == "statistics":
+            self.reply({"statistics": service.statistics()})
+        elif command == "shutdown":
+            self.reply({"shutdown": True})
+            service.runtime.shutdown()
+        elif command == "job":
+            job_id = request.get("id")
+            function = request.get("function")
+            inputs = request.get("inputs", [])
+            if not isinstance(function, basestring):
+                self.reply({"id": job_id, "error": "bad request: "
+                            "the function must be a string"})
+                return
+            if not isinstance(inputs, list):
+                self.reply({"id": job_id, "error": "bad request: "
+                            "the inputs must be a list"})
+                return
+            try:
+                job = service.submit_job(job_id, function, inputs)
+            except JobError, e:
+                self.reply({"id": job_id, "error": str(e)})
+                return
+            job.result.addCallback(self.job_done, job)
+            job.result.addErrback(self.job_failed, job)
+        else:
+            self.reply({"error": "unknown command: %s" % command})
+
+    def job_done(self, result, job):
+        self.reply({"id": job.id, "result": _plain(result),
+                    "statistics": job.statistics()})
+
+    def job_failed(self, failure, job):
+        self.reply({"id": job.id, "error": failure.getErrorMessage()})
+
+    def reply(self, response):
+        self.sendLine(json.dumps(response, sort_keys=True))
+
+
+class JobFactory(ServerFactory):
+    """Factory for :class:`JobProtocol` connections to *service*."""
+
+    protocol = JobProtocol
+
+    def __init__(self, service):
+        self.service = service
+
+
+def listen_for_jobs(service, port, interface="localhost"):
+    """Accept jobs for *service* on TCP *port*.
+
+    Only local clients are accepted by default. Returns the listening
+    port, see :meth:`twisted.internet.interfaces.IReactorTCP.listenTCP`.
+    """
+    return reactor.listenTCP(port, JobFactory(service), interface=interface)
+
+
+class ServiceClient(LineReceiver):
+    """Client for the protocol of :class:`JobProtocol`.
+
+    The statistics of each job are stored in :attr:`statistics` when
+    the result arrives."""
+
+    delimiter = "\n"
+
+    def __init__(self):
+        self._jobs = {}
+        self._requests = deque()
+        #: Mapping from job ID to the statistics of the job.
+        self.statistics = {}
+
+    def submit(self, job_id, function, *inputs):
+        """Submit a job. Returns a :class:`Deferred` which fires with
+        the result or fails with a :exc:`JobError`."""
+        assert job_id not in self._jobs, "Job %d is already running." % job_id
+        deferred = self._jobs[job_id] = Deferred()
+        self.send({"id": job_id, "function": function,
+                   "inputs": list(inputs)})
+        return deferred
+
+    def service_statistics(self):
+        """Return a :class:`Deferred` which fires with the
+        :meth:`Service.statistics` of the service."""
+        return self._request({"command": "statistics"})
+
+    def shutdown(self):
+        """Shut down the runtime of the service. Returns a
+        :class:`Deferred` which fires when the service has received
+        the command."""
+        return self._request({"command": "shutdown"})
+
+    def _request(self, request):
+        deferred = Deferred()
+        self._requests.append(deferred)
+        self.send(request)
+        return deferred
+
+    def send(self, request):
+        self.sendLine(json.dumps(request, sort_keys=True))
+
+    def lineReceived(self, line):
+        response = json.loads(line)
+        job_id = response.get("id")
+        if job_id in self._jobs:
+            deferred = self._jobs.pop(job_id)
+            if "error" in response:
+                deferred.errback(JobError(response["error"]))
+            else:
+                self.statistics[job_id] = response["statistics"]
+                deferred.callback(response["result"])
+        elif "statistics" in response:
+            self._requests.popleft().callback(response["statistics"])
+        elif "shutdown" in response:
+            self._requests.popleft().callback(None)
+        elif self._requests:
+            self._requests.popleft().errback(JobError(response["error"]))
+
+
+def connect_service(port, host="localhost"):
+    """Connect to a service listening on *port*, see
+    :func:`listen_for_jobs`.
+
+    Returns a :class:`Deferred` which fires with a
+    :class:`ServiceClient` when the connection is made, like
+    :func:`~viff.runtime.create_runtime` fires with the runtime.
+    """
+    return ClientCreator(reactor, ServiceClient).connectTCP(host, port)
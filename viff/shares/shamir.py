@@ -112,9 +112,35 @@ def recombine(shares, x_recomb=0):
     {3}
     """
     xs, ys = zip(*shares)
+    vector = _recombination_vector(xs, x_recomb)
+    return sum(map(operator.mul, ys, vector))
+
+
+def recombine_vector(shares, x_recomb=0):
+    """Recombines many sharings at once.
+
+    Shares is a list of *threshold* + 1 ``(player id, shares)``
+    pairs, where the second component is a list with a share of each
+    of the sharings. The recombination vector is computed only once.
+
+    >>> from viff.math.field import GF
+    >>> Zp = GF(19)
+    >>> shares = [(Zp(i), [7 * Zp(i) + 3, 2 * Zp(i) + 5])
+    ...           for i in range(1, 3)]
+    >>> recombine_vector(shares)
+    [{3}, {5}]
+    """
+    xs, columns = zip(*shares)
+    vector = _recombination_vector(xs, x_recomb)
+    return [sum(map(operator.mul, ys, vector)) for ys in zip(*columns)]
+
+
+def _recombination_vector(xs, x_recomb):
+    """Return the recombination vector for the player ids *xs* and
+    the point *x_recomb*."""
     key = xs + (x_recomb,)
     try:
-        vector = _recombination_vectors[key]
+        return _recombination_vectors[key]
     except KeyError:
         vector = []
         for i, x_i in enumerate(xs):
@@ -122,7 +148,7 @@ def recombine(shares, x_recomb=0):
                        for k, x_k in enumerate(xs) if k != i]
             vector.append(reduce(operator.mul, factors))
         _recombination_vectors[key] = vector
-    return sum(map(operator.mul, ys, vector))
+        return vector
 
 
 def verify_sharing(shares, degree):
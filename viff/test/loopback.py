@@ -77,9 +77,12 @@ class _LoopbackQueue(object):
 
     def __init__(self):
         self._queue = []
+        #: Number of bytes in the queue.
+        self.size = 0
 
     def put(self, v):
         self._queue.append(v)
+        self.size += len(v)
         if self._notificationDeferred is not None:
             d, self._notificationDeferred = self._notificationDeferred, None
             d.callback(None)
@@ -88,7 +91,9 @@ class _LoopbackQueue(object):
         return bool(self._queue)
 
     def get(self):
-        return self._queue.pop(0)
+        v = self._queue.pop(0)
+        self.size -= len(v)
+        return v
 
 
 class _LoopbackAddress(object):
@@ -103,11 +108,21 @@ class _LoopbackTransport(object):
 
     # ITransport
 
-    def __init__(self, q):
+    def __init__(self, q, window=None):
         self.q = q
         self._buffer = ''
         self._pending = None
         self._will_disconnect = False
+        #: Number of bytes which can be written but not yet read by
+        #: the other side before a streaming producer is paused, like
+        #: the buffers of a TCP connection. None means no limit.
+        self.window = window
+        self.producer_paused = False
+        #: The protocol does not read the data sent to it, see
+        #: pauseProducing.
+        self.reading_paused = False
+        #: The queue holding the data sent to the protocol.
+        self.incoming = None
 
     def close(self):
         self.q.disconnect = True
@@ -159,10 +174,19 @@ class _LoopbackTransport(object):
     def write(self, bytes):
         self._buffer += bytes
         self._schedule_write()
+        self._check_window()
 
     def writeSequence(self, iovec):
         self._buffer += ''.join(iovec)
         self._schedule_write()
+        self._check_window()
+
+    def _check_window(self):
+        if self.window is not None and self.producer is not None and \
+                self.streamingProducer and not self.producer_paused and \
+                len(self._buffer) + self.q.size > self.window:
+            self.producer_paused = True
+            self.producer.pauseProducing()
 
     def loseConnection(self):
         self._will_disconnect = True
@@ -189,10 +213,24 @@ class _LoopbackTransport(object):
     def _pollProducer(self):
         if self.producer is not None and not self.streamingProducer:
             self.producer.resumeProducing()
+        if self.producer_paused and \
+                len(self._buffer) + self.q.size <= self.window:
+            self.producer_paused = False
+            self.producer.resumeProducing()
+
+    # IPushProducer, for the reading side of the transport.
 
+    def pauseProducing(self):
+        self.reading_paused = True
 
+    def resumeProducing(self):
+        self.reading_paused = False
+        # Wake up the loop delivering the data.
+        reactor.callLater(0, self.incoming.put, '')
 
-def loopbackAsync(server, client):
+
+
+def loopbackAsync(server, client, window=None):
     """
     Establish a connection between C{server} and C{client} then transfer data
     between them until the connection is closed. This is often useful for
@@ -204,14 +242,20 @@ def loopbackAsync(server, client):
     @param client: The protocol instance representing the client-side of this
     connection.
 
+    @param window: The number of bytes each side can write before it
+    is paused as a producer until the other side has read them, or
+    None for no limit.
+
     @return: A L{Deferred} which fires when the connection has been closed and
     both sides have received notification of this.
     """
     serverToClient = _LoopbackQueue()
     clientToServer = _LoopbackQueue()
 
-    server.makeConnection(_LoopbackTransport(serverToClient))
-    client.makeConnection(_LoopbackTransport(clientToServer))
+    server.makeConnection(_LoopbackTransport(serverToClient, window))
+    client.makeConnection(_LoopbackTransport(clientToServer, window))
+    server.transport.incoming = clientToServer
+    client.transport.incoming = serverToClient
 
     result = defer.Deferred()
     _loopbackAsyncBody(server, serverToClient, client, clientToServer, result)
@@ -238,7 +282,7 @@ def _loopbackAsyncBody(server, serverToClient, client, clientToServer, result):
     """
     def pump(source, q, target):
         sent = False
-        while q:
+        while q and not target.transport.reading_paused:
             sent = True
             bytes = q.get()
             if bytes:
@@ -0,0 +1,107 @@
+# Copyright 2009 VIFF Development Team.
+#
+# This file is part of VIFF, the Virtual Ideal Functionality Framework.
+#
+# VIFF is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License (LGPL) as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# VIFF is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Lesser General
+# Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with VIFF. If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for viff.circuit."""
+
+from viff.circuit import trace, run
+from viff.mixins.comparison import Toft07Runtime
+from viff.runtime import Share, gather_shares
+from viff.test.util import RuntimeTestCase, protocol
+
+
+def poly(runtime, x, a, b, c):
+    return runtime.open(a * (x * x) + b * x + c)
+
+
+class CircuitTest(RuntimeTestCase):
+    """Tests tracing and execution of circuits."""
+
+    runtime_class = Toft07Runtime
+
+    def shares(self, runtime, values):
+        """Share the *values* with the polynomials x + id."""
+        return [Share(runtime, self.Zp, self.Zp(x + runtime.id))
+                for x in values]
+
+    @protocol
+    def test_trace(self, runtime):
+        """The two multiplications by x form one layer."""
+        circuit, inputs = trace(runtime, poly,
+                                *self.shares(runtime, [2, 3, 5, 7]))
+        self.assertEquals(len(inputs), 4)
+        self.assertEquals(circuit.depth(), 3)
+        ops = [[node.op for node in interactive]
+               for interactive, _ in circuit.layers()]
+        self.assertEquals(ops, [[], ["mul", "mul"], ["mul"], ["open"]])
+
+    @protocol
+    def test_constants_are_local(self, runtime):
+        def protocol(runtime, x):
+            return 3 * x + 1 - x * 2
+
+        circuit, _ = trace(runtime, protocol, *self.shares(runtime, [2]))
+        self.assertEquals(circuit.depth(), 0)
+
+    @protocol
+    def test_run(self, runtime):
+        x, a, b, c = self.shares(runtime, [2, 3, 5, 7])
+        result = run(runtime, poly, x, a, b, c)
+        result.addCallback(self.assertEquals, 3 * 4 + 5 * 2 + 7)
+        return result
+
+    @protocol
+    def test_run_structure(self, runtime):
+        """Lists and tuples of shares are kept as they are."""
+
+        def protocol(runtime, (x, y), values):
+            return [runtime.open(x * y)] + map(runtime.open, values)
+
+        x, y, z = self.shares(runtime, [2, 3, 4])
+        result = run(runtime, protocol, (x, y), [z])
+        self.assertEquals(len(result), 2)
+        result = gather_shares(result)
+        result.addCallback(self.assertEquals, [6, 4])
+        return result
+
+    @protocol
+    def test_one_message_per_layer(self, runtime):
+        """Each layer sends one message to each of the other players."""
+
+        def messages():
+            peers = runtime.traffic_statistics()["peers"]
+            return sum([peer["messages"] for peer in peers.itervalues()])
+
+        def protocol(runtime, values):
+            products = [x * x for x in values]
+            return runtime.open(sum(products[1:], products[0]))
+
+        before = messages()
+        result = run(runtime, protocol, self.shares(runtime, range(10)))
+        result.addCallback(self.assertEquals,
+                           sum([x * x for x in range(10)]))
+        result.addCallback(lambda _: messages() - before)
+        result.addCallback(self.assertEquals, 2 * (runtime.num_players - 1))
+        return result
+
+    @protocol
+    def test_comparison(self, runtime):
+        def protocol(runtime, x, y):
+            return runtime.open((x < y) * 10 + (y >= x))
+
+        result = run(runtime, protocol, *self.shares(runtime, [2, 3]))
+        result.addCallback(self.assertEquals, 11)
+        return result
@@ -15,6 +15,10 @@
 # You should have received a copy of the GNU Lesser General Public
 # License along with VIFF. If not, see <http://www.gnu.org/licenses/>.
 
+from twisted.internet.defer import Deferred
+
+from viff.math.field import GF256
+from viff.runtime import Share
 from viff.test.util import RuntimeTestCase, protocol
 
 class MemoryTest(RuntimeTestCase):
@@ -48,3 +52,47 @@ class MemoryTest(RuntimeTestCase):
         w = x * y + z
         w.addCallback(self.check_empty, runtime)
         return w
+
+    @protocol
+    def test_compact_share(self, runtime):
+        """Check that shares only store what they need."""
+        a = Share(runtime, self.Zp, self.Zp(1))
+        b = Share(runtime, self.Zp)
+        self.assertIdentical(a.kind, b.kind)
+        self.assertEquals(sorted(b.__dict__), ["kind"])
+        self.assertFalse("callbacks" in a.__dict__)
+
+        b.field = GF256
+        self.assertIdentical(b.field, GF256)
+        self.assertIdentical(b.runtime, runtime)
+        self.assertIdentical(a.field, self.Zp)
+
+        d = Share(runtime, self.Zp)
+        c = a + d
+        d.callback(self.Zp(1))
+        self.assertEquals(c.result, 2)
+
+    def test_deferred_attributes(self):
+        """Check the parts of Deferred that shares rely on.
+
+        A share does not call :meth:`Deferred.__init__`, so it gets
+        the default state of a Deferred from the class attributes."""
+        for name, value in [("called", False), ("paused", 0),
+                            ("_suppressAlreadyCalled", False),
+                            ("_runningCallbacks", False),
+                            ("_chainedTo", None)]:
+            self.assertEquals(getattr(Deferred, name), value)
+        self.assertEquals(Share._canceller, None)
+        # Deferred.__init__ must not set anything else.
+        attributes = set(Deferred().__dict__) - set(["_debugInfo"])
+        self.assertEquals(sorted(attributes), ["_canceller", "callbacks"])
+
+    @protocol
+    def test_is_resolved(self, runtime):
+        """Asking if a share is resolved creates no callback list."""
+        a = Share(runtime, self.Zp, self.Zp(1))
+        b = Share(runtime, self.Zp)
+        self.assertTrue(a.is_resolved())
+        self.assertFalse(b.is_resolved())
+        self.assertFalse("callbacks" in a.__dict__)
+        self.assertFalse("callbacks" in b.__dict__)
@@ -0,0 +1,109 @@
+# Copyright 2009 VIFF Development Team.
+#
+# This file is part of VIFF, the Virtual Ideal Functionality Framework.
+#
+# VIFF is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License (LGPL) as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# VIFF is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Lesser General
+# Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with VIFF. If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for viff.netem."""
+
+from twisted.internet.task import Clock
+from twisted.test.proto_helpers import StringTransport
+from twisted.trial.unittest import TestCase
+
+from viff.netem import EmulatedTransport
+
+
+class Producer:
+
+    def __init__(self):
+        self.paused = False
+
+    def pauseProducing(self):
+        self.paused = True
+
+    def resumeProducing(self):
+        self.paused = False
+
+
+class EmulatedTransportTest(TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.inner = StringTransport()
+
+    def make_transport(self, **settings):
+        return EmulatedTransport(self.inner, self.clock, **settings)
+
+    def test_latency(self):
+        transport = self.make_transport(latency=50)
+        transport.write("foo")
+        self.clock.advance(0.049)
+        self.assertEquals(self.inner.value(), "")
+        self.clock.advance(0.002)
+        self.assertEquals(self.inner.value(), "foo")
+        self.assertEquals(transport.round_trip_time(), 0.1)
+
+    def test_bandwidth(self):
+        # 8 kbit/s is 1000 bytes per second.
+        transport = self.make_transport(bandwidth=8)
+        transport.write("x" * 500)
+        transport.write("y" * 500)
+        self.clock.advance(0.51)
+        self.assertEquals(self.inner.value(), "x" * 500)
+        self.clock.advance(0.5)
+        self.assertEquals(self.inner.value(), "x" * 500 + "y" * 500)
+
+    def test_in_order(self):
+        transport = self.make_transport(latency=10, jitter=50, reorder=0.5)
+        data = [str(i) for i in range(100)]
+        for item in data:
+            transport.write(item)
+        self.clock.pump([0.01] * 20)
+        self.assertEquals(self.inner.value(), "".join(data))
+        self.assertEquals(transport.backlog, 0)
+
+    def test_backpressure(self):
+        transport = self.make_transport(latency=10)
+        producer = Producer()
+        transport.registerProducer(producer, True)
+        transport.write("x" * transport.bufferSize)
+        self.assertFalse(producer.paused)
+        transport.write("x")
+        self.assertTrue(producer.paused)
+        self.clock.advance(0.02)
+        self.assertFalse(producer.paused)
+
+    def test_lose_connection(self):
+        transport = self.make_transport(latency=10)
+        transport.write("foo")
+        transport.loseConnection()
+        self.assertFalse(self.inner.disconnecting)
+        self.clock.advance(0.02)
+        self.assertTrue(self.inner.disconnecting)
+
+    def test_cancel(self):
+        transport = self.make_transport(latency=10)
+        transport.write("foo")
+        transport.cancel()
+        self.assertEquals(self.clock.getDelayedCalls(), [])
+
+    def test_configure(self):
+        transport = self.make_transport(latency=10, bandwidth=100)
+        transport.configure(latency=20)
+        self.assertEquals(transport.latency, 0.02)
+        self.assertEquals(transport.bandwidth, 100 * 1000 / 8.0)
+
+    def test_delegation(self):
+        transport = self.make_transport()
+        self.assertEquals(transport.getPeer(), self.inner.getPeer())
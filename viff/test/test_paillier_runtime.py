@@ -0,0 +1,90 @@
+# Copyright 2009 VIFF Development Team.
+#
+# This file is part of VIFF, the Virtual Ideal Functionality Framework.
+#
+# VIFF is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License (LGPL) as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# VIFF is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Lesser General
+# Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with VIFF. If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for viff.runtimes.paillier."""
+
+from twisted.internet.defer import gatherResults
+
+from viff.runtime import gather_shares
+from viff.test.util import RuntimeTestCase, protocol
+
+try:
+    from viff.runtimes.paillier import PaillierRuntime
+except ImportError:
+    PaillierRuntime = None
+
+
+class PaillierRuntimeTest(RuntimeTestCase):
+    """Test the two-player Paillier runtime."""
+
+    num_players = 2
+
+    runtime_class = PaillierRuntime
+
+    @protocol
+    def test_mul(self, runtime):
+        a, b = runtime.share([1, 2], self.Zp, 6 + runtime.id)
+        result = gather_shares([runtime.open(a * b), runtime.open(b * a)])
+        result.addCallback(self.assertEquals, [56, 56])
+        return result
+
+    @protocol
+    def test_mul_statistics(self, runtime):
+        a, b = runtime.share([1, 2], self.Zp, 6 + runtime.id)
+        result = runtime.open(a * b)
+
+        def check(_):
+            operations = runtime.traffic_statistics()["operations"]
+            # One player sends two encryptions and the other one.
+            self.assertTrue(operations["mul"]["messages"] in (1, 2))
+            self.assertEquals(operations["open"]["messages"], 1)
+        result.addCallback(check)
+        return result
+
+    @protocol
+    def test_mul_in_session(self, runtime):
+        """The multiplications of a session are accounted to it."""
+        session = runtime.open_session(1)
+        a, b = session.share([1, 2], self.Zp, 6 + runtime.id)
+        result = session.open(a * b)
+
+        def check(product):
+            self.assertEquals(product, 56)
+            operations = session.traffic_statistics()["operations"]
+            self.assertTrue(operations["mul"]["messages"] in (1, 2))
+            operations = runtime.traffic_statistics()["operations"]
+            self.assertFalse("mul" in operations)
+        result.addCallback(check)
+        return gatherResults([result, runtime.close_session(1)])
+
+
+class WorkerPaillierRuntimeTest(PaillierRuntimeTest):
+    """Test the Paillier runtime with computations done by worker
+    processes."""
+
+    runtime_options = {"workers": 2}
+
+    def setUp(self):
+        PaillierRuntimeTest.setUp(self)
+        def stop_workers(runtimes):
+            for runtime in runtimes:
+                self.addCleanup(runtime.stop_workers)
+        return gatherResults(self.runtimes).addCallback(stop_workers)
+
+
+if PaillierRuntime is None:
+    PaillierRuntimeTest.skip = "Skipped because gmpy is not installed."
@@ -0,0 +1,131 @@
+# Copyright 2009 VIFF Development Team.
+#
+# This file is part of VIFF, the Virtual Ideal Functionality Framework.
+#
+# VIFF is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License (LGPL) as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# VIFF is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Lesser General
+# Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with VIFF. If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for viff.reactor."""
+
+import os
+import time
+
+from twisted.trial.unittest import TestCase
+
+import viff.reactor
+from viff.reactor import ViffReactor
+
+try:
+    from viff.epollreactor import EPollViffReactor
+except ImportError:
+    EPollViffReactor = None
+
+
+class InstallTest(TestCase):
+    """Test :func:`viff.reactor.install`."""
+
+    def setUp(self):
+        self.installed = []
+        self.backends = viff.reactor.backends.copy()
+        for name in self.backends:
+            viff.reactor.backends[name] = \
+                lambda name=name: self.installed.append(name)
+        self.environ = os.environ.get("VIFF_REACTOR")
+
+    def tearDown(self):
+        viff.reactor.backends.update(self.backends)
+        if self.environ is None:
+            os.environ.pop("VIFF_REACTOR", None)
+        else:
+            os.environ["VIFF_REACTOR"] = self.environ
+
+    def test_default(self):
+        os.environ.pop("VIFF_REACTOR", None)
+        viff.reactor.install()
+        self.assertEquals(self.installed, ["viff"])
+
+    def test_environment(self):
+        os.environ["VIFF_REACTOR"] = "epoll"
+        viff.reactor.install()
+        self.assertEquals(self.installed, ["epoll"])
+
+    def test_explicit(self):
+        os.environ["VIFF_REACTOR"] = "epoll"
+        viff.reactor.install("viff")
+        self.assertEquals(self.installed, ["viff"])
+
+    def test_unknown(self):
+        self.assertRaises(ValueError, viff.reactor.install, "foo")
+        self.assertEquals(self.installed, [])
+
+
+class ViffReactorTest(TestCase):
+    """Test the :class:`viff.reactor.ViffReactor`."""
+
+    reactor_class = ViffReactor
+
+    def setUp(self):
+        self.reactor = self.reactor_class()
+        self.loop_calls = []
+        self.reactor.setLoopCall(lambda: self.loop_calls.append(None))
+
+    def tearDown(self):
+        self.reactor.waker.connectionLost(None)
+
+    def test_poll(self):
+        polls = []
+
+        def timed():
+            polls.append(self.reactor.polling)
+            # Polling again from inside a poll does nothing.
+            self.reactor.poll()
+        self.reactor.callLater(0, timed)
+        self.reactor.callLater(0, timed)
+        self.reactor.poll()
+        self.assertEquals(polls, [True, True])
+        self.assertFalse(self.reactor.polling)
+        self.assertEquals(self.loop_calls, [])
+
+    def test_loop_call(self):
+        self.reactor.doIteration(0)
+        self.assertEquals(len(self.loop_calls), 2)
+
+    def test_call_from_loop_call(self):
+        """A call scheduled by the loop call does not wait for I/O."""
+        calls = []
+
+        def loop_call():
+            if not calls:
+                calls.append(self.reactor.callLater(0, lambda: None))
+        self.reactor.setLoopCall(loop_call)
+        self.reactor.running = True
+        started = time.time()
+        try:
+            self.reactor.doIteration(10)
+        finally:
+            self.reactor.running = False
+            calls[0].cancel()
+        self.assertTrue(time.time() - started < 5)
+
+
+class EPollViffReactorTest(ViffReactorTest):
+    """Test the :class:`viff.epollreactor.EPollViffReactor`."""
+
+    if EPollViffReactor is None:
+        skip = "epoll not available"
+    else:
+        reactor_class = EPollViffReactor
+
+    def tearDown(self):
+        ViffReactorTest.tearDown(self)
+        self.reactor._poller.close()
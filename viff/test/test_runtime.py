@@ -23,15 +23,17 @@ value) additional multiplication and comparison stress testing is
 performed by L{StressTest}.
 """
 
+import cPickle
 import operator
 import os
+import traceback
 from random import Random
 
 from twisted.internet.defer import gatherResults, Deferred, DeferredList
 
 from viff.math.field import GF256
 from viff.mixins.comparison import Toft05Runtime
-from viff.runtime import Share
+from viff.runtime import Share, gather_shares
 from viff.test.util import RuntimeTestCase, BinaryOperatorTestCase, protocol
 from viff.utils.constants import SHARE
 
@@ -50,6 +52,260 @@ class MulTest(BinaryOperatorTestCase, RuntimeTestCase):
     operator = operator.mul
 
 
+class LazyAddTest(AddTest):
+    """Run the addition tests without the eager evaluation."""
+
+    runtime_options = {"eager": False}
+
+
+class LazySubTest(SubTest):
+    """Run the subtraction tests without the eager evaluation."""
+
+    runtime_options = {"eager": False}
+
+
+class EagerTest(RuntimeTestCase):
+    """Test the eager evaluation of local operations."""
+
+    @protocol
+    def test_resolved(self, runtime):
+        a = Share(runtime, self.Zp, self.Zp(2))
+        b = Share(runtime, self.Zp, self.Zp(3))
+        results = [(a + b, 5), (a + 4, 6), (a - b, self.Zp(-1)), (7 - a, 5),
+                   (a * 5, 10), (runtime.lin_comb([2, 3], [a, b]), 13)]
+        for result, expected in results:
+            self.assertTrue(result.is_resolved())
+            self.assertEquals(result.result, expected)
+
+    @protocol
+    def test_unresolved(self, runtime):
+        a = Share(runtime, self.Zp)
+        b = Share(runtime, self.Zp, self.Zp(3))
+        results = [(a + b, 5), (a * 5, 10),
+                   (runtime.lin_comb([2, 3], [a, b]), 13)]
+        for result, _ in results:
+            self.assertFalse(result.is_resolved())
+        a.callback(self.Zp(2))
+        for result, expected in results:
+            self.assertEquals(result.result, expected)
+
+
+class DepthStatisticsTest(RuntimeTestCase):
+    """Test the tracking of the communication depth of shares."""
+
+    runtime_options = {"depth_statistics": True}
+
+    def shares(self, runtime, values):
+        """Share the *values* with the polynomials x + id."""
+        return [Share(runtime, self.Zp, self.Zp(x + runtime.id))
+                for x in values]
+
+    @protocol
+    def test_open_after_mul(self, runtime):
+        a, b = self.shares(runtime, [2, 3])
+        opened = runtime.open(a * b)
+
+        def check(_):
+            statistics = runtime.depth_statistics()
+            self.assertEquals(opened.round.depth, 2)
+            self.assertEquals(statistics["rounds"], 2)
+            self.assertEquals([entry["operation"]
+                               for entry in statistics["critical_path"]],
+                              ["mul", "open"])
+            self.assertEquals(statistics["histogram"],
+                              {1: runtime.num_players - 1,
+                               2: runtime.num_players - 1})
+
+        opened.addCallback(self.assertEquals, 6)
+        opened.addCallback(check)
+        return opened
+
+    @protocol
+    def test_deepest_input(self, runtime):
+        """Local operations take the deepest round of their inputs."""
+        a, b, c = self.shares(runtime, [2, 3, 4])
+        deep = runtime.open(runtime.open(a * b) * c)
+        shallow = runtime.open(a)
+        result = gather_shares([shallow + deep, deep - 1, shallow])
+
+        def check(_):
+            depths = [share.round.depth for share in [deep, shallow]]
+            self.assertEquals(depths, [4, 1])
+            self.assertEquals(result.round.depth, 4)
+            self.assertEquals(runtime.depth_statistics()["rounds"], 4)
+
+        result.addCallback(self.assertEquals, [26, 23, 2])
+        result.addCallback(check)
+        return result
+
+    @protocol
+    def test_not_tracked(self, runtime):
+        """Shares have no rounds without the option."""
+        runtime.track_depth = False
+        a, b = self.shares(runtime, [2, 3])
+        opened = runtime.open(a * b)
+
+        def check(_):
+            self.assertEquals(opened.round, None)
+            self.assertEquals(runtime.depth_statistics()["rounds"], 0)
+
+        opened.addCallback(check)
+        return opened
+
+
+class WorkerTest(RuntimeTestCase):
+    """Test the computations done in worker processes."""
+
+    runtime_options = {"workers": 1}
+
+    @protocol
+    def test_result(self, runtime):
+        self.addCleanup(runtime.stop_workers)
+        result = gatherResults([runtime.defer_to_worker(pow, 3, 5, 7),
+                                runtime.defer_to_worker(os.getpid)])
+        result.addCallback(lambda (value, pid): (value, pid != os.getpid()))
+        result.addCallback(self.assertEquals, (5, True))
+        return result
+
+    @protocol
+    def test_exception(self, runtime):
+        self.addCleanup(runtime.stop_workers)
+        result = runtime.defer_to_worker(operator.div, 1, 0)
+        return self.assertFailure(result, ZeroDivisionError)
+
+    @protocol
+    def test_unpicklable(self, runtime):
+        result = runtime.defer_to_worker(lambda: 1)
+        self.assertEquals(runtime.worker_pool is None, False)
+        self.addCleanup(runtime.stop_workers)
+        return self.assertFailure(result, cPickle.PicklingError)
+
+    @protocol
+    def test_open_result(self, runtime):
+        """The callbacks of a result can communicate."""
+        self.addCleanup(runtime.stop_workers)
+        result = runtime.defer_to_worker(pow, 3, 5, 7)
+
+        def open_result(value):
+            # The second opening polls the reactor.
+            return gather_shares([runtime.open(Share(runtime, self.Zp,
+                                                     self.Zp(value)))
+                                  for _ in range(2)])
+        runtime.schedule_callback(result, open_result)
+        result.addCallback(self.assertEquals, [5, 5])
+        return result
+
+    @protocol
+    def test_session(self, runtime):
+        """Sessions use the workers of the runtime."""
+        self.addCleanup(runtime.stop_workers)
+        session = runtime.open_session(1)
+        result = session.defer_to_worker(pow, 3, 5, 7)
+        self.assertEquals(session.worker_pool, None)
+        self.assertNotEquals(runtime.worker_pool, None)
+        result.addCallback(self.assertEquals, 5)
+        return gatherResults([result, runtime.close_session(1)])
+
+    @protocol
+    def test_no_workers(self, runtime):
+        """Without the option the call is made right away."""
+        runtime.options.workers = 0
+        result = runtime.defer_to_worker(pow, 3, 5, 7)
+        self.assertTrue(result.called)
+        self.assertEquals(runtime.worker_pool, None)
+        result.addCallback(self.assertEquals, 5)
+        return result
+
+
+class SessionTest(RuntimeTestCase):
+    """Test computations multiplexed over the same connections."""
+
+    def square(self, session, value):
+        """Share *value* with the polynomial x + id and open its
+        square."""
+        share = Share(session, self.Zp, self.Zp(value + session.id))
+        return session.open(share * share)
+
+    @protocol
+    def test_concurrent_sessions(self, runtime):
+        session_ids = [1, 2, 3]
+        # The players open the sessions in different orders.
+        if runtime.id == 1:
+            session_ids.reverse()
+        results = []
+        for session_id in session_ids:
+            session = runtime.open_session(session_id)
+            self.assertEquals(session.program_counter[0], session_id)
+            for peer_id in runtime.players:
+                if peer_id != runtime.id:
+                    self.assertTrue(session.protocols[peer_id] is
+                                    runtime.protocols[peer_id])
+            result = self.square(session, 10 * session_id)
+            result.addCallback(self.assertEquals, (10 * session_id) ** 2)
+            results.append(result)
+        self.assertEquals(sorted(runtime.sessions), [1, 2, 3])
+        return gatherResults(results)
+
+    @protocol
+    def test_preprocessing_is_isolated(self, runtime):
+        session = runtime.open_session(1)
+        runtime._pool[session.program_counter] = "data"
+        self.assertEquals(session._pool, {})
+
+    @protocol
+    def test_close_session(self, runtime):
+        session = runtime.open_session(5)
+        result = self.square(session, 4)
+        result.addCallback(self.assertEquals, 16)
+        result.addCallback(lambda _: runtime.close_session(5))
+        result.addCallback(lambda _: self.assertEquals(runtime.sessions, {}))
+        return result
+
+    @protocol
+    def test_traffic_statistics(self, runtime):
+        """The data sent by a session is accounted to the session."""
+        first = runtime.open_session(1)
+        second = runtime.open_session(2)
+
+        def share(session, value):
+            return Share(session, self.Zp, self.Zp(value + session.id))
+
+        results = [first.open(share(first, 1)),
+                   second.open(share(second, 2)),
+                   second.open(share(second, 3))]
+
+        def check(_):
+            peers = runtime.num_players - 1
+            stats = [session.traffic_statistics()["operations"]
+                     for session in first, second]
+            self.assertEquals(sorted(stats[0]), ["open"])
+            self.assertEquals(sorted(stats[1]), ["open"])
+            self.assertEquals(stats[0]["open"]["messages"], peers)
+            self.assertEquals(stats[1]["open"]["messages"], 2 * peers)
+            self.assertEquals(stats[1]["open"]["data_bytes"],
+                              2 * stats[0]["open"]["data_bytes"])
+            self.assertFalse("open" in
+                             runtime.traffic_statistics()["operations"])
+
+        result = gatherResults(results)
+        result.addCallback(check)
+        return result
+
+    @protocol
+    def test_shutdown_session(self, runtime):
+        session = runtime.open_session(1)
+        result = session.shutdown()
+        result.addCallback(lambda _: self.assertEquals(runtime.sessions, {}))
+        return result
+
+    @protocol
+    def test_session_id_in_use(self, runtime):
+        runtime.open_session(1)
+        self.assertRaises(AssertionError, runtime.open_session, 1)
+        self.assertRaises(AssertionError, runtime.open_session,
+                          runtime.program_counter[0])
+
+
 class PowTest(RuntimeTestCase):
     """Tests power to known integer"""
 
@@ -232,6 +488,34 @@ class RuntimeTest(RuntimeTestCase):
         dls.addCallback(check)
         return dls
 
+    @protocol
+    def test_deferred_queue_iterative(self, runtime):
+        """Test that queued callbacks are run one after another."""
+        depths = []
+        order = []
+
+        def queue(count):
+            d = Deferred()
+            d.addCallback(step)
+            runtime.deferred_queue.append((d, count))
+
+        def step(count):
+            depths.append(len(traceback.extract_stack()))
+            order.append(count)
+            # A nested call must leave the work to the outer loop.
+            runtime.process_deferred_queue()
+            if count > 0:
+                queue(count - 1)
+
+        complex = Deferred()
+        complex.addCallback(order.append)
+        runtime.complex_deferred_queue.append((complex, "complex"))
+        queue(2000)
+        runtime.process_deferred_queue()
+
+        self.assertEquals(order, range(2000, -1, -1) + ["complex"])
+        self.assertEquals(min(depths), max(depths))
+
 
 
 
@@ -116,3 +116,57 @@ class RuntimeOpenTest(RuntimeTestCase):
         receivers = r.sample(range(1, len(runtime.players) + 1),
                              no_of_receivers)
         return self._test_open(runtime, receivers)
+
+    @protocol
+    def test_open_many(self, runtime):
+        """Open a list of sharings with a single exchange."""
+        shares = [Share(runtime, self.Zp, self.Zp(10 * i + runtime.id))
+                  for i in range(5)]
+        opened = runtime.open_many(shares)
+        self.assertEquals(len(opened), 5)
+        result = gather_shares(opened)
+        result.addCallback(self.assertEquals, [10 * i for i in range(5)])
+        return result
+
+    @protocol
+    def test_open_many_receivers(self, runtime):
+        """Open a list of sharings to some of the players."""
+        shares = [Share(runtime, self.Zp, self.Zp(10 * i + runtime.id))
+                  for i in range(3)]
+        opened = runtime.open_many(shares, [1, 2])
+        if runtime.id == 3:
+            self.assertEquals(opened, None)
+            return
+        result = gather_shares(opened)
+        result.addCallback(self.assertEquals, [0, 10, 20])
+        return result
+
+
+class BatchedSharesOpenTest(RuntimeOpenTest):
+    """Run the open tests with the shares of an iteration batched."""
+
+    runtime_options = {"batch_shares": True}
+
+    @protocol
+    def test_shares_batched(self, runtime):
+        """Shares sent in the same iteration form a single message.
+
+        The VIFF reactor may be polled while the opens are made, so
+        only fewer messages than shares are required."""
+
+        def messages():
+            peers = runtime.traffic_statistics()["peers"]
+            return sum([peer["messages"] for peer in peers.itervalues()])
+
+        def compute(_):
+            before = messages()
+            shares = [Share(runtime, self.Zp, self.Zp(i + runtime.id))
+                      for i in range(4)]
+            opened = gather_shares([runtime.open(share) for share in shares])
+            opened.addCallback(lambda _: messages() - before)
+            opened.addCallback(lambda sent: self.assertTrue(sent < 2 * 4))
+            return opened
+
+        sync = runtime.synchronize()
+        runtime.schedule_callback(sync, compute)
+        return sync
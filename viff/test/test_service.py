@@ -0,0 +1,241 @@
+# Copyright 2009 VIFF Development Team.
+#
+# This file is part of VIFF, the Virtual Ideal Functionality Framework.
+#
+# VIFF is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License (LGPL) as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# VIFF is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Lesser General
+# Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with VIFF. If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for viff.service."""
+
+import json
+
+from twisted.internet.defer import gatherResults
+from twisted.test.proto_helpers import StringTransport
+from twisted.trial.unittest import TestCase
+
+from viff.runtime import Share, preprocess
+from viff.runtimes.active import ActiveRuntime
+from viff.runtimes.passive import PassiveRuntime
+from viff.service import Service, JobError, JobFactory, ServiceClient
+from viff.test.util import RuntimeTestCase, protocol
+
+
+class ServiceTest(RuntimeTestCase):
+    """Test running jobs with a service."""
+
+    def functions(self):
+        def square(runtime, value):
+            # Share the value with the polynomial x + id.
+            share = Share(runtime, self.Zp, self.Zp(value + runtime.id))
+            return runtime.open(share * share)
+
+        def fail(runtime):
+            raise ValueError("failed")
+
+        return {"square": square, "fail": fail}
+
+    @protocol
+    def test_jobs(self, runtime):
+        service = Service(runtime, self.functions())
+        results = gatherResults([service.submit(1, "square", 3),
+                                 service.submit(2, "square", 4)])
+        results.addCallback(self.assertEquals, [9, 16])
+
+        def check(_):
+            stats = service.statistics()
+            self.assertEquals(stats["completed"], 2)
+            self.assertEquals(stats["running"], 0)
+            self.assertEquals(stats["functions"]["square"]["jobs"], 2)
+            self.assertEquals(runtime.sessions.keys(), [])
+
+        results.addCallback(check)
+        return results
+
+    @protocol
+    def test_unknown_function(self, runtime):
+        service = Service(runtime, self.functions())
+        self.assertRaises(JobError, service.submit, 1, "cube", 3)
+
+    @protocol
+    def test_failure(self, runtime):
+        service = Service(runtime, self.functions())
+        result = self.assertFailure(service.submit(1, "fail"), ValueError)
+        result.addCallback(lambda _: self.assertEquals(service.failed, 1))
+        return result
+
+    @protocol
+    def test_max_jobs(self, runtime):
+        service = Service(runtime, self.functions(), max_jobs=1)
+        first = service.submit_job(1, "square", [3])
+        second = service.submit_job(2, "square", [4])
+        self.assertEquals(list(service.queue), [second])
+        result = gatherResults([first.result, second.result])
+        result.addCallback(self.assertEquals, [9, 16])
+        result.addCallback(lambda _: self.assertTrue(
+                second.started >= first.finished))
+        return result
+
+    @protocol
+    def test_job_protocol(self, runtime):
+        service = Service(runtime, self.functions())
+        job_protocol = JobFactory(service).buildProtocol(None)
+        job_protocol.makeConnection(StringTransport())
+        job_protocol.lineReceived(json.dumps({"id": 1, "function": "square",
+                                              "inputs": [5]}))
+        job_protocol.lineReceived(json.dumps({"id": 2, "function": "cube"}))
+
+        def check(_):
+            lines = job_protocol.transport.value().splitlines()
+            responses = [json.loads(line) for line in lines]
+            self.assertEquals(responses[0],
+                              {"id": 2, "error": "Unknown function: cube"})
+            self.assertEquals(responses[1]["result"], 25)
+            self.assertEquals(responses[1]["statistics"]["function"],
+                              "square")
+
+        # The job protocol answers before this callback is run.
+        return service.running[1].result.addCallback(check)
+
+    @protocol
+    def test_bad_job_ids(self, runtime):
+        service = Service(runtime, self.functions())
+        result = service.submit(1, "square", 5)
+        runtime.open_session(6)
+        for job_id in ["5", 2.0, True, 0, -1, None, 1, 3]:
+            self.assertRaises(JobError, service.submit, job_id, "square", 5)
+        self.assertEquals(service.running.keys(), [1])
+        self.assertEquals(sorted(runtime.sessions), [2, 6])
+        result.addCallback(self.assertEquals, 25)
+        return gatherResults([result, runtime.close_session(6)])
+
+    @protocol
+    def test_job_protocol_bad_requests(self, runtime):
+        service = Service(runtime, self.functions())
+        job_protocol = JobFactory(service).buildProtocol(None)
+        job_protocol.makeConnection(StringTransport())
+        for request in [{"id": "5", "function": "square", "inputs": [5]},
+                        {"id": 1.5, "function": "square", "inputs": [5]},
+                        {"id": 1, "function": ["square"]},
+                        {"id": 1, "function": "square", "inputs": 5},
+                        7]:
+            job_protocol.lineReceived(json.dumps(request))
+        lines = job_protocol.transport.value().splitlines()
+        responses = [json.loads(line) for line in lines]
+        self.assertEquals([response.get("id") for response in responses],
+                          ["5", 1.5, 1, 1, None])
+        for response in responses:
+            self.assertTrue("error" in response)
+        self.assertEquals(service.running, {})
+        self.assertEquals(runtime.sessions, {})
+
+
+class ServiceClientTest(TestCase):
+    """Test the client side of the job protocol."""
+
+    def test_submit(self):
+        client = ServiceClient()
+        client.makeConnection(StringTransport())
+        result = client.submit(7, "square", 5)
+        self.assertEquals(json.loads(client.transport.value()),
+                          {"id": 7, "function": "square", "inputs": [5]})
+        client.lineReceived(json.dumps({"id": 7, "result": 25,
+                                        "statistics": {"run": 0.5}}))
+        result.addCallback(self.assertEquals, 25)
+        self.assertEquals(client.statistics[7], {"run": 0.5})
+        return result
+
+    def test_error(self):
+        client = ServiceClient()
+        client.makeConnection(StringTransport())
+        result = client.submit(7, "cube", 5)
+        client.lineReceived(json.dumps({"id": 7, "error": "Unknown"}))
+        return self.assertFailure(result, JobError)
+
+    def test_service_statistics(self):
+        client = ServiceClient()
+        client.makeConnection(StringTransport())
+        result = client.service_statistics()
+        client.lineReceived(json.dumps({"statistics": {"completed": 3}}))
+        result.addCallback(self.assertEquals, {"completed": 3})
+        return result
+
+
+class PreprocessingServiceTest(RuntimeTestCase):
+    """Test preprocessing of jobs with the active runtime."""
+
+    num_players = 4
+
+    runtime_class = ActiveRuntime
+
+    @protocol
+    def test_preprocess(self, runtime):
+        def multiply(runtime, value):
+            a = Share(runtime, self.Zp, self.Zp(value + runtime.id))
+            b = Share(runtime, self.Zp, self.Zp(value + 2 * runtime.id))
+            return runtime.open(a * b)
+
+        service = Service(runtime, {"multiply": multiply}, preprocess=True)
+        first = service.submit_job(1, "multiply", [3])
+        second = service.submit_job(2, "multiply", [4])
+        sessions = [runtime.sessions[2], runtime.sessions[4]]
+        result = gatherResults([first.result, second.result])
+        result.addCallback(self.assertEquals, [9, 16])
+
+        def check(_):
+            self.assertEquals(first.statistics()["preprocessing"], None)
+            self.assertNotEquals(second.statistics()["preprocessing"], None)
+            self.assertTrue(second.started >= first.finished)
+            # The second job took its triple from the pool.
+            self.assertNotEquals(sessions[0]._needed_data, {})
+            self.assertEquals(sessions[1]._needed_data, {})
+
+        result.addCallback(check)
+        return result
+
+
+class BrokenPreprocessingRuntime(PassiveRuntime):
+    """A runtime which cannot preprocess its data."""
+
+    @preprocess("generate_numbers")
+    def number(self):
+        return 1
+
+    def generate_numbers(self, quantity):
+        raise ValueError("cannot preprocess")
+
+
+class FailedPreprocessingTest(RuntimeTestCase):
+    """Test a job whose preprocessing fails."""
+
+    runtime_class = BrokenPreprocessingRuntime
+
+    @protocol
+    def test_sessions_closed(self, runtime):
+        def count(runtime, value):
+            runtime.number()
+            share = Share(runtime, self.Zp, self.Zp(value + runtime.id))
+            return runtime.open(share)
+
+        service = Service(runtime, {"count": count}, preprocess=True)
+        first = service.submit_job(1, "count", [3])
+        second = service.submit_job(2, "count", [4])
+        first.result.addCallback(self.assertEquals, 3)
+        result = self.assertFailure(second.result, ValueError)
+
+        def check(_):
+            self.assertEquals(service.failed, 1)
+            self.assertEquals(runtime.sessions, {})
+
+        result.addCallback(lambda _: first.result)
+        result.addCallback(check)
+        return result
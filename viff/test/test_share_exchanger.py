@@ -0,0 +1,984 @@
+# Copyright 2009 VIFF Development Team.
+#
+# This file is part of VIFF, the Virtual Ideal Functionality Framework.
+#
+# VIFF is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License (LGPL) as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# VIFF is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Lesser General
+# Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with VIFF. If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for the wire format used by viff.runtime.ShareExchanger."""
+
+import os
+import socket
+import struct
+from random import Random
+from collections import deque
+from optparse import OptionParser
+
+from twisted.internet import reactor
+from twisted.internet.address import UNIXAddress
+from twisted.internet.defer import Deferred, DeferredList, gatherResults
+from twisted.internet.error import CannotListenError, TimeoutError
+from twisted.internet.protocol import ServerFactory
+from twisted.internet.task import deferLater
+from twisted.test.proto_helpers import StringTransport
+from twisted.trial.unittest import TestCase
+
+from viff.config import Player
+from viff.math.field import GF, GF256, FakeGF
+from viff.netem import EmulatedTransport
+from viff.runtime import Runtime, Share, ShareExchanger
+from viff.runtime import encode_share, decode_share
+from viff.runtime import create_runtime
+from viff.runtime import encode_varint, decode_varint, COMPACT_MARKER
+from viff.test import test_runtime
+from viff.test.util import RuntimeTestCase, protocol
+from viff.utils.constants import SHARE, TEXT, PAILLIER, CHUNK, COMPRESSED
+from viff.utils.util import operation
+
+
+def random_bytes(count):
+    """Return *count* incompressible bytes."""
+    generator = Random(0)
+    return "".join([chr(generator.randrange(256)) for _ in xrange(count)])
+
+
+def packets(exchanger):
+    """Return the packets written by *exchanger* without their length
+    prefix."""
+    data = exchanger.transport.value()
+    exchanger.transport.clear()
+    result = []
+    while data:
+        size, = struct.unpack("!H", data[:2])
+        result.append(data[2:2 + size])
+        data = data[2 + size:]
+    return result
+
+
+class FakeRuntime:
+    """Just enough of a runtime for a :class:`ShareExchanger`."""
+
+    def __init__(self, id, **options):
+        parser = OptionParser()
+        Runtime.add_options(parser)
+        self.options = parser.get_default_values()
+        for name, value in options.iteritems():
+            setattr(self.options, name, value)
+        self.id = id
+        self.operation = None
+        self.traffic = {}
+        self.pressure = []
+
+    def handle_deferred_data(self, deferred, data):
+        deferred.callback(data)
+
+    def send_pressure(self, peer_id, congested):
+        self.pressure.append((peer_id, congested))
+
+    def receive_pressure(self, peer_id, paused):
+        pass
+
+
+class FakeFactory:
+
+    def __init__(self, runtime):
+        self.runtime = runtime
+
+    def identify_peer(self, protocol):
+        pass
+
+
+def make_exchanger(id, **options):
+    """Return a :class:`ShareExchanger` for player *id* writing to a
+    :class:`StringTransport`."""
+    exchanger = ShareExchanger()
+    exchanger.factory = FakeFactory(FakeRuntime(id, **options))
+    exchanger.makeConnection(StringTransport())
+    return exchanger
+
+
+def connected_exchangers(options_a={}, options_b={}):
+    """Return two :class:`ShareExchanger` instances which have
+    exchanged player IDs and features."""
+    a = make_exchanger(1, **options_a)
+    b = make_exchanger(2, **options_b)
+    transfer(a, b)
+    transfer(b, a)
+    return a, b
+
+
+def transfer(sender, receiver):
+    """Move the bytes written by *sender* to *receiver*."""
+    data = sender.transport.value()
+    sender.transport.clear()
+    receiver.dataReceived(data)
+
+
+class BatchingTest(TestCase):
+    """Test packing and unpacking of batched packets."""
+
+    options = {"batch_messages": True}
+
+    def test_single_packet_not_batched(self):
+        sender, receiver = connected_exchangers(self.options, self.options)
+        sender.sendData((0, 1), 42, "foo")
+        self.assertEquals(sender.transport.value(), "")
+        sender.flush()
+        transfer(sender, receiver)
+        self.assertEquals(receiver.incoming_data[((0, 1), 42)][0], "foo")
+        self.assertEquals(sender.sent_packets, 2)
+        self.assertEquals(sender.sent_messages, 2)
+
+    def test_batch_round_trip(self):
+        sender, receiver = connected_exchangers(self.options, self.options)
+        sender.sendData((0, 1), 42, "foo")
+        sender.sendData((0, 1), 42, "bar")
+        sender.sendData((0, 2, 7), 5, "baz")
+        sender.flush()
+        # One HELLO packet and one batch.
+        self.assertEquals(sender.sent_packets, 2)
+        self.assertEquals(sender.sent_messages, 4)
+
+        transfer(sender, receiver)
+        self.assertEquals(list(receiver.incoming_data[((0, 1), 42)]),
+                          ["foo", "bar"])
+        self.assertEquals(list(receiver.incoming_data[((0, 2, 7), 5)]),
+                          ["baz"])
+
+    def test_large_batches_are_split(self):
+        sender, receiver = connected_exchangers(self.options, self.options)
+        data = "x" * 30000
+        for i in range(5):
+            sender.sendData((0, i), 42, data)
+        sender.flush()
+        self.assertEquals(sender.sent_packets, 1 + 3)
+
+        transfer(sender, receiver)
+        for i in range(5):
+            self.assertEquals(receiver.incoming_data[((0, i), 42)][0], data)
+
+    def test_batching_needs_both_players(self):
+        sender, receiver = connected_exchangers(self.options, {})
+        self.assertFalse(sender.batch_messages)
+        sender.sendData((0, 1), 42, "foo")
+        self.assertNotEquals(sender.transport.value(), "")
+
+
+class FeatureNegotiationTest(TestCase):
+    """Test the exchange of HELLO packets."""
+
+    def test_features_announced(self):
+        a, b = connected_exchangers({"batch_messages": True},
+                                    {"batch_messages": True})
+        self.assertEquals(a.peer_id, 2)
+        self.assertEquals(b.peer_id, 1)
+        self.assertEquals(a.features, frozenset(["batch", "binary-shares",
+                                                 "chunks", "compact-pc"]))
+        self.assertEquals(b.features, a.features)
+        self.assertEquals(a.incoming_data, {})
+
+    def test_intersection(self):
+        a, b = connected_exchangers({"batch_messages": True},
+                                    {"binary_shares": False})
+        self.assertEquals(a.peer_features, frozenset(["chunks",
+                                                      "compact-pc"]))
+        self.assertEquals(b.peer_features, frozenset(["batch",
+                                                      "binary-shares",
+                                                      "chunks",
+                                                      "compact-pc"]))
+        self.assertEquals(a.features, frozenset(["chunks", "compact-pc"]))
+        self.assertEquals(b.features, a.features)
+
+    def test_old_peer(self):
+        """A peer which sends no HELLO packet gets no new features."""
+        a = make_exchanger(1)
+        a.transport.clear()
+        a.dataReceived(struct.pack("!H", 1) + "2")
+        self.assertEquals(a.peer_id, 2)
+        self.assertEquals(a.features, frozenset())
+        a.sendShare((0, 1), GF256(7))
+        self.assertTrue(a.transport.value().endswith("0x7"))
+
+
+class BinaryShareTest(TestCase):
+    """Test the binary encoding of shares."""
+
+    def setUp(self):
+        self.Zp = GF(30916444023318367583)
+
+    def test_encode_width(self):
+        self.assertEquals(len(encode_share(GF256(0))), 1)
+        self.assertEquals(len(encode_share(self.Zp(0))), 9)
+        self.assertEquals(len(encode_share(self.Zp(-1))), 9)
+
+    def test_round_trip(self):
+        for value in [0, 1, 255, 256, 2**64, self.Zp.modulus - 1]:
+            element = self.Zp(value)
+            self.assertEquals(decode_share(encode_share(element)),
+                              element.value)
+
+    def test_out_of_range(self):
+        F = FakeGF(1031)
+        self.assertEquals(encode_share(F(-1)), None)
+        self.assertEquals(encode_share(F(2**16)), None)
+
+    def test_send_share(self):
+        a, b = connected_exchangers()
+        a.sendShare((0, 1), self.Zp(-1234))
+        a.sendShare((0, 2), GF256(12))
+        binary_bytes = len(a.transport.value())
+        transfer(a, b)
+        self.assertEquals(b.incoming_data[((0, 1), SHARE)][0],
+                          self.Zp.modulus - 1234)
+        self.assertEquals(b.incoming_data[((0, 2), SHARE)][0], 12)
+
+        c, d = connected_exchangers({"binary_shares": False})
+        c.sendShare((0, 1), self.Zp(-1234))
+        c.sendShare((0, 2), GF256(12))
+        hex_bytes = len(c.transport.value())
+        transfer(c, d)
+        self.assertEquals(d.incoming_data[((0, 1), SHARE)][0],
+                          hex(self.Zp.modulus - 1234))
+        self.assertTrue(binary_bytes < hex_bytes)
+
+
+class LargeMessageTest(TestCase):
+    """Test sending data which does not fit in a single packet."""
+
+    data = "".join([chr(i % 256) for i in xrange(200000)])
+
+    def test_round_trip(self):
+        sender, receiver = connected_exchangers()
+        sender.sendData((0, 1, 2), 42, self.data)
+        sender.sendData((0, 1, 2), 42, "small")
+        self.assertEquals(sender.sent_messages, 1 + 2)
+        self.assertEquals(sender.sent_packets, 1 + 5)
+        transfer(sender, receiver)
+        self.assertEquals(list(receiver.incoming_data[((0, 1, 2), 42)]),
+                          [self.data, "small"])
+
+    def test_batched_round_trip(self):
+        options = {"batch_messages": True}
+        sender, receiver = connected_exchangers(options, options)
+        sender.sendData((0, 1), 42, "small")
+        sender.sendData((0, 2), 42, self.data)
+        sender.sendData((0, 3), 42, "small")
+        sender.flush()
+        transfer(sender, receiver)
+        self.assertEquals(receiver.incoming_data[((0, 1), 42)][0], "small")
+        self.assertEquals(receiver.incoming_data[((0, 2), 42)][0], self.data)
+        self.assertEquals(receiver.incoming_data[((0, 3), 42)][0], "small")
+
+    def test_interleaved_chunks(self):
+        sender, receiver = connected_exchangers()
+        sender._send_message((0, 1), CHUNK, "foo")
+        sender._send_message((0, 2), 42, "bar")
+        first, second = packets(sender)
+        receiver._packet_received(first)
+        self.assertRaises(struct.error, receiver._packet_received, second)
+
+    def test_before_hello(self):
+        """Large data is chunked before the HELLO of the peer."""
+        sender = make_exchanger(1)
+        receiver = make_exchanger(2)
+        sender.dataReceived(struct.pack("!H", 1) + "2")
+        transfer(sender, receiver)
+        sender.sendData((0, 1), 42, self.data)
+        transfer(sender, receiver)
+        self.assertEquals(receiver.incoming_data[((0, 1), 42)][0], self.data)
+
+
+class LargeMessageRuntimeTest(RuntimeTestCase):
+
+    @protocol
+    def test_send_receive(self, runtime):
+        data = str(range(20000))
+        sync = runtime.synchronize()
+
+        def exchange(_):
+            pc = tuple(runtime.program_counter)
+            received = []
+            for peer_id in runtime.players:
+                runtime.protocols[peer_id].sendData(pc, TEXT, data)
+                d = Deferred()
+                d.addCallback(self.assertEquals, data)
+                runtime._expect_data(peer_id, TEXT, d)
+                received.append(d)
+            return gatherResults(received)
+        runtime.schedule_callback(sync, exchange)
+        return sync
+
+
+class CompactProgramCounterTest(TestCase):
+    """Test the compact program counter encoding."""
+
+    def test_varint_round_trip(self):
+        for number in [0, 1, 127, 128, 300, 2**14, 2**32 - 1]:
+            self.assertEquals(decode_varint(encode_varint(number), 0),
+                              (number, len(encode_varint(number))))
+
+    def test_truncated_varint(self):
+        self.assertRaises(struct.error, decode_varint, "\x80", 0)
+
+    def test_round_trip(self):
+        sender, receiver = connected_exchangers()
+        pcs = [(0, 1), (0, 1, 5, 2), (0, 1, 5, 3), (0, 1, 5, 3), (0, 2),
+               (0, 2, 300, 2**31), (1,), ()]
+        for i, pc in enumerate(pcs):
+            sender.sendData(pc, 42, str(i))
+        transfer(sender, receiver)
+        for i, pc in enumerate(pcs):
+            received = receiver.incoming_data[(pc, 42)]
+            self.assertEquals(received.popleft(), str(i))
+            if not received:
+                del receiver.incoming_data[(pc, 42)]
+        self.assertEquals(receiver.incoming_data, {})
+
+    def test_prefix_is_shared(self):
+        sender, receiver = connected_exchangers()
+        sender.sendData((0, 7, 3, 2, 100, 6, 1), 42, "a")
+        first, = packets(sender)
+        sender.sendData((0, 7, 3, 2, 100, 7, 1), 42, "b")
+        second, = packets(sender)
+        # Marker, data type, shared, count, two components and data.
+        self.assertEquals(len(second), 2 + 1 + 1 + 1 + 2 + 1)
+        self.assertTrue(len(second) < len(first))
+
+    def test_smaller_than_legacy(self):
+        pc = (0, 12, 3, 4, 5, 6, 7, 8)
+        compact, _ = connected_exchangers()
+        compact.sendData(pc, 42, "x")
+        legacy, _ = connected_exchangers({"compact_pc": False})
+        legacy.sendData(pc, 42, "x")
+        self.assertTrue(len(compact.transport.value()) <
+                        len(legacy.transport.value()))
+
+    def test_bad_prefix(self):
+        _, receiver = connected_exchangers()
+        packet = COMPACT_MARKER + chr(42) + encode_varint(3) + \
+            encode_varint(0) + "x"
+        self.assertRaises(struct.error, receiver._packet_received, packet)
+
+
+class CompressionTest(TestCase):
+    """Test compression of large messages."""
+
+    options = {"compress": True}
+    data = repr(range(1000))
+
+    def test_round_trip(self):
+        sender, receiver = connected_exchangers(self.options, self.options)
+        sender.sendData((0, 1), TEXT, self.data)
+        sender.sendData((0, 2), PAILLIER, self.data)
+        self.assertTrue(len(sender.transport.value()) < len(self.data))
+        transfer(sender, receiver)
+        self.assertEquals(receiver.incoming_data[((0, 1), TEXT)][0],
+                          self.data)
+        self.assertEquals(receiver.incoming_data[((0, 2), PAILLIER)][0],
+                          self.data)
+        self.assertEquals(sorted(receiver.decompression_time),
+                          [PAILLIER, TEXT])
+
+    def test_statistics(self):
+        sender, receiver = connected_exchangers(self.options, self.options)
+        sender.sendData((0, 1), TEXT, self.data)
+        sender.sendData((0, 2), TEXT, self.data)
+        messages, before, after, seconds = sender.compression_stats[TEXT]
+        self.assertEquals(messages, 2)
+        self.assertEquals(before, 2 * len(self.data))
+        self.assertTrue(after < before)
+
+    def test_small_and_other_types_not_compressed(self):
+        sender, receiver = connected_exchangers(self.options, self.options)
+        sender.sendData((0, 1), TEXT, "short")
+        sender.sendData((0, 2), 42, self.data)
+        self.assertEquals(sender.compression_stats, {})
+        self.assertTrue(len(sender.transport.value()) > len(self.data))
+
+    def test_incompressible(self):
+        sender, receiver = connected_exchangers(self.options, self.options)
+        data = random_bytes(2000)
+        sender.sendData((0, 1), TEXT, data)
+        packet, = packets(sender)
+        self.assertTrue(packet.endswith(data))
+
+    def test_needs_both_players(self):
+        sender, receiver = connected_exchangers(self.options, {})
+        self.assertFalse(sender.compress)
+        sender.sendData((0, 1), TEXT, self.data)
+        self.assertEquals(sender.compression_stats, {})
+
+    def test_large_message(self):
+        sender, receiver = connected_exchangers(self.options, self.options)
+        data = random_bytes(200000)
+        sender.sendData((0, 1), TEXT, data)
+        transfer(sender, receiver)
+        self.assertEquals(receiver.incoming_data[((0, 1), TEXT)][0], data)
+
+    def test_bad_data(self):
+        _, receiver = connected_exchangers(self.options, self.options)
+        receiver.compact_pc = False
+        packet = struct.pack("!HHB", 0, 4, COMPRESSED) + chr(TEXT) + "foo"
+        self.assertRaises(struct.error, receiver._packet_received, packet)
+
+
+class FlowControlTest(TestCase):
+    """Test the send queue used while the transport is paused."""
+
+    options = {"send_high_watermark": 100, "send_low_watermark": 50}
+
+    def test_queue_while_paused(self):
+        sender, receiver = connected_exchangers()
+        sender.pauseProducing()
+        sender.sendData((0, 1), 42, "foo")
+        self.assertEquals(sender.transport.value(), "")
+        self.assertTrue(sender.queued_bytes > 0)
+        sender.resumeProducing()
+        self.assertEquals(sender.queued_bytes, 0)
+        transfer(sender, receiver)
+        self.assertEquals(receiver.incoming_data[((0, 1), 42)][0], "foo")
+
+    def test_watermarks(self):
+        sender, receiver = connected_exchangers(self.options)
+        runtime = sender.factory.runtime
+        sender.pauseProducing()
+        for i in range(10):
+            sender.sendData((0, i), 42, "x" * 20)
+        self.assertEquals(runtime.pressure, [(2, True)])
+        self.assertTrue(sender.congested)
+
+        # Pause again after writing a single packet.
+        write = sender.transport.write
+        def write_and_pause(data):
+            write(data)
+            sender.pauseProducing()
+        sender.transport.write = write_and_pause
+        sender.resumeProducing()
+        self.assertEquals(runtime.pressure, [(2, True)])
+
+        sender.transport.write = write
+        sender.resumeProducing()
+        self.assertEquals(runtime.pressure, [(2, True), (2, False)])
+        self.assertEquals(sender.congestion_count, 1)
+        self.assertTrue(sender.max_queued_bytes > 100)
+
+    def test_close_after_queue(self):
+        sender, receiver = connected_exchangers()
+        sender.pauseProducing()
+        sender.sendData((0, 1), 42, "foo")
+        sender.loseConnection()
+        self.assertFalse(sender.transport.disconnecting)
+        sender.resumeProducing()
+        self.assertTrue(sender.transport.disconnecting)
+
+
+class SendCapacityTest(RuntimeTestCase):
+
+    @protocol
+    def test_send_capacity(self, runtime):
+        runtime.send_pressure(2, True)
+        runtime.send_pressure(3, True)
+        capacity = runtime.send_capacity()
+        self.assertFalse(capacity.called)
+        runtime.send_pressure(2, False)
+        self.assertFalse(capacity.called)
+        runtime.send_pressure(3, False)
+        self.assertTrue(capacity.called)
+        self.assertTrue(runtime.send_capacity().called)
+        return capacity
+
+
+class ReceiveTest(TestCase):
+    """Test splitting of the received bytes into packets."""
+
+    def test_byte_by_byte(self):
+        sender, receiver = connected_exchangers()
+        sender.sendData((0, 1), 42, "foo")
+        sender.sendData((0, 1, 2), 42, "bar")
+        for byte in sender.transport.value():
+            receiver.dataReceived(byte)
+        self.assertEquals(receiver.incoming_data[((0, 1), 42)][0], "foo")
+        self.assertEquals(receiver.incoming_data[((0, 1, 2), 42)][0], "bar")
+        self.assertEquals(receiver._buffer, "")
+
+    def test_reentrant(self):
+        """Data received while delivering data is processed after
+        the current packet."""
+        sender, receiver = connected_exchangers()
+        sender.sendData((0, 1), 42, "foo")
+        first = sender.transport.value()
+        sender.transport.clear()
+        sender.sendData((0, 2), 42, "bar")
+        second = sender.transport.value()
+
+        received = []
+        def deliver_more(data):
+            received.append(data)
+            receiver.dataReceived(second)
+            # The second packet must wait for us to return.
+            self.assertEquals(receiver.incoming_data, {})
+        d = Deferred().addCallback(deliver_more)
+        receiver.waiting_deferreds[((0, 1), 42)] = deque([d])
+        receiver.dataReceived(first)
+        self.assertEquals(received, ["foo"])
+        self.assertEquals(receiver.incoming_data[((0, 2), 42)][0], "bar")
+
+    def test_bad_packet_aborts(self):
+        sender, receiver = connected_exchangers()
+        aborted = []
+        receiver.factory.runtime.abort = lambda p, e: aborted.append(p)
+        receiver.dataReceived(struct.pack("!HHHB", 5, 1, 10, 42))
+        self.assertEquals(aborted, [receiver])
+
+
+class EarlyDataTest(TestCase):
+    """Test the limit on data received before it is needed."""
+
+    def receive(self, options, *messages):
+        sender, receiver = connected_exchangers({}, options)
+        for i, data in enumerate(messages):
+            sender.sendData((0, i), 42, data)
+        transfer(sender, receiver)
+        return receiver
+
+    def test_pause_reading(self):
+        receiver = self.receive({"max_early_bytes": 10}, "a" * 6, "b" * 6)
+        self.assertTrue(receiver.reading_paused)
+        self.assertEquals(receiver.transport.producerState, "paused")
+        self.assertEquals(receiver.early_bytes, 12)
+        self.assertEquals(receiver.claim_data(((0, 0), 42)), "a" * 6)
+        # Reading resumes at half the limit.
+        self.assertTrue(receiver.reading_paused)
+        self.assertEquals(receiver.claim_data(((0, 1), 42)), "b" * 6)
+        self.assertFalse(receiver.reading_paused)
+        self.assertEquals(receiver.transport.producerState, "producing")
+        self.assertEquals(receiver.read_pause_count, 1)
+        self.assertEquals(receiver.peak_early_bytes, 12)
+
+    def test_no_pause_while_waiting(self):
+        sender, receiver = connected_exchangers({}, {"max_early_bytes": 10})
+        receiver.wait_for_data(((0, 9), 42), Deferred())
+        sender.sendData((0, 0), 42, "a" * 20)
+        transfer(sender, receiver)
+        self.assertFalse(receiver.reading_paused)
+
+    def test_waiting_resumes_reading(self):
+        receiver = self.receive({"max_early_bytes": 10}, "a" * 20)
+        self.assertTrue(receiver.reading_paused)
+        d = Deferred()
+        receiver.wait_for_data(((0, 9), 42), d)
+        self.assertFalse(receiver.reading_paused)
+        self.assertEquals(receiver.waiting_deferreds[((0, 9), 42)][0], d)
+
+    def test_spill(self):
+        directory = self.mktemp()
+        os.mkdir(directory)
+        options = {"max_early_bytes": 10, "spill_dir": directory}
+        receiver = self.receive(options, "a" * 6, "b" * 6, "c" * 6)
+        self.assertFalse(receiver.reading_paused)
+        self.assertEquals(receiver.spill_count, 2)
+        self.assertEquals(receiver.early_bytes, 6)
+        self.assertEquals(receiver.claim_data(((0, 2), 42)), "c" * 6)
+        self.assertEquals(receiver.claim_data(((0, 0), 42)), "a" * 6)
+        self.assertEquals(receiver.claim_data(((0, 1), 42)), "b" * 6)
+        self.assertEquals(receiver.early_bytes, 0)
+        self.assertEquals(receiver.spilled_bytes, 0)
+
+    def test_spill_shares(self):
+        directory = self.mktemp()
+        os.mkdir(directory)
+        options = {"max_early_bytes": 0, "spill_dir": directory}
+        sender, receiver = connected_exchangers({}, options)
+        field = GF(1031)
+        sender.sendShare((0, 1), field(1000))
+        sender.sendShare((0, 2), field(7))
+        transfer(sender, receiver)
+        self.assertEquals(receiver.spill_count, 2)
+        self.assertEquals(receiver.claim_data(((0, 1), SHARE)), 1000)
+        self.assertEquals(receiver.claim_data(((0, 2), SHARE)), 7)
+
+    def test_key_times(self):
+        receiver = self.receive({"stale_report": 10}, "foo")
+        self.assertEquals(receiver.key_times.keys(), [((0, 0), 42)])
+        receiver.claim_data(((0, 0), 42))
+        self.assertEquals(receiver.key_times, {})
+
+    def test_no_key_times(self):
+        receiver = self.receive({}, "foo")
+        self.assertEquals(receiver.key_times, {})
+
+
+class StaleKeysTest(RuntimeTestCase):
+
+    runtime_options = {"stale_report": 60}
+
+    @protocol
+    def test_stale_keys(self, runtime):
+        """Data sent and expected with mismatched program counters
+        is reported."""
+        peers = [peer_id for peer_id in runtime.players
+                 if peer_id != runtime.id]
+        for peer_id in peers:
+            runtime._expect_data_with_pc((0, 999), peer_id, TEXT, Deferred())
+            runtime.protocols[peer_id].sendData((1, 999), TEXT, "lost")
+
+        def check(_):
+            stale = runtime.stale_keys(-1)
+            self.assertEquals(sorted([(peer_id, pc, state)
+                                      for _, peer_id, pc, _, state in stale]),
+                              sorted([(peer_id, (0, 999), "waiting")
+                                      for peer_id in peers] +
+                                     [(peer_id, (1, 999), "unclaimed")
+                                      for peer_id in peers]))
+            self.assertEquals(runtime.stale_keys(60), [])
+
+        # The packets sent above arrive before the synchronization.
+        result = runtime.synchronize()
+        result.addCallback(check)
+        return result
+
+
+def free_port():
+    """Return a TCP port which is currently not in use."""
+    sock = socket.socket()
+    sock.bind(("localhost", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+class EarlyDataBackpressureTest(RuntimeTestCase):
+    """Test the limit on early data together with congestion."""
+
+    num_players = 2
+
+    #: Reading pauses after 1000 bytes of early data and any data
+    #: queued for sending makes a peer congested.
+    runtime_options = {"max_early_bytes": 1000, "send_high_watermark": 0,
+                       "send_low_watermark": 0}
+
+    loopback_window = 1000
+
+    @protocol
+    def test_both_limits(self, runtime):
+        """The players stop reading from each other while they are
+        congested, but still get their data."""
+        peer_id = 3 - runtime.id
+        protocol = runtime.protocols[peer_id]
+        data = "x" * 100
+        count = 100
+        sync = runtime.synchronize()
+        # Data the peer only asks for after the synchronization.
+        for i in range(count):
+            protocol.sendData((10000, i), TEXT, data, runtime)
+
+        def receive(_):
+            received = []
+            for i in range(count):
+                d = Deferred()
+                runtime._expect_data_with_pc((10000, i), peer_id, TEXT, d)
+                received.append(d)
+            return gatherResults(received)
+
+        def check(results):
+            self.assertEquals(results, [data] * count)
+            if runtime.using_viff_reactor:
+                self.assertTrue(protocol.read_pause_count > 0)
+                self.assertTrue(protocol.congestion_count > 0)
+
+        runtime.schedule_callback(sync, receive)
+        sync.addCallback(check)
+        return sync
+
+
+class CreateRuntimeTest(TestCase):
+    """Test connecting players with :func:`create_runtime`."""
+
+    def create_runtimes(self, ids, count, network={}, **overrides):
+        """Start players *ids* of *count* players on this host. The
+        *network* maps player IDs to emulated link settings."""
+        parser = OptionParser()
+        Runtime.add_options(parser)
+        options = parser.get_default_values()
+        options.ssl = False
+        for name, value in overrides.iteritems():
+            setattr(options, name, value)
+
+        ports = [free_port() for _ in range(count)]
+        results = []
+        for id in ids:
+            players = dict([(i, Player(i, "localhost", ports[i - 1], None))
+                            for i in range(1, count + 1)])
+            for i, settings in network.iteritems():
+                players[i].network = settings
+            results.append(create_runtime(id, players, 1, options, Runtime))
+        return results
+
+    def close(self, runtimes):
+        closed = []
+        for runtime in runtimes:
+            closed.append(runtime.port.stopListening())
+            if runtime.unix_port is not None:
+                closed.append(runtime.unix_port.stopListening())
+            for peer_id, protocol in runtime.protocols.iteritems():
+                if peer_id != runtime.id:
+                    closed.append(protocol.lost_connection)
+                    protocol.loseConnection()
+        return DeferredList(closed)
+
+    def test_connection_times(self):
+        def check(runtimes):
+            for runtime in runtimes:
+                self.assertEquals(sorted(runtime.connection_times),
+                                  sorted(set([1, 2, 3]) - set([runtime.id])))
+            return self.close(runtimes)
+        results = self.create_runtimes([1, 2, 3], 3)
+        return gatherResults(results).addCallback(check)
+
+    def test_ready_timeout(self):
+        # Player 2 never shows up.
+        result, = self.create_runtimes([1], 2, ready_timeout=0.1)
+        return self.assertFailure(result, TimeoutError)
+
+    def test_no_socket_retry(self):
+        blocker = reactor.listenTCP(0, ServerFactory())
+        self.addCleanup(blocker.stopListening)
+        port = blocker.getHost().port
+        parser = OptionParser()
+        Runtime.add_options(parser)
+        options = parser.get_default_values()
+        options.ssl = False
+        options.no_socket_retry = True
+        players = {1: Player(1, "localhost", port, None),
+                   2: Player(2, "localhost", free_port(), None)}
+        result = create_runtime(1, players, 1, options, Runtime)
+        return self.assertFailure(result, CannotListenError)
+
+    def test_listen_after_ready(self):
+        """Listening is retried when the players connect first."""
+        # Player 1 connects to player 2, so it can be ready before it
+        # listens itself.
+        blocker = reactor.listenTCP(0, ServerFactory())
+        port = blocker.getHost().port
+        parser = OptionParser()
+        Runtime.add_options(parser)
+        options = parser.get_default_values()
+        options.ssl = False
+        players = {1: Player(1, "localhost", port, None),
+                   2: Player(2, "localhost", free_port(), None)}
+        results = [create_runtime(i, players, 1, options, Runtime)
+                   for i in 1, 2]
+
+        def retry(runtimes):
+            self.assertEquals(runtimes[0].port, None)
+            calls = [call for call in reactor.getDelayedCalls()
+                     if call.func.__name__ == "try_listen"]
+            self.assertEquals(len(calls), 1)
+            d = blocker.stopListening()
+            d.addCallback(lambda _: deferLater(reactor, calls[0].getTime() -
+                                               reactor.seconds() + 0.1,
+                                               check, runtimes))
+            return d
+
+        def check(runtimes):
+            self.assertNotEquals(runtimes[0].port, None)
+            return self.close(runtimes)
+        return gatherResults(results).addCallback(retry)
+
+    def test_emulated_network(self):
+        def check((runtime1, runtime2)):
+            link = runtime1.protocols[2].transport
+            self.assertTrue(isinstance(link, EmulatedTransport))
+            self.assertEquals(link.latency, 0.005)
+            self.assertEquals(runtime2.protocols[1].transport.latency, 0.001)
+            return self.close([runtime1, runtime2])
+        results = self.create_runtimes([1, 2], 2, network={2: {"latency": 5}},
+                                       net_latency=1)
+        return gatherResults(results).addCallback(check)
+
+    def test_large_message_when_ready(self):
+        """Data larger than a packet can be sent as soon as the
+        runtime is ready, before the HELLO of the peer is handled."""
+        data = "".join([chr(i % 256) for i in xrange(100000)])
+
+        def send(runtime):
+            runtime.protocols[3 - runtime.id].sendData((0, 1), TEXT, data)
+            return runtime
+
+        def receive(runtimes):
+            if runtimes[0].using_viff_reactor:
+                # Both players share the reactor, see RuntimeTestCase.
+                def loop_call():
+                    for runtime in runtimes:
+                        runtime.process_deferred_queue()
+                reactor.setLoopCall(loop_call)
+            received = []
+            for runtime in runtimes:
+                d = Deferred()
+                d.addCallback(self.assertEquals, data)
+                runtime._expect_data_with_pc((0, 1), 3 - runtime.id, TEXT, d)
+                received.append(d)
+            result = gatherResults(received)
+            return result.addCallback(lambda _: self.close(runtimes))
+
+        results = self.create_runtimes([1, 2], 2)
+        for result in results:
+            result.addCallback(send)
+        return gatherResults(results).addCallback(receive)
+
+    def test_unix_sockets(self):
+        socket_dir = self.mktemp()
+        os.mkdir(socket_dir)
+
+        def check(runtimes):
+            for runtime in runtimes:
+                protocol = runtime.protocols[3 - runtime.id]
+                self.assertTrue(isinstance(protocol.transport.getPeer(),
+                                           UNIXAddress))
+            return self.close(runtimes)
+        results = self.create_runtimes([1, 2], 2, unix_sockets=True,
+                                       socket_dir=socket_dir)
+        return gatherResults(results).addCallback(check)
+
+
+class BatchedRuntimeTest(test_runtime.RuntimeTest):
+    """Run the runtime tests with batching enabled."""
+
+    runtime_options = {"batch_messages": True}
+
+
+class LegacyWireFormatRuntimeTest(test_runtime.RuntimeTest):
+    """Run the runtime tests with the original wire format."""
+
+    runtime_options = {"binary_shares": False, "compact_pc": False}
+
+
+class TrafficStatisticsTest(RuntimeTestCase):
+
+    @protocol
+    def test_operations(self, runtime):
+        sync = runtime.synchronize()
+
+        def compute(_):
+            a = runtime.prss_share_random(self.Zp)
+            b = runtime.prss_share_random(self.Zp)
+            return gatherResults([runtime.open(a), runtime.open(a * b)])
+
+        def check(_):
+            statistics = runtime.traffic_statistics()
+            operations = statistics["operations"]
+            self.assertEquals(sorted(operations), ["mul", "open", "other"])
+            # Each player sends a share to the two others.
+            self.assertEquals(operations["open"]["messages"], 4)
+            self.assertEquals(operations["mul"]["messages"], 2)
+            data_types = statistics["data_types"]
+            # The synchronization sends shares too.
+            self.assertEquals(data_types["SHARE"]["messages"], 8)
+            self.assertTrue(data_types["SHARE"]["header_bytes"] > 0)
+            self.assertEquals(sorted(statistics["peers"]),
+                              sorted(set([1, 2, 3]) - set([runtime.id])))
+        runtime.schedule_callback(sync, compute)
+        sync.addCallback(check)
+        return sync
+
+    def test_operation_in_callback(self):
+        """Callbacks scheduled by an operation are accounted to it."""
+        class FakeRuntime(Runtime):
+            def __init__(self):
+                self.operation = None
+                self.program_counter = (0,)
+
+            @operation
+            def outer(self, deferred):
+                self.inner()
+                self.schedule_callback(deferred, lambda _: self.operation)
+                return deferred
+
+            @operation
+            def inner(self):
+                self.assertion = self.operation
+
+        runtime = FakeRuntime()
+        d = runtime.outer(Deferred())
+        self.assertEquals(runtime.assertion, "outer")
+        self.assertEquals(runtime.operation, None)
+        d.callback(None)
+        d.addCallback(self.assertEquals, "outer")
+        return d
+
+
+class BatchedStatisticsTest(RuntimeTestCase):
+
+    runtime_options = {"batch_messages": True}
+
+    @protocol
+    def test_opens_are_batched(self, runtime):
+        # Features are enabled when the HELLO packets arrive, which
+        # is no later than the data for the synchronization.
+        sync = runtime.synchronize()
+        sent = {}
+
+        def open_shares(_):
+            for peer_id, protocol in runtime.protocols.iteritems():
+                sent[peer_id] = (protocol.sent_messages, protocol.sent_packets)
+            shares = [runtime.prss_share_random(self.Zp) for _ in range(10)]
+            return gatherResults([runtime.open(share) for share in shares])
+
+        def check(_):
+            for peer_id, protocol in runtime.protocols.iteritems():
+                if peer_id != runtime.id:
+                    messages, packets = sent[peer_id]
+                    self.assertEquals(protocol.sent_messages - messages, 10)
+                    self.assertTrue(protocol.sent_packets - packets < 10)
+        runtime.schedule_callback(sync, open_shares)
+        sync.addCallback(check)
+        return sync
+
+
+class BatchedSharesStatisticsTest(RuntimeTestCase):
+
+    runtime_options = {"batch_shares": True}
+
+    @protocol
+    def test_sessions(self, runtime):
+        """The shares of a batch are accounted to the sessions which
+        sent them."""
+        sync = runtime.synchronize()
+
+        def open_shares(_):
+            for peer_id, protocol in runtime.protocols.iteritems():
+                if peer_id != runtime.id:
+                    self.assertTrue(protocol.batch_shares)
+            first = runtime.open_session(1)
+            second = runtime.open_session(2)
+            results = [first.open(Share(first, self.Zp, self.Zp(1))),
+                       second.open(Share(second, self.Zp, self.Zp(2))),
+                       second.open(Share(second, self.Zp, self.Zp(3)))]
+            result = gatherResults(results)
+            result.addCallback(check, first, second)
+            result.addCallback(lambda _: gatherResults(
+                    [runtime.close_session(1), runtime.close_session(2)]))
+            return result
+
+        def check(_, first, second):
+            peers = runtime.num_players - 1
+            for session, opens in [(first, 1), (second, 2)]:
+                operations = session.traffic_statistics()["operations"]
+                self.assertEquals(sorted(operations), ["open"])
+                self.assertEquals(operations["open"]["messages"],
+                                  opens * peers)
+                self.assertTrue(operations["open"]["header_bytes"] > 0)
+            self.assertFalse("open" in
+                             runtime.traffic_statistics()["operations"])
+        runtime.schedule_callback(sync, open_shares)
+        return sync
@@ -0,0 +1,125 @@
+# Copyright 2008 VIFF Development Team.
+#
+# This file is part of VIFF, the Virtual Ideal Functionality Framework.
+#
+# VIFF is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Lesser General Public License (LGPL) as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# VIFF is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY
+# or FITNESS FOR A PARTICULAR PURPOSE. See the GNU Lesser General
+# Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with VIFF. If not, see <http://www.gnu.org/licenses/>.
+
+"""Tests for the elementwise operations on share vectors."""
+
+from viff.runtime import Share, ShareVector, gather_vector
+from viff.runtimes.active import ActiveRuntime
+from viff.test.util import RuntimeTestCase, protocol
+
+
+class ShareVectorTest(RuntimeTestCase):
+    """Tests the share vector operations of the passive runtime."""
+
+    def vectors(self, runtime):
+        """Return share vectors of [1, 2, 3] and [4, 5, 6].
+
+        The sharings are the polynomials x + id and x + 2 id."""
+        a = ShareVector(runtime, self.Zp, 3,
+                        [self.Zp(x + runtime.id) for x in [1, 2, 3]])
+        b = ShareVector(runtime, self.Zp, 3,
+                        [self.Zp(x + 2 * runtime.id) for x in [4, 5, 6]])
+        return a, b
+
+    def check(self, runtime, vector, expected):
+        self.assert_type(vector, ShareVector)
+        opened = runtime.vector_open(vector)
+        self.assert_type(opened, ShareVector)
+        opened.addCallback(self.assertEquals, expected)
+        return opened
+
+    @protocol
+    def test_gather_vector(self, runtime):
+        """Gather shares into a vector and open it."""
+        shares = [Share(runtime, self.Zp, self.Zp(x + runtime.id))
+                  for x in [7, 8]]
+        vector = gather_vector(shares)
+        self.assertEquals(vector.size, 2)
+        return self.check(runtime, vector, [7, 8])
+
+    @protocol
+    def test_add(self, runtime):
+        a, b = self.vectors(runtime)
+        return self.check(runtime, a + b, [5, 7, 9])
+
+    @protocol
+    def test_add_constants(self, runtime):
+        a, _ = self.vectors(runtime)
+        return self.check(runtime, [10, 20, 30] + a, [11, 22, 33])
+
+    @protocol
+    def test_sub(self, runtime):
+        a, b = self.vectors(runtime)
+        return self.check(runtime, b - a, [3, 3, 3])
+
+    @protocol
+    def test_sub_constant(self, runtime):
+        a, _ = self.vectors(runtime)
+        return self.check(runtime, 10 - a, [9, 8, 7])
+
+    @protocol
+    def test_scale(self, runtime):
+        a, _ = self.vectors(runtime)
+        return self.check(runtime, 3 * a, [3, 6, 9])
+
+    @protocol
+    def test_lin_comb(self, runtime):
+        a, b = self.vectors(runtime)
+        return self.check(runtime, runtime.vector_lin_comb([2, 3], [a, b]),
+                          [14, 19, 24])
+
+    @protocol
+    def test_mul(self, runtime):
+        a, b = self.vectors(runtime)
+        return self.check(runtime, a * b, [4, 10, 18])
+
+    @protocol
+    def test_open_sends_one_message(self, runtime):
+        """The whole vector is opened with one message per peer."""
+
+        def messages():
+            peers = runtime.traffic_statistics()["peers"]
+            return sum([peer["messages"] for peer in peers.itervalues()])
+
+        a, _ = self.vectors(runtime)
+        before = messages()
+        opened = runtime.vector_open(a)
+        self.assertEquals(messages() - before, runtime.num_players - 1)
+        opened.addCallback(self.assertEquals, [1, 2, 3])
+        return opened
+
+    @protocol
+    def test_open_receivers(self, runtime):
+        a, _ = self.vectors(runtime)
+        opened = runtime.vector_open(a, receivers=[1])
+        if runtime.id == 1:
+            opened.addCallback(self.assertEquals, [1, 2, 3])
+            return opened
+        else:
+            self.assertEquals(opened, None)
+
+
+class ActiveShareVectorTest(ShareVectorTest):
+    """Runs the share vector tests with the active runtime."""
+
+    #: Number of players.
+    #:
+    #: The protocols for active security needs n > 3t+1, so with the
+    #: default threshold of t=1, we need n=4.
+    num_players = 4
+
+    runtime_class = ActiveRuntime
@@ -17,6 +17,7 @@
 
 """Utility functions and classes used for testing."""
 
+from optparse import OptionParser
 from random import Random
 
 from twisted.internet import reactor
@@ -25,7 +26,7 @@ from twisted.trial.unittest import TestCase
 
 from viff.config import generate_configs, load_config
 from viff.math.field import GF
-from viff.reactor import ViffReactor
+from viff.reactor import ViffReactorMixin
 from viff.runtime import Share, ShareExchanger, ShareExchangerFactory, SelfShareExchanger, SelfShareExchangerFactory, \
     FakeTransport
 from viff.runtimes.passive import PassiveRuntime
@@ -96,6 +97,11 @@ class RuntimeTestCase(TestCase):
     threshold = 1
     #: Default Runtime class to instantiate.
     runtime_class = PassiveRuntime
+    #: Runtime options which should differ from the defaults.
+    runtime_options = {}
+    #: Bytes a player can send before it must wait for the peer to
+    #: read them, see :func:`viff.test.loopback.loopbackAsync`.
+    loopback_window = None
 
     #: A dictionary mapping player ids to pseudorandom generators.
     #:
@@ -144,7 +150,7 @@ class RuntimeTestCase(TestCase):
             _, players = load_config(configs[id])
             self.create_loopback_runtime(id, players)
 
-        if isinstance(reactor, ViffReactor):
+        if isinstance(reactor, ViffReactorMixin):
             def set_loop_call(runtimes):
                 self.i = 0
 
@@ -179,6 +185,21 @@ class RuntimeTestCase(TestCase):
         for protocol in self.protocols.itervalues():
             protocol.transport.close()
 
+    def make_options(self):
+        """Create runtime options with :attr:`runtime_options` applied.
+
+        Returns :const:`None` if no options are overridden, which
+        gives the runtime its default options.
+        """
+        if not self.runtime_options:
+            return None
+        parser = OptionParser()
+        self.runtime_class.add_options(parser)
+        options = parser.get_default_values()
+        for name, value in self.runtime_options.iteritems():
+            setattr(options, name, value)
+        return options
+
     def create_loopback_runtime(self, id, players):
         """Create a L{Runtime} connected with a loopback.
 
@@ -194,7 +215,8 @@ class RuntimeTestCase(TestCase):
         # Create a runtime that knows about no other players than itself.
         # It will eventually be returned in result when the factory has
         # determined that all needed protocols are ready.
-        runtime = self.runtime_class(players[id], self.threshold)
+        runtime = self.runtime_class(players[id], self.threshold,
+                                     self.make_options())
         factory = ShareExchangerFactory(runtime, players, result)
         # We add the Deferred passed to ShareExchangerFactory and not
         # the Runtime, since we want everybody to wait until all
@@ -222,7 +244,8 @@ class RuntimeTestCase(TestCase):
                     # forth, and when both sides has closed the
                     # connection, then the returned Deferred will
                     # fire.
-                    sentinel = loopbackAsync(server, client)
+                    sentinel = loopbackAsync(server, client,
+                                             self.loopback_window)
                     self.close_sentinels.append(sentinel)
             else:
                 protocol = SelfShareExchanger(id, SelfShareExchangerFactory(runtime))
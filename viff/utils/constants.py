@@ -30,3 +30,16 @@ INCONSISTENTHASH = 6
 OK = 7
 HASH = 8
 SIGNAL = 9
+
+# Used by PassiveRuntime.open_many
+SHARE_VECTOR = 10
+
+# Used by the ShareExchanger itself, these are never delivered to the
+# runtime. They are allocated from the top to leave room for protocol
+# specific data types.
+BATCH = 255
+HELLO = 254
+BINARY_SHARE = 253
+CHUNK = 252
+COMPRESSED = 251
+SHARE_BATCH = 250
@@ -353,6 +353,31 @@ def profile(method):
     return profile_wrapper
 
 
+def operation(method):
+    """Traffic accounting decorator.
+
+    Data sent while the decorated :class:`Runtime
+    <viff.runtime.Runtime>` method runs, or by callbacks it schedules
+    with :meth:`~viff.runtime.Runtime.schedule_callback`, is accounted
+    to the name of the method. Operations nested inside another
+    operation are accounted to the outermost one. See
+    :meth:`~viff.runtime.Runtime.traffic_statistics`.
+    """
+    name = method.__name__
+
+    @wrapper(method)
+    def operation_wrapper(self, *args, **kwargs):
+        if self.operation is not None:
+            return method(self, *args, **kwargs)
+        self.operation = name
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self.operation = None
+
+    return operation_wrapper
+
+
 def memory_usage():
     """Read memory usage of the current process."""
     status = None